@@ -1,12 +1,15 @@
 """Handles the automatic file (.automatic.yml)."""
 
+import pickle
+import re
 from enum import Enum
-from typing import Dict, List
-
-from ruamel.yaml import YAML
+from hashlib import sha256
+from typing import Dict, List, Optional, Union
 
 from .config import settings
 from .exceptions import AutomaticEntryError
+from .schedule import parse_schedule
+from .state import atomic_write
 
 
 class EntryType(Enum):
@@ -26,10 +29,95 @@ ATTRS_TYPES = {
     "zip": bool,
     "zipname": str,
     "filter": str,
+    "max_size": (str, int, float),
+    "min_size": (str, int, float),
+    "newer_than": (str, int, float),
+    "older_than": (str, int, float),
+    "owner": (str, int),
+    "schedule": str,
 }
 VALID_ATTRS = set(ATTRS_TYPES.keys())
 
 
+def _type_names(attr_type) -> str:
+    if not isinstance(attr_type, tuple):
+        return repr(attr_type.__name__)
+    names = [repr(x.__name__) for x in attr_type]
+    return ", ".join(names[:-1]) + " or " + names[-1]
+
+
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_SIZE_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*$", re.IGNORECASE)
+_AGE_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$", re.IGNORECASE)
+
+
+def parse_size(size: Union[str, int, float, None]) -> Optional[int]:
+    """Parses a file size, like `'100MB'` or `'1.5 GiB'`.
+
+    Units are case insensitive and multiples of 1024. A number without
+    unit is a size in bytes.
+
+    Args:
+        size (Union[str, int, float, None]): size to parse.
+
+    Raises:
+        ValueError: if `size` is not a valid size.
+
+    Returns:
+        Optional[int]: size in bytes, or None if `size` is None.
+    """
+
+    if size is None:
+        return None
+
+    match = _SIZE_REGEX.match(str(size))
+    if not match:
+        raise ValueError(f"Invalid size: {size!r}")
+
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.lower()])
+
+
+def parse_age(age: Union[str, int, float, None]) -> Optional[float]:
+    """Parses a time span, like `'7d'` or `'12h'`.
+
+    Valid units are `s` (seconds), `m` (minutes), `h` (hours), `d` (days)
+    and `w` (weeks). A number without unit is a time span in seconds.
+
+    Args:
+        age (Union[str, int, float, None]): time span to parse.
+
+    Raises:
+        ValueError: if `age` is not a valid time span.
+
+    Returns:
+        Optional[float]: time span in seconds, or None if `age` is None.
+    """
+
+    if age is None:
+        return None
+
+    match = _AGE_REGEX.match(str(age))
+    if not match:
+        raise ValueError(f"Invalid time span: {age!r}")
+
+    number, unit = match.groups()
+    return float(number) * _AGE_UNITS[unit.lower()]
+
+
+# Must be increased every time the validated attributes change
+COMPILED_CACHE_VERSION = 2
+
+ATTRS_PARSERS = {
+    "max_size": parse_size,
+    "min_size": parse_size,
+    "newer_than": parse_age,
+    "older_than": parse_age,
+    "schedule": parse_schedule,
+}
+
+
 class BackupEntry:
     """Represents an entry in .automatic.yml
 
@@ -52,6 +140,23 @@ class BackupEntry:
             By default is `'.'`, which is a regex for match anything. It is
             encouraged to check the regex before creating the first backup.
             To check the regex check README). Defaults to '.'.
+        max_size (Union[str, int, float], optional): if the type is
+            `multiple-files`, only files up to this size (like `'100MB'`, or a
+            number of bytes) are selected. Defaults to None.
+        min_size (Union[str, int, float], optional): if the type is
+            `multiple-files`, only files of at least this size are selected.
+            Defaults to None.
+        newer_than (Union[str, int, float], optional): if the type is
+            `multiple-files`, only files modified within this time span (like
+            `'7d'`, or a number of seconds) are selected. Defaults to None.
+        older_than (Union[str, int, float], optional): if the type is
+            `multiple-files`, only files not modified within this time span
+            are selected. Defaults to None.
+        owner (Union[str, int], optional): if the type is `multiple-files`,
+            only files owned by this user (name or uid) are selected.
+            Defaults to None.
+        schedule (str, optional): cron expression (like `'0 3 * * *'`) of the
+            times the `daemon` backs up the entry. Defaults to None.
     """
 
     def __init__(
@@ -63,6 +168,12 @@ class BackupEntry:
         zip=False,
         zipname=None,
         filter=".",
+        max_size=None,
+        min_size=None,
+        newer_than=None,
+        older_than=None,
+        owner=None,
+        schedule=None,
     ):
 
         self.name = name
@@ -72,6 +183,12 @@ class BackupEntry:
         self.zip = zip
         self.zipname = zipname
         self.filter = filter
+        self.max_size = parse_size(max_size)
+        self.min_size = parse_size(min_size)
+        self.newer_than = parse_age(newer_than)
+        self.older_than = parse_age(older_than)
+        self.owner = owner
+        self.schedule = parse_schedule(schedule)
 
     def __repr__(self):
         attrs = vars(self).__repr__()
@@ -81,16 +198,62 @@ class BackupEntry:
 def get_automatic_entries() -> List[BackupEntry]:
     """Parses the automatic entries file and returns a list of BackupEntries.
 
+    The validated attributes of the entries are compiled into a snapshot,
+    stored in `settings.automatic_cache_path`. While the automatic file
+    doesn't change (same modification time and size, or same sha256 hash),
+    the entries are loaded from the snapshot, skipping the YAML parsing and
+    the validation.
+
     Returns:
         List[BackupEntry]: backup entries parsed.
     """
 
-    automatic_entries_dict = YAML(typ="safe").load(settings.automatic_path.read_text())
+    return [BackupEntry(**attrs) for attrs in _get_compiled_entries()]
+
+
+def _get_compiled_entries() -> List[Dict[str, str]]:
+    stat_result = settings.automatic_path.stat()
+    try:
+        snapshot = pickle.loads(settings.automatic_cache_path.read_bytes())
+        if snapshot["version"] != COMPILED_CACHE_VERSION:
+            snapshot = None
+    except Exception:  # pylint: disable=broad-except
+        snapshot = None
+
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    if snapshot and snapshot["stat"] == key:
+        return snapshot["entries"]
+
+    data = settings.automatic_path.read_bytes()
+    digest = sha256(data).hexdigest()
+
+    if snapshot and snapshot["sha256"] == digest:
+        entries = snapshot["entries"]
+    else:
+        entries = _parse_entries(data)
+
+    snapshot = {
+        "version": COMPILED_CACHE_VERSION,
+        "stat": key,
+        "sha256": digest,
+        "entries": entries,
+    }
+    try:
+        atomic_write(settings.automatic_cache_path, pickle.dumps(snapshot, -1))
+    except OSError:
+        pass
+
+    return entries
+
+
+def _parse_entries(data: bytes) -> List[Dict[str, str]]:
+    from ruamel.yaml import YAML
+
+    automatic_entries_dict = YAML(typ="safe").load(data.decode("utf-8"))
 
     entries = []
     for name, yaml_entry in automatic_entries_dict.items():
-        result = check_yaml_entry(name=name, **yaml_entry)
-        entries.append(BackupEntry(**result))
+        entries.append(check_yaml_entry(name=name, **yaml_entry))
     return entries
 
 
@@ -108,6 +271,7 @@ def check_yaml_entry(**yaml_entry: Dict[str, str]) -> Dict[str, str]:
         TypeError: if any attribute it's not the type it should be.
         AutomaticEntryError: if entry type is multiple-files, zip is True
             and zipname is not defiend.
+        AutomaticEntryError: if a size or a time span is not valid.
 
     Returns:
         Dict[str, str]: attributes parsed.
@@ -138,13 +302,13 @@ def check_yaml_entry(**yaml_entry: Dict[str, str]) -> Dict[str, str]:
     def check_attr(key, required):
         attr_type = ATTRS_TYPES[key]
 
-        if result.get(key) or required:
+        if result.get(key) is not None or required:
             if not isinstance(result[key], attr_type):
                 real_type = type(result.get(key)).__name__
                 msg = ""
                 if not required:
                     msg += "If defined, "
-                msg += f"{key!r} must be {attr_type.__name__!r}, not {real_type!r}"
+                msg += f"{key!r} must be {_type_names(attr_type)}, not {real_type!r}"
 
                 raise TypeError(msg)
 
@@ -158,4 +322,10 @@ def check_yaml_entry(**yaml_entry: Dict[str, str]) -> Dict[str, str]:
         if not result.get("zipname"):
             raise AutomaticEntryError("Must provide 'zipname' if zip=True")
 
+    for attribute, parser in ATTRS_PARSERS.items():
+        try:
+            parser(result.get(attribute))
+        except ValueError as exc:
+            raise AutomaticEntryError(f"Invalid {attribute!r}: {exc}") from exc
+
     return result
@@ -0,0 +1,389 @@
+"""End to end benchmark of create_backup, run against the Drive emulator."""
+
+import json
+import platform
+import sys
+from contextlib import contextmanager
+from math import log as ln
+from multiprocessing import get_context
+from pathlib import Path
+from random import Random
+from time import perf_counter, process_time
+from typing import Dict, List, Optional
+
+from . import __version__
+
+DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+FILES_PER_DIR = 100
+LOGNORMAL_SIGMA = 1.0
+RANDOM_BLOCK_SIZE = 1024**2
+
+# Metrics compared against the baseline, and whether a higher value is better.
+COMPARED_METRICS = {
+    "throughput_bytes": True,
+    "throughput_files": True,
+    "wall_time": False,
+    "cpu_time": False,
+    "peak_rss": False,
+    "latency_p50": False,
+    "latency_p90": False,
+    "latency_p99": False,
+}
+
+
+class Workload:
+    """Reproducible set of files to back up.
+
+    The same arguments always create the same files.
+
+    Args:
+        files (int): number of files.
+        size (int): mean size of the files, in bytes.
+        distribution (str, optional): distribution of the sizes, `fixed`,
+            `uniform` (between 0 and twice `size`) or `lognormal`. Defaults
+            to `fixed`.
+        compressibility (float, optional): ratio of every file filled with
+            zeros, the rest is random data. Defaults to 0.5.
+        zip (bool, optional): if True, the files are backed up in a single
+            zip file. Otherwise, they are uploaded one by one. Defaults
+            to False.
+        seed (int, optional): seed of the sizes and contents. Defaults to 0.
+
+    Raises:
+        ValueError: if any argument is out of range.
+    """
+
+    def __init__(
+        self,
+        files: int,
+        size: int,
+        distribution: str = "fixed",
+        compressibility: float = 0.5,
+        zip: bool = False,  # pylint: disable=redefined-builtin
+        seed: int = 0,
+    ):
+        if files < 1:
+            raise ValueError(f"Invalid number of files: {files!r}")
+        if size < 0:
+            raise ValueError(f"Invalid size: {size!r}")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Invalid distribution: {distribution!r}")
+        if not 0 <= compressibility <= 1:
+            raise ValueError(f"Invalid compressibility: {compressibility!r}")
+
+        self.files = files
+        self.size = size
+        self.distribution = distribution
+        self.compressibility = compressibility
+        self.zip = zip
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        """Returns the arguments of the workload."""
+        return dict(vars(self))
+
+    def sizes(self) -> List[int]:
+        """Returns the size of each file, in bytes."""
+
+        rng = Random(self.seed)
+        if self.distribution == "fixed":
+            return [self.size] * self.files
+        if self.distribution == "uniform":
+            return [rng.randint(0, 2 * self.size) for _ in range(self.files)]
+
+        # The mean of a lognormal distribution is exp(mu + sigma ** 2 / 2).
+        if not self.size:
+            return [0] * self.files
+        mu = ln(self.size) - LOGNORMAL_SIGMA**2 / 2
+        return [int(rng.lognormvariate(mu, LOGNORMAL_SIGMA)) for _ in range(self.files)]
+
+    def create(self, root: Path) -> int:
+        """Creates the files of the workload.
+
+        Files are spread in folders of `FILES_PER_DIR` files.
+
+        Args:
+            root (Path): folder to create the files into.
+
+        Returns:
+            int: total size of the files, in bytes.
+        """
+
+        rng = Random(self.seed)
+        block = rng.getrandbits(8 * RANDOM_BLOCK_SIZE).to_bytes(
+            RANDOM_BLOCK_SIZE, "little"
+        )
+        zeros_block = bytes(RANDOM_BLOCK_SIZE)
+
+        total = 0
+        for index, size in enumerate(self.sizes()):
+            folder = Path(root).joinpath(f"dir-{index // FILES_PER_DIR}")
+            if index % FILES_PER_DIR == 0:
+                folder.mkdir(parents=True, exist_ok=True)
+
+            zeros = int(size * self.compressibility)
+            offset = rng.randrange(RANDOM_BLOCK_SIZE)
+            path = folder.joinpath(f"file-{index}.dat")
+            with path.open("wb") as file_handler:
+                _write_repeated(file_handler, block, offset, size - zeros)
+                _write_repeated(file_handler, zeros_block, 0, zeros)
+            total += size
+        return total
+
+
+def _write_repeated(file_handler, block: bytes, offset: int, size: int):
+    # Writes `size` bytes of `block` repeated, starting at `offset`, one block
+    # at a time.
+    view = memoryview(block)
+    chunk = view[offset : offset + size]
+    while chunk:
+        file_handler.write(chunk)
+        size -= len(chunk)
+        chunk = view[:size]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Returns a percentile of `values`, interpolating between samples.
+
+    Args:
+        values (List[float]): samples.
+        percent (float): percentile, between 0 and 100.
+
+    Returns:
+        float: percentile of the samples, or 0 if there are no samples.
+    """
+
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def get_peak_rss() -> Optional[int]:
+    """Returns the peak resident set size of the current process, in bytes.
+
+    Returns:
+        Optional[int]: peak RSS, or None if the platform doesn't report it.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_bench(
+    workload: Workload, workdir: Path, latency: float = 0, bandwidth: float = 0
+) -> dict:
+    """Runs create_backup on a workload, uploading to a local Drive emulator.
+
+    The backup runs in a new process, with its own settings, so it uses its
+    own root path inside `workdir` and doesn't touch the real backups. Its
+    peak RSS doesn't include the creation of the workload nor the emulator,
+    which keeps only the size and md5 of the uploads.
+
+    Args:
+        workload (Workload): files to back up.
+        workdir (Path): folder to create the files and the root path into.
+        latency (float, optional): seconds added to every API request.
+            Defaults to 0.
+        bandwidth (float, optional): bandwidth of the emulator, in bytes per
+            second, 0 for unlimited. Defaults to 0.
+
+    Returns:
+        dict: report of the benchmark.
+    """
+
+    from .emulator import DriveEmulator
+
+    workdir = Path(workdir)
+    data_path = workdir.joinpath("data")
+    root_path = workdir.joinpath("root")
+    total_size = workload.create(data_path)
+
+    root_path.mkdir(parents=True, exist_ok=True)
+    root_path.joinpath("credentials.json").write_text("{}")
+    entry = {
+        "type": "multiple-files",
+        "root_path": data_path.as_posix(),
+        "cloud_folder_id": "root",
+        "zip": workload.zip,
+        "zipname": "bench.zip",
+    }
+    # JSON is valid YAML.
+    root_path.joinpath(".automatic.yml").write_text(json.dumps({"bench": entry}))
+
+    emulator = DriveEmulator(latency=latency, bandwidth=bandwidth, keep_content=False)
+    with emulator, get_context("spawn").Pool(1) as pool:
+        result = pool.apply(_run_backup, (root_path, emulator.url))
+
+    wall_time = result["wall_time"]
+    latencies = result["latencies"]
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workload": workload.as_dict(),
+        "files": workload.files,
+        "bytes": total_size,
+        "uploads": len(latencies),
+        "api_requests": emulator.stats["requests"],
+        "uploaded_bytes": emulator.stats["bytes_received"],
+        "wall_time": wall_time,
+        "cpu_time": result["cpu_time"],
+        "peak_rss": result["peak_rss"],
+        "throughput_bytes": total_size / wall_time if wall_time else 0,
+        "throughput_files": workload.files / wall_time if wall_time else 0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies, default=0.0),
+    }
+
+
+def _run_backup(root_path: Path, api_url: str) -> dict:
+    # Run in the benchmark's process.
+    from .main import create_backup
+
+    latencies: List[float] = []
+    with _bench_settings(root_path, api_url), _timed(latencies):
+        start_cpu = process_time()
+        start = perf_counter()
+        create_backup()
+        wall_time = perf_counter() - start
+        cpu_time = process_time() - start_cpu
+
+    return {
+        "wall_time": wall_time,
+        "cpu_time": cpu_time,
+        "latencies": latencies,
+        "peak_rss": get_peak_rss(),
+    }
+
+
+@contextmanager
+def _bench_settings(root_path: Path, api_url: str):
+    from .config import Settings, settings
+    from .drive import clear_services_cache
+    from .logger import log_writer
+    from .state import mimetype_cache, run_history, upload_journal
+
+    metrics_path = root_path.joinpath("state", "metrics.prom")
+    bench_settings = Settings(
+        root_path=root_path, drive_api_url=api_url, metrics_path=metrics_path
+    )
+
+    # Swaps the object behind the LazySettings proxy, as it does on load.
+    previous = settings._settings  # pylint: disable=protected-access
+    log_writer.close()
+    mimetype_cache.unload()
+    run_history.unload()
+    upload_journal.unload()
+    object.__setattr__(settings, "_settings", bench_settings)
+    try:
+        yield
+    finally:
+        log_writer.close()
+        mimetype_cache.unload()
+        run_history.unload()
+        upload_journal.unload()
+        clear_services_cache()
+        object.__setattr__(settings, "_settings", previous)
+
+
+@contextmanager
+def _timed(latencies: List[float]):
+    from . import main
+
+    backup = main.backup
+
+    def timed_backup(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return backup(*args, **kwargs)
+        finally:
+            latencies.append(perf_counter() - start)
+
+    main.backup = timed_backup
+    try:
+        yield
+    finally:
+        main.backup = backup
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[Dict]:
+    """Compares a report against a baseline.
+
+    Args:
+        report (dict): report of the benchmark.
+        baseline (dict): report used as reference.
+        threshold (float): maximum change allowed, in percent.
+
+    Returns:
+        List[Dict]: every metric of `COMPARED_METRICS` present in both
+            reports, with its `baseline` and `current` values, its `change`
+            in percent and whether it's a `regression`.
+    """
+
+    results = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        current = report.get(metric)
+        reference = baseline.get(metric)
+        if current is None or not reference:
+            continue
+
+        change = 100 * (current - reference) / reference
+        worse = -change if higher_is_better else change
+        results.append(
+            {
+                "metric": metric,
+                "baseline": reference,
+                "current": current,
+                "change": change,
+                "regression": worse > threshold,
+            }
+        )
+    return results
+
+
+def format_report(report: dict) -> str:
+    """Returns a human readable summary of a report."""
+
+    peak_rss = report["peak_rss"]
+    lines = [
+        f"Files: {report['files']} ({report['bytes']} bytes)",
+        f"Uploads: {report['uploads']} ({report['uploaded_bytes']} bytes)",
+        f"API requests: {report['api_requests']}",
+        f"Wall time: {report['wall_time']:.3f} s",
+        f"CPU time: {report['cpu_time']:.3f} s",
+        f"Peak RSS: {peak_rss / 1024**2:.1f} MiB" if peak_rss else "Peak RSS: -",
+        "Throughput: %.2f MiB/s, %.1f files/s"
+        % (report["throughput_bytes"] / 1024**2, report["throughput_files"]),
+        "Upload latency: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms"
+        % tuple(
+            1000 * report[x]
+            for x in ("latency_p50", "latency_p90", "latency_p99", "latency_max")
+        ),
+    ]
+    return "\n".join(lines)
+
+
+def format_comparison(results: List[Dict]) -> str:
+    """Returns a human readable table of the comparison against a baseline."""
+
+    lines = [f"{'Metric':<18} {'Baseline':>12} {'Current':>12} {'Change':>8}"]
+    for result in results:
+        flag = "  REGRESSION" if result["regression"] else ""
+        lines.append(
+            f"{result['metric']:<18} {result['baseline']:>12.4g} "
+            f"{result['current']:>12.4g} {result['change']:>+7.1f}%{flag}"
+        )
+    return "\n".join(lines)
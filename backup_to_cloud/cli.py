@@ -1,11 +1,61 @@
 """Handles the Command Line Interface."""
 
+from contextlib import contextmanager
+
 import click
 
-from .main import create_backup
-from .utils import gen_new_token, list_files
+# Heavy modules (Google API client, YAML parser, settings) are imported
+# by the commands that need them, so lightweight commands start instantly.
 
 CTX_SETTINGS = dict(help_option_names=["-h", "--help"])
+PROFILE_OPTIONS = (
+    click.option(
+        "--profile",
+        is_flag=True,
+        help="Profile the command, writing the results into the root path.",
+    ),
+    click.option(
+        "--profiler",
+        type=click.Choice(["sample", "cprofile"]),
+        default="sample",
+        show_default=True,
+        help="Profiler used by --profile.",
+    ),
+)
+
+
+def profile_options(func):
+    """Adds the options --profile and --profiler to a command."""
+
+    for option in reversed(PROFILE_OPTIONS):
+        func = option(func)
+    return func
+
+
+@contextmanager
+def _profile(name: str, enabled: bool, profiler: str):
+    if not enabled:
+        yield
+        return
+
+    from .profiler import Profiler
+
+    with Profiler(name, _get_profile_dir(), profiler) as prof:
+        yield
+
+    for path in prof.paths:
+        click.echo(f"Profile saved to {path.as_posix()}", err=True)
+
+
+def _get_profile_dir():
+    from pydantic import ValidationError
+
+    from .config import settings
+
+    try:
+        return settings.root_path
+    except ValidationError:
+        return "."
 
 
 @click.group(context_settings=CTX_SETTINGS)
@@ -16,26 +66,316 @@ def main():
 @main.command("check-regex")
 @click.argument("root-path")
 @click.argument("regex", default=".", required=False)
-def check_regex_command(root_path, regex):
+@click.option("--summary", is_flag=True, help="Print only a summary of the matches.")
+@profile_options
+def check_regex_command(root_path, regex, summary, profile, profiler):
     """Checks which files are catched by a regex"""
 
-    files = list_files(root_path, regex)
-    for file in files:
-        print(file)
+    from .walker import WalkStats, iter_matches
+
+    stats = WalkStats()
+    with _profile("check-regex", profile, profiler):
+        for filepath, _ in iter_matches(root_path, regex, stats):
+            if not summary:
+                click.echo(filepath)
+
+    if summary:
+        elapsed = stats.elapsed
+        speed = stats.files / elapsed if elapsed else 0
+        click.echo(f"Matched files: {stats.matched}")
+        click.echo(f"Total size: {_format_size(stats.bytes)} ({stats.bytes} bytes)")
+        click.echo(f"Folders scanned: {stats.dirs}")
+        click.echo(f"Files scanned: {stats.files}")
+        click.echo(f"Elapsed time: {elapsed:.2f} s ({speed:.0f} files/s)")
+
+
+def _format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:.1f} {unit}"
 
 
 @main.command("gen-token")
 def gen_token_command():
     """Generates a new token"""
 
+    from .drive import gen_new_token
+
     gen_new_token()
 
 
 @main.command("create-backup")
-def create_backup_command():
+@click.option(
+    "--deadline",
+    help="Time span after which no new work is started, like 2h or 90m. "
+    "The work left is saved, and done first by the next run.",
+)
+@profile_options
+def create_backup_command(deadline, profile, profiler):
     """Creates a backup and uploads it to google drive"""
 
-    create_backup()
+    from .automatic import parse_age
+    from .main import create_backup
+
+    try:
+        deadline = parse_age(deadline)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+
+    with _profile("create-backup", profile, profiler):
+        pending = create_backup(deadline=deadline)
+
+    if pending:
+        click.echo(
+            f"Deadline reached, {len(pending)} entries left for the next run",
+            err=True,
+        )
+
+
+@main.command("plan")
+@click.argument("names", nargs=-1)
+@click.option("--json", "as_json", is_flag=True, help="Print the plan as JSON.")
+def plan_command(names, as_json):
+    """Shows what create-backup would upload, without uploading anything"""
+
+    import json
+
+    from .config import settings
+    from .planner import estimate_duration, plan_backup
+
+    plans = plan_backup(list(names) or None)
+    duration = estimate_duration(plans, settings.workers)
+    if as_json:
+        report = {
+            "entries": [plan.as_dict() for plan in plans],
+            "workers": settings.workers,
+            "seconds": duration,
+        }
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    if any(plan.resumed for plan in plans):
+        click.echo("Resuming the work left by the last backup")
+
+    header = ("Entry", "Files", "Size", "Upload", "Skipped", "Deleted", "API", "Time")
+    rows = [
+        (
+            plan.name,
+            str(plan.files),
+            _format_size(plan.bytes),
+            _format_size(plan.upload_bytes),
+            str(plan.skipped),
+            str(plan.deleted),
+            str(plan.api_calls),
+            f"{plan.seconds:.1f} s",
+        )
+        for plan in plans
+    ]
+    widths = [max(len(x) for x in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        cells = [row[0].ljust(widths[0])]
+        cells.extend(x.rjust(width) for x, width in zip(row[1:], widths[1:]))
+        click.echo("  ".join(cells))
+
+    files = sum(plan.files for plan in plans)
+    upload_bytes = sum(plan.upload_bytes for plan in plans)
+    api_calls = sum(plan.api_calls for plan in plans)
+    click.echo()
+    click.echo(f"Files to upload: {files} ({_format_size(upload_bytes)})")
+    click.echo(f"Files skipped: {sum(plan.skipped for plan in plans)}")
+    click.echo(f"Files deleted: {sum(plan.deleted for plan in plans)}")
+    click.echo(f"API calls: {api_calls}")
+    click.echo(f"Estimated duration: {duration:.1f} s ({settings.workers} workers)")
+
+
+@main.command("daemon")
+@click.option(
+    "--poll-interval",
+    type=float,
+    default=5,
+    show_default=True,
+    help="Seconds between checks of the settings file.",
+)
+def daemon_command(poll_interval):
+    """Backs up the entries on their schedules, until stopped"""
+
+    import signal
+
+    from .daemon import Daemon
+
+    daemon = Daemon(poll_interval)
+    daemon.reload()
+    signal.signal(signal.SIGTERM, lambda *args: daemon.stop())
+
+    click.echo(f"Running {len(daemon.schedules)} scheduled entries")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command("watch")
+@click.argument("names", nargs=-1)
+@click.option(
+    "--debounce",
+    type=float,
+    default=2,
+    show_default=True,
+    help="Seconds without changes to wait before backing them up.",
+)
+@click.option(
+    "--max-delay",
+    type=float,
+    default=60,
+    show_default=True,
+    help="Max seconds to wait since the first change.",
+)
+@click.option("--initial", is_flag=True, help="Back up the entries before watching.")
+def watch_command(names, debounce, max_delay, initial):
+    """Backs up the entries when their files change (Linux only)"""
+
+    import signal
+
+    from .automatic import get_automatic_entries
+    from .main import create_backup
+    from .watcher import Watcher
+
+    entries = [x for x in get_automatic_entries() if x.root_path is not None]
+    unknown = set(names) - {x.name for x in entries}
+    if unknown:
+        raise click.BadParameter(f"Unknown entries: {', '.join(sorted(unknown))}")
+    if names:
+        entries = [x for x in entries if x.name in names]
+
+    if initial:
+        create_backup([x.name for x in entries])
+
+    try:
+        watcher = Watcher(entries, debounce, max_delay)
+    except OSError as exc:
+        raise click.ClickException(str(exc)) from exc
+
+    signal.signal(signal.SIGTERM, lambda *args: watcher.stop())
+    click.echo(f"Watching {len(entries)} entries ({len(watcher.dirs)} folders)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+@main.command("drive-emulator")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8765, show_default=True)
+@click.option("--latency", type=float, default=0, help="Seconds added to requests.")
+@click.option("--bandwidth", type=float, default=0, help="Bytes per second.")
+@click.option("--error-rate", type=float, default=0, help="Ratio of failed requests.")
+@click.option("--seed", type=int, default=0, help="Seed of the injected errors.")
+def drive_emulator_command(host, port, latency, bandwidth, error_rate, seed):
+    """Runs a local emulator of the Google Drive API"""
+
+    from .emulator import DriveEmulator
+
+    emulator = DriveEmulator(host, port, latency, bandwidth, error_rate, seed=seed)
+    click.echo(f"Serving on {emulator.url} (set BTC_DRIVE_API_URL to use it)")
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+@main.command("bench")
+@click.option("--files", type=int, default=1000, show_default=True)
+@click.option("--size", default="64KB", show_default=True, help="Mean file size.")
+@click.option(
+    "--distribution",
+    type=click.Choice(["fixed", "uniform", "lognormal"]),
+    default="fixed",
+    show_default=True,
+    help="Distribution of the file sizes.",
+)
+@click.option(
+    "--compressibility",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="Ratio of every file filled with zeros.",
+)
+@click.option("--zip", "use_zip", is_flag=True, help="Upload a single zip file.")
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--latency", type=float, default=0, help="Seconds added to requests.")
+@click.option("--bandwidth", type=float, default=0, help="Bytes per second.")
+@click.option("--output", type=click.Path(dir_okay=False), help="Save the report.")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Report to compare against.",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=10,
+    show_default=True,
+    help="Maximum change allowed against the baseline, in percent.",
+)
+@click.pass_context
+def bench_command(
+    ctx,
+    files,
+    size,
+    distribution,
+    compressibility,
+    use_zip,
+    seed,
+    latency,
+    bandwidth,
+    output,
+    baseline,
+    threshold,
+):
+    """Benchmarks a backup of synthetic files against a local emulator"""
+
+    import json
+    import tempfile
+
+    from .automatic import parse_size
+    from .bench import Workload, compare, format_comparison, format_report, run_bench
+
+    try:
+        size = parse_size(size)
+        workload = Workload(files, size, distribution, compressibility, use_zip, seed)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+
+    with tempfile.TemporaryDirectory(prefix="btc-bench-") as workdir:
+        report = run_bench(workload, workdir, latency, bandwidth)
+
+    click.echo(format_report(report))
+    if output:
+        with open(output, "wt", encoding="utf-8") as file_handler:
+            json.dump(report, file_handler, indent=2)
+
+    if not baseline:
+        return
+
+    with open(baseline, encoding="utf-8") as file_handler:
+        baseline = json.load(file_handler)
+    if baseline.get("workload") != report["workload"]:
+        click.echo("Warning: the baseline was run with another workload", err=True)
+
+    results = compare(report, baseline, threshold)
+    click.echo()
+    click.echo(format_comparison(results))
+    if any(result["regression"] for result in results):
+        click.echo("Regressions found against the baseline", err=True)
+        ctx.exit(1)
 
 
 def cli():
@@ -6,12 +6,22 @@ from typing import Optional
 from pydantic import BaseSettings, validator
 from pydantic.types import DirectoryPath, FilePath
 
+# Half of the budget must fit a chunk of a resumable upload (see `upload`).
+MIN_MAX_MEMORY = 16 * 1024**2
+
 
 class Settings(BaseSettings):
     """Base settings of the application."""
 
     root_path: DirectoryPath
     credentials_path: Optional[FilePath]
+    metrics_path: Optional[Path]
+    drive_api_url: Optional[str] = None
+    log_format: str = "text"
+    log_max_size: int = 10 * 1024**2
+    log_backups: int = 3
+    workers: int = 4
+    max_memory: Optional[int] = None
 
     @validator("credentials_path", pre=True)
     def check_credentials_path(cls, v, values):
@@ -25,6 +35,46 @@ class Settings(BaseSettings):
         if v:
             return FilePath.validate(v)
 
+    @validator("metrics_path", pre=True, always=True)
+    def check_metrics_path(cls, v, values):
+        if not v and "root_path" in values:
+            return values["root_path"].joinpath("state", "metrics.prom")
+
+        return v
+
+    @validator("log_format")
+    def check_log_format(cls, v):
+        v = v.lower()
+        if v not in ("text", "json"):
+            raise ValueError(f"must be 'text' or 'json', not {v!r}")
+        return v
+
+    @validator("log_max_size", "log_backups")
+    def check_not_negative(cls, v):
+        if v < 0:
+            raise ValueError("must not be negative")
+        return v
+
+    @validator("workers")
+    def check_positive(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator("max_memory", pre=True)
+    def parse_max_memory(cls, v):
+        if isinstance(v, str):
+            from .automatic import parse_size
+
+            return parse_size(v)
+        return v
+
+    @validator("max_memory")
+    def check_max_memory(cls, v):
+        if v is not None and v < MIN_MAX_MEMORY:
+            raise ValueError("must be at least 16MB")
+        return v
+
     @property
     def log_path(self) -> Path:
         return self.root_path.joinpath("cloud-backup.log")
@@ -33,13 +83,67 @@ class Settings(BaseSettings):
     def automatic_path(self) -> Path:
         return self.root_path.joinpath(".automatic.yml")
 
+    @property
+    def automatic_cache_path(self) -> Path:
+        return self.root_path.joinpath(".automatic.cache")
+
     @property
     def token_path(self) -> Path:
         return self.root_path.joinpath("token.pickle")
 
+    @property
+    def state_path(self) -> Path:
+        return self.root_path.joinpath("state")
+
+    @property
+    def mimetype_cache_path(self) -> Path:
+        return self.state_path.joinpath("mimetypes.json")
+
+    @property
+    def history_path(self) -> Path:
+        return self.state_path.joinpath("history.json")
+
+    @property
+    def resume_queue_path(self) -> Path:
+        return self.state_path.joinpath("resume.json")
+
+    @property
+    def upload_journal_path(self) -> Path:
+        return self.state_path.joinpath("uploads.jsonl")
+
+    @property
+    def discovery_cache_path(self) -> Path:
+        return self.state_path.joinpath("drive-v3-discovery.json")
+
     class Config:
         env_prefix = "btc_"
         validate_assignment = True
 
 
-settings = Settings()
+class LazySettings:
+    """Proxy to the application's Settings.
+
+    The settings are loaded (and validated) the first time one of them is
+    used, instead of when the module is imported. Commands that don't need
+    them can run even if the environment is not configured.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_settings", None)
+
+    def _load(self) -> Settings:
+        if self._settings is None:
+            object.__setattr__(self, "_settings", Settings())
+        return self._settings
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        return f"LazySettings({self._settings!r})"
+
+
+settings = LazySettings()
@@ -0,0 +1,135 @@
+"""Runs the backup entries on their schedules, in a long-running process."""
+
+from datetime import datetime
+from threading import Event
+from typing import Dict, List, Optional
+
+from .automatic import get_automatic_entries
+from .config import settings
+from .logger import log_writer
+from .main import create_backup
+from .schedule import CronSchedule
+from .utils import log
+
+POLL_INTERVAL = 5.0
+
+
+class Daemon:
+    """Backs up every entry with a `schedule` when it's due.
+
+    Unlike the processes started by cron, the daemon keeps its state between
+    backups: the Drive service and its connections, the credentials, the
+    discovery document and the MIME type cache. Entries due at the same
+    time are backed up together, so their folders are walked once.
+
+    The automatic file is checked every `poll_interval` seconds and reloaded
+    when it changes. Entries whose schedule didn't change keep their next
+    run. If the new file is invalid, the error is logged and the previous
+    entries are kept.
+
+    Args:
+        poll_interval (float, optional): seconds between checks of the
+            automatic file. Defaults to `POLL_INTERVAL`.
+    """
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.schedules: Dict[str, CronSchedule] = {}
+        self.next_runs: Dict[str, datetime] = {}
+        self._config_key = None
+        self._stop = Event()
+
+    def reload(self, now: Optional[datetime] = None) -> bool:
+        """Reloads the automatic file, if it changed since the last load.
+
+        Args:
+            now (datetime, optional): current time, to schedule the next run
+                of new entries. Defaults to `datetime.now()`.
+
+        Raises:
+            AutomaticEntryError, TypeError, ValueError: if the automatic file
+                is not valid (see `get_automatic_entries`).
+
+        Returns:
+            bool: True if the automatic file was reloaded.
+        """
+
+        now = now or datetime.now()
+        stat_result = settings.automatic_path.stat()
+        key = (stat_result.st_mtime_ns, stat_result.st_size)
+        if key == self._config_key:
+            return False
+
+        # An invalid file is not loaded again until it changes.
+        self._config_key = key
+        schedules, next_runs = {}, {}
+        for entry in get_automatic_entries():
+            if entry.schedule is None:
+                log("Entry %r has no schedule, skipping it", entry.name)
+                continue
+
+            schedules[entry.name] = entry.schedule
+            if self.schedules.get(entry.name) == entry.schedule:
+                next_runs[entry.name] = self.next_runs[entry.name]
+            else:
+                next_runs[entry.name] = entry.schedule.next_after(now)
+
+        self.schedules, self.next_runs = schedules, next_runs
+        log("Loaded %d scheduled entries", len(schedules))
+        return True
+
+    def run_pending(self, now: Optional[datetime] = None) -> List[str]:
+        """Backs up the entries whose next run is due.
+
+        Errors are logged, they don't stop the daemon.
+
+        Args:
+            now (datetime, optional): current time. Defaults to
+                `datetime.now()`.
+
+        Returns:
+            List[str]: names of the entries backed up.
+        """
+
+        now = now or datetime.now()
+        due = sorted(name for name, date in self.next_runs.items() if date <= now)
+        if not due:
+            return due
+
+        for name in due:
+            self.next_runs[name] = self.schedules[name].next_after(now)
+
+        log("Backing up scheduled entries: %s", ", ".join(due))
+        try:
+            create_backup(due)
+        except Exception as exc:  # pylint: disable=broad-except
+            log(exc)
+        return due
+
+    def run(self):
+        """Runs the scheduled backups until `stop` is called."""
+
+        while not self._stop.is_set():
+            now = datetime.now()
+            try:
+                self.reload(now)
+            except Exception as exc:  # pylint: disable=broad-except
+                log(exc)
+
+            self.run_pending(now)
+            log_writer.flush()
+            self._stop.wait(self.get_timeout())
+
+    def get_timeout(self, now: Optional[datetime] = None) -> float:
+        """Returns the seconds to wait until the next run or check."""
+
+        now = now or datetime.now()
+        timeout = self.poll_interval
+        if self.next_runs:
+            until = (min(self.next_runs.values()) - now).total_seconds()
+            timeout = min(timeout, max(until, 0))
+        return timeout
+
+    def stop(self):
+        """Stops the daemon, after the running backup ends."""
+        self._stop.set()
@@ -0,0 +1,52 @@
+"""Time limit of a backup, and the work left when it's reached."""
+
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional
+
+
+class Deadline:
+    """Time limit of a backup.
+
+    Once the deadline expires, no new work is started: the entries and
+    files skipped are deferred, to be backed up by the next run.
+
+    Args:
+        seconds (Optional[float]): seconds from now until the deadline, or
+            None for no deadline.
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.end = monotonic() + seconds if seconds is not None else None
+        self.pending: Dict[str, Optional[List[str]]] = {}
+        self._lock = Lock()
+
+    def expired(self) -> bool:
+        """Returns True if the deadline has been reached."""
+        return self.end is not None and monotonic() >= self.end
+
+    def defer_entry(self, name: str):
+        """Defers a whole entry to the next run.
+
+        Args:
+            name (str): name of the entry.
+        """
+
+        with self._lock:
+            self.pending[name] = None
+
+    def defer_file(self, name: str, path: str):
+        """Defers a file of a `multiple-files` entry to the next run.
+
+        Args:
+            name (str): name of the entry.
+            path (str): path of the file.
+        """
+
+        with self._lock:
+            files = self.pending.setdefault(name, [])
+            if files is not None:
+                files.append(path)
+
+    def __repr__(self):
+        return f"Deadline(expired={self.expired()}, pending={len(self.pending)})"
@@ -0,0 +1,327 @@
+"""Handles the authentication and the services of the Google Drive API v3."""
+
+import json
+import pickle
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from threading import Lock, local
+from time import time
+from typing import Callable, List, Optional, Tuple
+from weakref import finalize
+
+import httplib2
+from google.auth.credentials import AnonymousCredentials
+from google.auth.exceptions import RefreshError, TransportError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import Resource, build_from_document
+
+from .config import settings
+from .exceptions import TokenError
+from .state import atomic_write
+from .utils import log
+
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+DISCOVERY_MAX_AGE = 30 * 86400
+REFRESH_MARGIN = 300
+ANONYMOUS_CREDENTIALS = AnonymousCredentials()
+
+
+def gen_new_token():
+    """Generates a new token."""
+
+    if not settings.credentials_path.exists():
+        raise FileNotFoundError(settings.credentials_path.as_posix())
+
+    flow = InstalledAppFlow.from_client_secrets_file(
+        settings.credentials_path.as_posix(), SCOPES
+    )
+    creds = flow.run_local_server(port=0)
+
+    settings.token_path.write_bytes(pickle.dumps(creds))
+    credentials.invalidate()
+
+
+def get_google_drive_services(creds: Credentials = None) -> Resource:
+    """Returns an object to operate with the Google Drive API v3.
+
+    Args:
+        creds (Credentials, optional): credentials to use. If None, it
+            will be generated by get_creds_from_token(). Defaults to None.
+
+    If `settings.drive_api_url` is set, requests are sent to that URL (for
+    example, a `DriveEmulator`) instead of Google, with anonymous credentials.
+
+    Each thread uses its own service (httplib2 connections are not thread
+    safe) while the credentials and the API URL don't change. When the
+    thread ends, the service is kept for other threads, so its connections
+    are reused by later calls and later backups. See `ServicePool`.
+
+    Returns:
+        Resource: Google Drive API v3 operator.
+    """
+
+    if settings.drive_api_url:
+        creds = creds or ANONYMOUS_CREDENTIALS
+
+    if not creds:
+        creds = get_creds_from_token()
+
+    return services.get((settings.drive_api_url, creds), lambda: _build(creds))
+
+
+def _build(creds: Credentials) -> Resource:
+    # build_from_document mutates the nested dicts of the document and the
+    # pool may build services from several threads, so never share the cache.
+    document = deepcopy(get_discovery_document())
+    if settings.drive_api_url:
+        root_url = settings.drive_api_url.rstrip("/") + "/"
+        document.update(rootUrl=root_url, mtlsRootUrl=root_url)
+
+    return build_from_document(document, credentials=creds)
+
+
+def clear_services_cache():
+    """Forgets the services kept by the current thread and by the pool."""
+    services.clear()
+
+
+class ServicePool:
+    """Keeps the services of the Google Drive API v3 after their threads end.
+
+    A thread takes a service from the pool the first time it needs one, and
+    uses it alone until it ends. Then the service goes back to the pool, so
+    the threads of the next backups reuse it, with its open connections.
+    Only the services built for the current key (the credentials and the API
+    URL) are reused, the rest are dropped.
+    """
+
+    def __init__(self):
+        self._idle: List[Tuple[tuple, Resource]] = []
+        self._local = local()
+        self._lock = Lock()
+
+    def get(self, key: tuple, build: Callable[[], Resource]) -> Resource:
+        """Returns the service of the current thread.
+
+        Args:
+            key (tuple): credentials and API URL of the service.
+            build (Callable[[], Resource]): builds a new service, if there
+                isn't one for `key` in the pool.
+
+        Returns:
+            Resource: Google Drive API v3 operator.
+        """
+
+        lease = getattr(self._local, "lease", None)
+        if lease is not None and lease.key == key:
+            return lease.service
+        if lease is not None:
+            lease.finalizer.detach()
+
+        with self._lock:
+            self._idle = [x for x in self._idle if x[0] == key]
+            service = self._idle.pop()[1] if self._idle else None
+
+        if service is None:
+            service = build()
+        self._local.lease = _Lease(self, key, service)
+        return service
+
+    def clear(self):
+        """Drops the service of the current thread and the idle services."""
+
+        lease = getattr(self._local, "lease", None)
+        if lease is not None:
+            lease.finalizer.detach()
+            self._local.lease = None
+
+        with self._lock:
+            self._idle.clear()
+
+    def _release(self, key: tuple, service: Resource):
+        with self._lock:
+            self._idle.append((key, service))
+
+
+class _Lease:
+    # Service used by a thread. The thread local data is deleted when the
+    # thread ends, giving the service back to the pool.
+
+    def __init__(self, pool: ServicePool, key: tuple, service: Resource):
+        self.key = key
+        self.service = service
+        release = pool._release  # pylint: disable=protected-access
+        self.finalizer = finalize(self, release, key, service)
+        self.finalizer.atexit = False
+
+
+services = ServicePool()
+
+
+@lru_cache(maxsize=None)
+def get_discovery_document() -> dict:
+    """Returns the discovery document of the Google Drive API v3.
+
+    It's loaded once per process from `settings.discovery_cache_path`. If
+    the cached document doesn't exist or is older than `DISCOVERY_MAX_AGE`,
+    it's replaced by the document bundled with googleapiclient or, if there
+    isn't one, by the document downloaded from `DISCOVERY_URL`.
+
+    Returns:
+        dict: discovery document.
+    """
+
+    path = settings.discovery_cache_path
+    try:
+        document = json.loads(path.read_text(encoding="utf-8"))
+        if time() - path.stat().st_mtime < DISCOVERY_MAX_AGE:
+            return document
+    except (OSError, ValueError):
+        document = None
+
+    try:
+        content = _fetch_discovery_document()
+        new_document = json.loads(content)
+    except (OSError, ValueError, httplib2.HttpLib2Error) as exc:
+        if document is None:
+            raise
+        log("Using outdated discovery document: %r", exc)
+        return document
+
+    atomic_write(path, content.encode("utf-8"))
+    log("Discovery document cached in %r", path.as_posix())
+    return new_document
+
+
+def _fetch_discovery_document() -> str:
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+
+        content = get_static_doc("drive", "v3")
+        if content:
+            return content
+    except ImportError:
+        pass
+
+    response, content = httplib2.Http(timeout=30).request(DISCOVERY_URL)
+    if response.status != 200:
+        raise OSError(f"Can't download discovery document ({response.status})")
+    return content.decode("utf-8")
+
+
+def get_creds_from_token() -> Credentials:
+    """Returns the credentials for the Google Drive API v3.
+
+    The token is loaded only once per process and refreshed shortly before
+    it expires. See `CredentialManager`.
+
+    Raises:
+        TokenError: if the token path doesn't exist.
+        TokenError: if the token path is not valid.
+
+    Returns:
+        Credentials: credentials for google drive.
+    """
+
+    return credentials.get()
+
+
+class CredentialManager:
+    """Keeps the credentials of the Google Drive API v3 in memory.
+
+    The token is loaded from `settings.token_path` the first time it's
+    needed. It's refreshed when it expires in less than `REFRESH_MARGIN`
+    seconds, so it never expires in the middle of an upload. The manager
+    is thread safe: if several threads need a refresh at the same time,
+    only one of them refreshes the token and the rest wait and share it.
+    The token file is rewritten (atomically) only if the token changed.
+    """
+
+    def __init__(self):
+        self._creds: Optional[Credentials] = None
+        self._saved_data: Optional[bytes] = None
+        self._lock = Lock()
+
+    def get(self) -> Credentials:
+        """Returns valid credentials, loading or refreshing them if needed.
+
+        Raises:
+            TokenError: if the token path doesn't exist.
+            TokenError: if the token path is not valid.
+
+        Returns:
+            Credentials: credentials for google drive.
+        """
+
+        creds = self._creds
+        if creds is not None and not self._needs_refresh(creds):
+            return creds
+
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._load()
+            if self._needs_refresh(self._creds):
+                self._refresh(self._creds)
+            return self._creds
+
+    def invalidate(self):
+        """Forgets the credentials, so they are loaded again from disk."""
+
+        with self._lock:
+            self._creds = None
+            self._saved_data = None
+
+    @staticmethod
+    def _needs_refresh(creds: Credentials) -> bool:
+        if not creds.valid:
+            return True
+        if not creds.expiry or not creds.refresh_token:
+            return False
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return creds.expiry - now < timedelta(seconds=REFRESH_MARGIN)
+
+    def _load(self) -> Credentials:
+        token_path = settings.token_path
+        if not token_path.exists():
+            exc = TokenError(f"{token_path.as_posix()!r} doesn't exist")
+            log(exc)
+            raise exc
+
+        self._saved_data = token_path.read_bytes()
+        creds = pickle.loads(self._saved_data)
+
+        if not creds:
+            exc = TokenError(f"Invalid token: {token_path.as_posix()!r}")
+            log(exc)
+            raise exc
+
+        return creds
+
+    def _refresh(self, creds: Credentials):
+        if not creds.refresh_token or (not creds.valid and not creds.expired):
+            exc = TokenError(f"Invalid token: {settings.token_path.as_posix()!r}")
+            log(exc)
+            raise exc
+
+        try:
+            creds.refresh(Request())
+        except (RefreshError, TransportError) as exc:
+            if not creds.valid:
+                raise
+            log("Token refresh failed, using the current token: %r", exc)
+            return
+
+        log("Token updated (expires %s)", creds.expiry)
+
+        data = pickle.dumps(creds)
+        if data != self._saved_data:
+            atomic_write(settings.token_path, data)
+            self._saved_data = data
+
+
+credentials = CredentialManager()
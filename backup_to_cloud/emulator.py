@@ -0,0 +1,763 @@
+"""Local emulator of the subset of the Google Drive API v3 used by the app.
+
+It's meant for end-to-end tests and throughput measurements, not as a
+storage: files are kept in memory, or only their size and md5, and
+authentication is ignored.
+"""
+
+import json
+import re
+from datetime import datetime
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+DEFAULT_FIELDS = "kind,id,name,mimeType"
+DEFAULT_LIST_FIELDS = f"kind,incompleteSearch,nextPageToken,files({DEFAULT_FIELDS})"
+ERROR_REASONS = {
+    400: "badRequest",
+    404: "notFound",
+    429: "rateLimitExceeded",
+    500: "backendError",
+    502: "backendError",
+    503: "backendError",
+}
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+
+Response = Tuple[int, Dict[str, str], bytes]
+
+_STRING = r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+_QUERY_CLAUSES = (
+    ("name", re.compile(r"^name\s*(=|!=|contains)\s*" + _STRING + "$")),
+    ("mimeType", re.compile(r"^mimeType\s*(=|!=)\s*" + _STRING + "$")),
+    ("parents", re.compile(r"^" + _STRING + r"\s+in\s+parents$")),
+    ("trashed", re.compile(r"^trashed\s*(=|!=)\s*(true|false)$")),
+)
+
+
+class DriveError(Exception):
+    """Error returned by the emulator, with an HTTP status code."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class DriveEmulator:
+    """Serves an in-memory Google Drive API v3 over HTTP.
+
+    Supported methods: `files.list`, `files.get` (including `alt=media`),
+    `files.create`, `files.update`, `files.delete` and `revisions.list`, with
+    multipart, media and resumable uploads, and batch requests. Files have
+    an `md5Checksum` and every upload creates a new revision.
+
+    Requests can be slowed down and made to fail, reproducibly:
+
+    Args:
+        host (str, optional): address to listen to. Defaults to `127.0.0.1`.
+        port (int, optional): port to listen to. If 0, a free port is
+            chosen. Defaults to 0.
+        latency (float, optional): seconds added to every request.
+            Defaults to 0.
+        bandwidth (float, optional): bytes per second of the link shared by
+            every request. If 0, the bandwidth is unlimited. Defaults to 0.
+        error_rate (float, optional): probability of a request failing with
+            one of `error_statuses`. Defaults to 0.
+        error_statuses (Tuple[int, ...], optional): HTTP statuses of the
+            injected errors. Defaults to (429, 500, 503).
+        seed (int, optional): seed of the injected errors. Defaults to 0.
+        keep_content (bool, optional): if False, only the size and md5 of
+            the uploads are kept, and files can't be downloaded. Defaults
+            to True.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        bandwidth: float = 0,
+        error_rate: float = 0,
+        error_statuses: Tuple[int, ...] = (429, 500, 503),
+        seed: int = 0,
+        keep_content: bool = True,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.keep_content = keep_content
+
+        self.files: Dict[str, dict] = {}
+        self.stats = {
+            "requests": 0,
+            "batch_requests": 0,
+            "errors": 0,
+            "uploads": 0,
+            "bytes_received": 0,
+            "bytes_sent": 0,
+        }
+
+        self._random = Random(seed)
+        self._sessions: Dict[str, dict] = {}
+        self._counter = 0
+        self._lock = Lock()
+        self._link_lock = Lock()
+        self._link_free_at = 0.0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.emulator = self
+        self._thread: Optional[Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the emulator, to use as `BTC_DRIVE_API_URL`."""
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "DriveEmulator":
+        """Starts serving requests in a background thread."""
+
+        self._thread = Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serves requests until the process is interrupted."""
+
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stops serving requests."""
+
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> "DriveEmulator":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Request handling
+
+    def handle(
+        self, method: str, url: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        """Handles a request, applying the latency, bandwidth and errors.
+
+        Args:
+            method (str): HTTP method.
+            url (str): path and query string of the request.
+            headers (Dict[str, str]): headers of the request, lowercased.
+            body (bytes): body of the request.
+
+        Returns:
+            Response: status, headers and body of the response.
+        """
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_received"] += len(body)
+            fail = self.error_rate and self._random.random() < self.error_rate
+            status = self._random.choice(self.error_statuses) if fail else None
+
+        if self.latency:
+            sleep(self.latency)
+        self._throttle(len(body))
+
+        if status:
+            with self._lock:
+                self.stats["errors"] += 1
+            response = _error(DriveError(status, "Injected error"))
+        else:
+            response = self.dispatch(method, url, headers, body)
+
+        self._throttle(len(response[2]))
+        with self._lock:
+            self.stats["bytes_sent"] += len(response[2])
+        return response
+
+    def _throttle(self, size: int):
+        if not self.bandwidth or not size:
+            return
+
+        with self._link_lock:
+            start = max(monotonic(), self._link_free_at)
+            self._link_free_at = start + size / self.bandwidth
+            wait = self._link_free_at - monotonic()
+        if wait > 0:
+            sleep(wait)
+
+    def dispatch(
+        self, method: str, url: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        """Handles a request, without latency, bandwidth limits or errors.
+
+        Args:
+            method (str): HTTP method.
+            url (str): path and query string of the request.
+            headers (Dict[str, str]): headers of the request, lowercased.
+            body (bytes): body of the request.
+
+        Returns:
+            Response: status, headers and body of the response.
+        """
+
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/")
+        params = dict(parse_qsl(parts.query))
+
+        try:
+            if path == "/batch/drive/v3":
+                return self._batch(headers, body)
+            if path == "/upload/drive/v3/files" and "upload_id" in params:
+                return self._resumable_chunk(params["upload_id"], headers, body)
+
+            match = re.match(
+                r"^(/upload)?/drive/v3/files(?:/([^/]+))?(/revisions)?$", path
+            )
+            if not match:
+                raise DriveError(404, f"Not found: {path}")
+
+            upload, file_id, revisions = match.groups()
+            if revisions and method == "GET":
+                return self._list_revisions(file_id, params)
+            if upload and method in ("POST", "PATCH"):
+                return self._upload(file_id, params, headers, body)
+            if method == "GET" and file_id:
+                return self._get(file_id, params)
+            if method == "GET":
+                return self._list(params)
+            if method == "POST" and not file_id:
+                metadata = json.loads(body or b"{}")
+                return _json(self._create(metadata, None, params), params)
+            if method == "PATCH" and file_id:
+                metadata = json.loads(body or b"{}")
+                return _json(self._update(file_id, metadata, None, params), params)
+            if method == "DELETE" and file_id:
+                with self._lock:
+                    self._get_file(file_id)
+                    del self.files[file_id]
+                return 204, {}, b""
+            raise DriveError(400, f"Unsupported method: {method} {path}")
+        except DriveError as exc:
+            return _error(exc)
+        except ValueError as exc:
+            return _error(DriveError(400, f"Invalid request: {exc}"))
+
+    # Methods
+
+    def _list(self, params: dict) -> Response:
+        query = params.get("q", "")
+        predicates = _parse_query(query)
+        page_size = min(int(params.get("pageSize", 100)), 1000)
+        offset = int(params.get("pageToken", 0))
+
+        with self._lock:
+            files = [
+                self._file_resource(x)
+                for x in self.files.values()
+                if all(predicate(x) for predicate in predicates)
+            ]
+
+        result = {
+            "kind": "drive#fileList",
+            "incompleteSearch": False,
+            "files": files[offset : offset + page_size],
+        }
+        if offset + page_size < len(files):
+            result["nextPageToken"] = str(offset + page_size)
+
+        fields = params.get("fields") or DEFAULT_LIST_FIELDS
+        return _json(result, {"fields": fields})
+
+    def _get(self, file_id: str, params: dict) -> Response:
+        with self._lock:
+            file = self._get_file(file_id)
+            if params.get("alt") == "media":
+                if file["content"] is None:
+                    raise DriveError(403, "The content of the files is not kept")
+                content = bytes(file["content"])
+                return 200, {"Content-Type": file["mimeType"]}, content
+            resource = self._file_resource(file)
+        return _json(resource, params)
+
+    def _list_revisions(self, file_id: str, params: dict) -> Response:
+        with self._lock:
+            revisions = [dict(x) for x in self._get_file(file_id)["revisions"]]
+
+        result = {"kind": "drive#revisionList", "revisions": revisions}
+        fields = params.get("fields") or "kind,revisions(kind,id,mimeType,modifiedTime)"
+        return _json(result, {"fields": fields})
+
+    def _upload(
+        self, file_id: Optional[str], params: dict, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        upload_type = params.get("uploadType", "media")
+
+        if upload_type == "resumable":
+            metadata = json.loads(body or b"{}")
+            total = headers.get("x-upload-content-length")
+            with self._lock:
+                if file_id:
+                    self._get_file(file_id)
+                upload_id = self._new_id("upload")
+                self._sessions[upload_id] = {
+                    "file_id": file_id,
+                    "metadata": metadata,
+                    "mimetype": headers.get("x-upload-content-type"),
+                    "total": int(total) if total else None,
+                    "data": _Content(self.keep_content),
+                    "params": params,
+                }
+            host = headers.get("host", "localhost")
+            location = f"http://{host}/upload/drive/v3/files?upload_id={upload_id}"
+            return 200, {"Location": location, "Content-Length": "0"}, b""
+
+        if upload_type == "multipart":
+            metadata, content, mimetype = _parse_multipart_related(headers, body)
+        elif upload_type == "media":
+            metadata = {}
+            content = body
+            mimetype = headers.get("content-type")
+        else:
+            raise DriveError(400, f"Invalid uploadType: {upload_type!r}")
+
+        if mimetype and "mimeType" not in metadata:
+            metadata["mimeType"] = mimetype
+        content = _Content(self.keep_content).extend(content)
+        return _json(self._save(file_id, metadata, content, params), params)
+
+    def _resumable_chunk(
+        self, upload_id: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            raise DriveError(404, f"Upload session not found: {upload_id}")
+
+        match = re.match(
+            r"^bytes (?:(\d+)-(-?\d+)|\*)/(\d+|\*)$",
+            headers.get("content-range", f"bytes 0-{len(body) - 1}/{len(body)}"),
+        )
+        if not match:
+            raise DriveError(400, "Invalid Content-Range")
+
+        first, _, total = match.groups()
+        if total != "*":
+            session["total"] = int(total)
+        data = session["data"]
+        if first is not None and int(first) == data.size:
+            data.extend(body)
+
+        if session["total"] is not None and data.size >= session["total"]:
+            with self._lock:
+                del self._sessions[upload_id]
+            metadata = dict(session["metadata"])
+            if session["mimetype"] and "mimeType" not in metadata:
+                metadata["mimeType"] = session["mimetype"]
+            params = session["params"]
+            file = self._save(session["file_id"], metadata, data, params)
+            return _json(file, params)
+
+        response_headers = {}
+        if data.size:
+            response_headers["Range"] = f"bytes=0-{data.size - 1}"
+        return 308, response_headers, b""
+
+    def _batch(self, headers: Dict[str, str], body: bytes) -> Response:
+        boundary = _get_boundary(headers.get("content-type", ""))
+        with self._lock:
+            response_boundary = "batch_" + self._new_id("batch")
+        parts = []
+
+        for part_headers, part_body in _split_multipart(body, boundary):
+            with self._lock:
+                self.stats["batch_requests"] += 1
+            content_id = part_headers.get("content-id", "<+0>")
+            method, url, sub_headers, sub_body = _parse_http_request(part_body)
+            status, res_headers, res_body = self.dispatch(
+                method, url, sub_headers, sub_body
+            )
+
+            lines = [f"HTTP/1.1 {status} {_reason(status)}"]
+            lines += [f"{k}: {v}" for k, v in res_headers.items()]
+            lines.append(f"Content-Length: {len(res_body)}")
+            payload = "\r\n".join(lines).encode() + b"\r\n\r\n" + res_body
+            parts.append(
+                f"--{response_boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n".encode()
+                + payload
+                + b"\r\n"
+            )
+
+        content = b"".join(parts) + f"--{response_boundary}--\r\n".encode()
+        content_type = f"multipart/mixed; boundary={response_boundary}"
+        return 200, {"Content-Type": content_type}, content
+
+    # Storage
+
+    def _new_id(self, prefix: str) -> str:
+        self._counter += 1
+        return f"{prefix}{self._counter:025d}"
+
+    def _get_file(self, file_id: str) -> dict:
+        try:
+            return self.files[file_id]
+        except KeyError:
+            raise DriveError(404, f"File not found: {file_id}") from None
+
+    def _save(
+        self, file_id: Optional[str], metadata: dict, content: "_Content", params: dict
+    ) -> dict:
+        with self._lock:
+            self.stats["uploads"] += 1
+        if file_id:
+            return self._update(file_id, metadata, content, params)
+        return self._create(metadata, content, params)
+
+    def _create(
+        self, metadata: dict, content: Optional["_Content"], params: dict
+    ) -> dict:
+        with self._lock:
+            file_id = self._new_id("file")
+            file = {
+                "id": file_id,
+                "name": metadata.get("name", "Untitled"),
+                "mimeType": metadata.get("mimeType", "application/octet-stream"),
+                "parents": list(metadata.get("parents") or ["root"]),
+                "trashed": False,
+                "createdTime": _now(),
+                "content": b"",
+                "size": 0,
+                "revisions": [],
+            }
+            self.files[file_id] = file
+            if content is not None:
+                self._add_revision(file, content, params)
+            else:
+                file["modifiedTime"] = file["createdTime"]
+            return self._file_resource(file)
+
+    def _update(
+        self, file_id: str, metadata: dict, content: Optional["_Content"], params: dict
+    ) -> dict:
+        with self._lock:
+            file = self._get_file(file_id)
+            for key in ("name", "mimeType", "trashed"):
+                if key in metadata:
+                    file[key] = metadata[key]
+            if content is not None:
+                self._add_revision(file, content, params)
+            else:
+                file["modifiedTime"] = _now()
+            return self._file_resource(file)
+
+    def _add_revision(self, file: dict, content: "_Content", params: dict):
+        file["content"] = content.getvalue()
+        file["size"] = content.size
+        file["modifiedTime"] = _now()
+        file["md5Checksum"] = content.md5.hexdigest()
+        file["revisions"].append(
+            {
+                "kind": "drive#revision",
+                "id": self._new_id("rev"),
+                "mimeType": file["mimeType"],
+                "modifiedTime": file["modifiedTime"],
+                "keepForever": params.get("keepRevisionForever") == "true",
+                "md5Checksum": file["md5Checksum"],
+                "size": str(content.size),
+            }
+        )
+
+    @staticmethod
+    def _file_resource(file: dict) -> dict:
+        resource = {
+            k: v for k, v in file.items() if k not in ("content", "size", "revisions")
+        }
+        resource["kind"] = "drive#file"
+        if file["mimeType"] != FOLDER_MIMETYPE:
+            resource["size"] = str(file["size"])
+        if file["revisions"]:
+            resource["headRevisionId"] = file["revisions"][-1]["id"]
+        return resource
+
+
+class _Content:
+    """Content of an upload, received in chunks.
+
+    Args:
+        keep (bool): if False, only the size and md5 of the content are kept.
+    """
+
+    def __init__(self, keep: bool):
+        self.size = 0
+        self.md5 = md5()
+        self._data = bytearray() if keep else None
+
+    def extend(self, chunk: bytes) -> "_Content":
+        """Adds a chunk to the content."""
+
+        self.size += len(chunk)
+        self.md5.update(chunk)
+        if self._data is not None:
+            self._data.extend(chunk)
+        return self
+
+    def getvalue(self) -> Optional[bytes]:
+        """Returns the content, or None if it's not kept."""
+
+        return bytes(self._data) if self._data is not None else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately. With Nagle's algorithm, the
+    # body waits for the delayed ACK of the client, adding ~40 ms per request.
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        headers = {k.lower(): v for k, v in self.headers.items()}
+
+        emulator = self.server.emulator
+        status, response_headers, content = emulator.handle(
+            self.command, self.path, headers, body
+        )
+
+        self.send_response(status)
+        for key, value in response_headers.items():
+            self.send_header(key, value)
+        if "Content-Length" not in response_headers:
+            self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if content:
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+# Helpers
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+
+
+def _reason(status: int) -> str:
+    return BaseHTTPRequestHandler.responses.get(status, ("Unknown",))[0]
+
+
+def _error(exc: DriveError) -> Response:
+    reason = ERROR_REASONS.get(exc.status, "error")
+    error = {
+        "code": exc.status,
+        "message": exc.message,
+        "errors": [{"domain": "global", "reason": reason, "message": exc.message}],
+    }
+    content = json.dumps({"error": error}).encode("utf-8")
+    return exc.status, {"Content-Type": "application/json; charset=UTF-8"}, content
+
+
+def _json(resource: dict, params: dict) -> Response:
+    fields = params.get("fields") or DEFAULT_FIELDS
+    resource = _select_fields(resource, _parse_fields(fields))
+    content = json.dumps(resource).encode("utf-8")
+    return 200, {"Content-Type": "application/json; charset=UTF-8"}, content
+
+
+def _parse_fields(fields: str) -> Optional[dict]:
+    """Parses a partial response selector, like `files(id, name),kind`.
+
+    Returns None if every field is selected (`*`).
+    """
+
+    result: Dict[str, Optional[dict]] = {}
+    depth = 0
+    token = ""
+    for char in fields + ",":
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            token = token.strip()
+            if token == "*":
+                return None
+            if "(" in token:
+                name, inner = token.split("(", 1)
+                result[name.strip()] = _parse_fields(inner[:-1])
+            elif "/" in token:
+                name, inner = token.split("/", 1)
+                result[name.strip()] = _parse_fields(inner)
+            elif token:
+                result[token] = None
+            token = ""
+        else:
+            token += char
+    return result
+
+
+def _select_fields(resource, selection: Optional[dict]):
+    if selection is None:
+        return resource
+    if isinstance(resource, list):
+        return [_select_fields(x, selection) for x in resource]
+
+    result = {}
+    for key, sub_selection in selection.items():
+        if key in resource:
+            result[key] = _select_fields(resource[key], sub_selection)
+    return result
+
+
+def _parse_string(literal: str) -> str:
+    return re.sub(r"\\(.)", r"\1", literal[1:-1])
+
+
+def _split_query(query: str) -> List[str]:
+    clauses, current, quote = [], "", None
+    index = 0
+    while index < len(query):
+        char = query[index]
+        if quote:
+            current += char
+            if char == "\\":
+                current += query[index + 1 : index + 2]
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+            current += char
+        elif query[index : index + 5].lower() == " and ":
+            clauses.append(current.strip())
+            current = ""
+            index += 4
+        else:
+            current += char
+        index += 1
+
+    if current.strip():
+        clauses.append(current.strip())
+    return clauses
+
+
+def _parse_query(query: str) -> list:
+    """Parses a files.list query into a list of predicates.
+
+    Supported clauses, joined by `and`: `name = '...'`, `name != '...'`,
+    `name contains '...'`, `mimeType = '...'`, `mimeType != '...'`,
+    `'...' in parents` and `trashed = true|false`.
+    """
+
+    predicates = []
+    for clause in _split_query(query):
+        for field, regex in _QUERY_CLAUSES:
+            match = regex.match(clause)
+            if match:
+                break
+        else:
+            raise DriveError(400, f"Invalid query: {clause!r}")
+
+        if field == "parents":
+            parent = _parse_string(match.group(1))
+            predicates.append(lambda x, p=parent: p in x["parents"])
+            continue
+
+        operator, value = match.groups()
+        if field == "trashed":
+            value = value == "true"
+        else:
+            value = _parse_string(value)
+
+        if operator == "contains":
+            predicates.append(lambda x, f=field, v=value: v in x[f])
+        elif operator == "=":
+            predicates.append(lambda x, f=field, v=value: x[f] == v)
+        else:
+            predicates.append(lambda x, f=field, v=value: x[f] != v)
+
+    return predicates
+
+
+def _get_boundary(content_type: str) -> str:
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise DriveError(400, "Missing multipart boundary")
+    return match.group(1)
+
+
+def _split_headers(data: bytes) -> Tuple[Dict[str, str], bytes]:
+    if data.startswith(b"\r\n") or data.startswith(b"\n"):
+        # No headers
+        return {}, data.split(b"\n", 1)[1]
+
+    # The headers end at the first blank line, the body may have others.
+    ends = [(data.find(x), x) for x in (b"\r\n\r\n", b"\n\n") if x in data]
+    if ends:
+        index, separator = min(ends)
+        head, body = data[:index], data[index + len(separator) :]
+    else:
+        head, body = data, b""
+    headers = {}
+    for line in head.decode("utf-8").splitlines():
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    return headers, body
+
+
+def _split_multipart(body: bytes, boundary: str) -> List[Tuple[Dict[str, str], bytes]]:
+    delimiter = b"--" + boundary.encode()
+    _, found, rest = body.partition(delimiter)
+    if not found:
+        return []
+
+    # The line break before a delimiter belongs to it, so content ending
+    # with a line break is kept whole.
+    newline = b"\r\n" if rest.startswith(b"\r\n") else b"\n"
+    parts = []
+    for chunk in rest.split(newline + delimiter):
+        if chunk.startswith(b"--"):
+            break
+        if chunk.startswith(newline):
+            chunk = chunk[len(newline) :]
+        parts.append(_split_headers(chunk))
+    return parts
+
+
+def _parse_multipart_related(
+    headers: Dict[str, str], body: bytes
+) -> Tuple[dict, bytes, Optional[str]]:
+    boundary = _get_boundary(headers.get("content-type", ""))
+    parts = _split_multipart(body, boundary)
+    if len(parts) != 2:
+        raise DriveError(400, "Multipart upload must have 2 parts")
+
+    (_, metadata), (media_headers, content) = parts
+    return json.loads(metadata or b"{}"), content, media_headers.get("content-type")
+
+
+def _parse_http_request(data: bytes) -> Tuple[str, str, Dict[str, str], bytes]:
+    request_line, _, rest = data.partition(b"\n")
+    method, url, _ = request_line.decode("utf-8").strip().split(" ", 2)
+    headers, body = _split_headers(rest)
+    return method, url, headers, body
@@ -0,0 +1,181 @@
+"""Compact storage for the files found while listing a BackupEntry."""
+
+from array import array
+from pathlib import Path
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+_SEP = "\0"
+
+
+class FileStat(NamedTuple):
+    """Stat data of a file, collected while walking its folder."""
+
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def from_stat(cls, stat_result) -> "FileStat":
+        """Builds a FileStat from an `os.stat_result`."""
+
+        return cls(stat_result.st_size, stat_result.st_mtime_ns)
+
+
+class FileList:
+    """Sorted, memory-compact collection of file paths.
+
+    Instead of keeping one `Path` object per file, files are grouped by their
+    directory: every directory is stored once (interned prefix) and the names
+    of the files inside it are packed in a single string, separated by a null
+    character (which can't be part of a filename). The size and modification
+    time of each file, if known, are packed in arrays. Iterating the list builds
+    the `Path` objects on demand, so it can be iterated several times without
+    keeping millions of objects alive.
+
+    Directories must be added with `add_dir`. Call `freeze` (or just iterate)
+    once all the directories have been added to get them sorted.
+    """
+
+    def __init__(self):
+        self._dirs: List[str] = []
+        self._names: List[str] = []
+        self._counts = array("L")
+        self._sizes = array("q")
+        self._mtimes = array("q")
+        self._size = 0
+        self._sorted = True
+
+    @classmethod
+    def from_paths(cls, paths: Iterable[Union[str, Path]]) -> "FileList":
+        """Builds a FileList from an iterable of filepaths. Stat data is unknown.
+
+        Args:
+            paths (Iterable[Union[str, Path]]): filepaths.
+
+        Returns:
+            FileList: file list containing `paths`.
+        """
+
+        groups = {}
+        for path in paths:
+            path = Path(path)
+            groups.setdefault(path.parent.as_posix(), []).append(path.name)
+
+        file_list = cls()
+        for dirpath, names in groups.items():
+            file_list.add_dir(dirpath, names)
+        return file_list.freeze()
+
+    def add_dir(self, dirpath: str, names: List[str], stats: Sequence = None):
+        """Adds the files `names` located in the folder `dirpath`.
+
+        Args:
+            dirpath (str): folder of the files, in posix format.
+            names (List[str]): names of the files. If it's empty, nothing is added.
+            stats (Sequence[os.stat_result], optional): stat results of the files,
+                in the same order as `names`. If None, stat data will be unknown.
+                Defaults to None.
+        """
+
+        if not names:
+            return
+
+        if self._dirs and dirpath < self._dirs[-1]:
+            self._sorted = False
+
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self._dirs.append(dirpath)
+        self._names.append(_SEP.join(names[i] for i in order))
+        self._counts.append(len(names))
+        self._size += len(names)
+
+        if stats is None:
+            self._sizes.extend([-1] * len(names))
+            self._mtimes.extend([-1] * len(names))
+        else:
+            self._sizes.extend(stats[i].st_size for i in order)
+            self._mtimes.extend(stats[i].st_mtime_ns for i in order)
+
+    def freeze(self) -> "FileList":
+        """Sorts the folders of the list. Returns the list itself."""
+
+        if self._sorted:
+            return self
+
+        offsets = [0]
+        for count in self._counts:
+            offsets.append(offsets[-1] + count)
+
+        order = sorted(range(len(self._dirs)), key=self._dirs.__getitem__)
+        sizes, mtimes = array("q"), array("q")
+        for i in order:
+            sizes.extend(self._sizes[offsets[i] : offsets[i + 1]])
+            mtimes.extend(self._mtimes[offsets[i] : offsets[i + 1]])
+
+        self._dirs = [self._dirs[i] for i in order]
+        self._names = [self._names[i] for i in order]
+        self._counts = array("L", (self._counts[i] for i in order))
+        self._sizes, self._mtimes = sizes, mtimes
+        self._sorted = True
+        return self
+
+    def iter_posix(self) -> Iterator[str]:
+        """Iterates over the files of the list, as posix strings."""
+
+        self.freeze()
+        for dirpath, names in zip(self._dirs, self._names):
+            prefix = dirpath.rstrip("/") + "/"
+            for name in names.split(_SEP):
+                yield prefix + name
+
+    def items(self) -> Iterator[Tuple[Path, Optional[FileStat]]]:
+        """Iterates over the files of the list and their stat data.
+
+        Yields:
+            Tuple[Path, Optional[FileStat]]: path and stat data of each file.
+                The stat data is None if it's unknown.
+        """
+
+        for index, filepath in enumerate(self.iter_posix()):
+            yield Path(filepath), self.stat(index)
+
+    def stat(self, index: int) -> Optional[FileStat]:
+        """Returns the stat data of the file in the position `index`.
+
+        Args:
+            index (int): position of the file in the list.
+
+        Returns:
+            Optional[FileStat]: stat data of the file, or None if it's unknown.
+        """
+
+        self.freeze()
+        if self._sizes[index] < 0:
+            return None
+        return FileStat(self._sizes[index], self._mtimes[index])
+
+    def total_size(self) -> int:
+        """Returns the sum of the sizes of the files with known stat data."""
+
+        return sum(size for size in self._sizes if size > 0)
+
+    def __iter__(self) -> Iterator[Path]:
+        for filepath in self.iter_posix():
+            yield Path(filepath)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __repr__(self):
+        return f"FileList(files={self._size}, folders={len(self._dirs)})"
@@ -0,0 +1,117 @@
+"""Buffered writer of the log file (cloud-backup.log)."""
+
+import atexit
+import json
+from datetime import datetime
+from threading import Lock
+from time import time
+from typing import IO, Optional
+
+from .config import settings
+
+
+class LogWriter:
+    """Writes the log messages to `settings.log_path`.
+
+    The file is opened once and kept open, with a buffered handle, so
+    logging a message doesn't need any syscall until the buffer is full.
+    The buffer is flushed by `flush`, which is called after every backup
+    entry and when the process exits.
+
+    Messages are written as plain text (`[date] message`) or, if
+    `settings.log_format` is `json`, as JSON lines. When the file grows
+    over `settings.log_max_size` bytes it's rotated: `cloud-backup.log`
+    is renamed to `cloud-backup.log.1`, `cloud-backup.log.1` to
+    `cloud-backup.log.2` and so on, keeping `settings.log_backups` files.
+
+    The writer is thread safe.
+    """
+
+    def __init__(self):
+        self._handle: Optional[IO[str]] = None
+        self._size = 0
+        self._lock = Lock()
+        self._second = None
+        self._timestamp = ""
+
+    def write(self, message: str, error: bool = False):
+        """Writes a message to the log file.
+
+        Args:
+            message (str): message to write.
+            error (bool, optional): True if the message describes an error.
+                Defaults to False.
+        """
+
+        with self._lock:
+            if self._handle is None:
+                self._open()
+
+            timestamp = self._get_timestamp()
+            if settings.log_format == "json":
+                record = {
+                    "time": timestamp,
+                    "level": "ERROR" if error else "INFO",
+                    "message": message,
+                }
+                line = json.dumps(record, ensure_ascii=False) + "\n"
+            else:
+                if error:
+                    message = "ERROR: " + message
+                line = f"[{timestamp}] {message}\n"
+
+            size = len(line.encode("utf-8"))
+            if 0 < settings.log_max_size < self._size + size and self._size:
+                self._rotate()
+
+            self._handle.write(line)
+            self._size += size
+
+    def flush(self):
+        """Writes the buffered messages to the log file."""
+
+        with self._lock:
+            if self._handle is not None:
+                self._handle.flush()
+
+    def close(self):
+        """Flushes and closes the log file. It's reopened if needed."""
+
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+    def _open(self):
+        self._handle = settings.log_path.open("at", encoding="utf-8")
+        self._size = self._handle.tell()
+
+    def _rotate(self):
+        self._handle.close()
+        self._handle = None
+
+        log_path = settings.log_path
+        backups = settings.log_backups
+        for index in range(backups - 1, 0, -1):
+            source = log_path.with_name(f"{log_path.name}.{index}")
+            if source.exists():
+                source.replace(log_path.with_name(f"{log_path.name}.{index + 1}"))
+
+        if backups > 0:
+            log_path.replace(log_path.with_name(f"{log_path.name}.1"))
+        else:
+            log_path.unlink()
+
+        self._open()
+
+    def _get_timestamp(self) -> str:
+        second = int(time())
+        if second != self._second:
+            self._second = second
+            now = datetime.fromtimestamp(second)
+            self._timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        return self._timestamp
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.close)
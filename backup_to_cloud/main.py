@@ -1,67 +1,531 @@
 """Main module to handle start of execution."""
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from itertools import chain
 from pathlib import Path
-from zipfile import ZipFile
+from stat import S_ISREG
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from zipfile import ZipFile, ZipInfo
 
 from .automatic import EntryType, get_automatic_entries
+from .config import settings
+from .deadline import Deadline
 from .exceptions import AutomaticEntryError, NoFilesFoundError
-from .upload import backup
-from .utils import ZIP_MIMETYPE, get_mimetype, list_files, log
+from .filelist import FileList, FileStat
+from .logger import log_writer
+from .memory import memory_budget
+from .metrics import metrics
+from .pipeline import QUEUE_SIZE, Pipeline
+from .state import (
+    load_resume_queue,
+    mimetype_cache,
+    run_history,
+    save_resume_queue,
+    upload_journal,
+)
+from .upload import CHUNK_SIZE, ChunkedUpload, backup
+from .utils import ZIP_MIMETYPE, get_mimetype, log
+from .walker import WalkStats, WalkTarget, iter_target, walk_entries
 
+# Files up to this size are read while the previous ones are uploaded.
+READ_AHEAD_SIZE = 1024**2
+# Chunks held by a zip pipeline besides its queue: the zip writer (up to
+# two), the block read from a file and the upload buffer (up to two).
+ZIP_BUFFERS = 5
 
-def create_backup():
+
+def create_backup(
+    names: Iterable[str] = None, deadline: float = None
+) -> Dict[str, Optional[List[str]]]:
     """Real main function.
 
+    Up to `settings.workers` entries are backed up at the same time, each
+    one in its own thread. If an entry fails, the error is logged and the
+    other entries go on. Once all of them end, the first error is raised.
+
+    Entries start longest first, according to the durations estimated from
+    `run_history`, so the longest entry doesn't start when the others are
+    ending. The duration of every successful entry is recorded.
+
+    The files of a `multiple-files` entry go through a `Pipeline`: they are
+    walked, read, added to the zip file (if `zip` is set) and uploaded at
+    the same time. Entries whose roots overlap are walked together first,
+    so each tree is still walked once.
+
+    Buffers are reserved from `memory_budget` (see `settings.max_memory`):
+    files are read ahead while it has room, and zip pipelines reserve the
+    memory of their chunks when they start, shrinking their queues to fit.
+
+    Once the deadline is reached, no new entry or file is started, and the
+    uploads in progress end. Zip files are uploaded completely. If every
+    entry was selected, the entries and files left are saved to
+    `settings.resume_queue_path`, and the next backup of every entry backs
+    up only them, without walking their folders again.
+
+    Args:
+        names (Iterable[str], optional): names of the entries to back up. If
+            None, every entry is backed up (or the work left by the last
+            backup, if it reached its deadline). Defaults to None.
+        deadline (float, optional): seconds after which no new work is
+            started. Defaults to None (no deadline).
+
     Raises:
         FileNotFoundError: if a file is not found in the filesystem.
         NoFilesFoundError: if the system is supposed to find multiple
             files and it doesn't find any files.
 
+    Returns:
+        Dict[str, Optional[List[str]]]: work left when the deadline was
+            reached: files left of every entry, by name (None if the whole
+            entry was left). Empty if the backup finished.
+    """
+
+    start = perf_counter()
+    success = False
+    limit = Deadline(deadline)
+    metrics.reset()
+    try:
+        _create_backup(names, limit)
+        success = True
+    finally:
+        mimetype_cache.save()
+        run_history.save()
+        upload_journal.compact()
+        metrics.record_run(start, success)
+        try:
+            metrics.write()
+        except OSError as exc:
+            log(exc)
+        log_writer.flush()
+
+    return limit.pending
+
+
+def _create_backup(names, deadline: Deadline):
+    queue = None
+    if names is None:
+        try:
+            queue = load_resume_queue()
+        except ValueError as exc:
+            log(exc)
+        if queue is not None:
+            log("Resuming the last backup, %d entries left", len(queue))
+
+    entries, entries_files = select_entries(names, queue)
+    try:
+        _run_entries(entries, entries_files, deadline)
+    finally:
+        if deadline.pending:
+            log(
+                "Deadline reached, %d entries left for the next backup",
+                len(deadline.pending),
+            )
+        if names is None:
+            save_resume_queue(deadline.pending)
+
+
+def select_entries(
+    names: Iterable[str] = None, queue: Dict[str, Optional[List[str]]] = None
+) -> Tuple[List, Dict[str, Union[FileList, List[str]]]]:
+    """Selects the entries to back up, and walks the ones whose roots overlap.
+
+    Entries without root path are excluded.
+
+    Args:
+        names (Iterable[str], optional): names of the entries. If None, every
+            entry is selected. Defaults to None.
+        queue (Dict[str, Optional[List[str]]], optional): work left by the
+            last backup (see `load_resume_queue`). If provided, only its
+            entries are selected, and the files left of the `multiple-files`
+            entries without zip are not walked again. Defaults to None.
+
+    Returns:
+        Tuple[List[BackupEntry], Dict[str, Union[FileList, List[str]]]]:
+            entries selected, and the files already known of some of them,
+            by name: walked together with other entries, or paths left by
+            the last backup. The other entries are walked when they are
+            backed up.
     """
 
-    automatic_entries = get_automatic_entries()
+    with metrics.stage("config"):
+        automatic_entries = get_automatic_entries()
+    selected = names if queue is None else queue
+    if selected is not None:
+        selected = set(selected)
+        automatic_entries = [x for x in automatic_entries if x.name in selected]
+    # Files left of entries without zip are backed up without walking again.
+    resumed_files = {
+        x.name: queue[x.name]
+        for x in automatic_entries
+        if queue is not None
+        and queue[x.name] is not None
+        and x.type == EntryType.multiple_files
+        and not x.zip
+    }
 
+    walk_stats = WalkStats()
+    with metrics.stage("walk"):
+        entries_files = walk_entries(
+            [
+                entry
+                for entry in automatic_entries
+                if entry.root_path is not None
+                and entry.type == EntryType.multiple_files
+                and entry.name not in resumed_files
+            ],
+            walk_stats,
+            overlapping_only=True,
+        )
+    entries_files.update(resumed_files)
+    metrics.inc("backup_walk_folders", walk_stats.dirs)
+    metrics.inc("backup_walk_files", walk_stats.files)
+
+    entries = []
     for entry in automatic_entries:
         if entry.root_path is None:
             log("Excluding entry %r", entry.name)
+        else:
+            entries.append(entry)
+    return entries, entries_files
+
+
+def _run_entries(entries, entries_files, deadline: Deadline):
+    estimates = {
+        entry.name: run_history.estimate(
+            entry.name, _get_size(entry, entries_files.get(entry.name))
+        )
+        for entry in entries
+    }
+    entries = order_entries(entries, estimates)
+
+    workers = min(settings.workers, len(entries)) or 1
+    with ThreadPoolExecutor(workers, thread_name_prefix="backup") as executor:
+        futures = [
+            executor.submit(
+                _run_entry,
+                entry,
+                entries_files.get(entry.name),
+                estimates[entry.name],
+                deadline,
+            )
+            for entry in entries
+        ]
+
+    errors = []
+    for entry, future in zip(entries, futures):
+        exc = future.exception()
+        if exc is not None:
+            log("Entry %r failed: %r", entry.name, exc)
+            errors.append(exc)
+
+    if errors:
+        raise errors[0]
+
+
+def order_entries(entries: List, estimates: Dict[str, Optional[float]]) -> List:
+    """Sorts the entries to minimize the duration of the backup.
+
+    The workers take the entries in order, so starting the longest entries
+    first (longest processing time first) keeps every worker busy until the
+    end, instead of leaving one long entry running alone. Entries without an
+    estimate go first, as they could be the longest. Ties keep their order.
+
+    Args:
+        entries (List[BackupEntry]): entries to sort.
+        estimates (Dict[str, Optional[float]]): estimated seconds of every
+            entry, by name, or None if they are unknown.
+
+    Returns:
+        List[BackupEntry]: entries, in the order they must start.
+    """
+
+    def key(entry):
+        estimate = estimates.get(entry.name)
+        return (estimate is not None, -(estimate or 0))
+
+    return sorted(entries, key=key)
+
+
+def _get_size(entry, files=None) -> Optional[int]:
+    """Returns the bytes to back up of an entry, if they are known."""
+
+    if entry.type == EntryType.single_file:
+        try:
+            return os.stat(entry.root_path).st_size
+        except OSError:
+            return None
+    if isinstance(files, FileList):
+        return files.total_size()
+    return None
+
+
+def _run_entry(entry, files, estimate: Optional[float], deadline: Deadline):
+    if deadline.expired():
+        deadline.defer_entry(entry.name)
+        return
+
+    start = perf_counter()
+    with metrics.entry(entry.name), metrics.stage("total"):
+        if estimate is not None:
+            metrics.set("backup_entry_estimated_seconds", estimate)
+        _backup_entry(entry, files, deadline)
+        run_history.record(
+            entry.name,
+            perf_counter() - start,
+            metrics.get("backup_entry_read_bytes"),
+            metrics.get("backup_entry_files"),
+        )
+    log_writer.flush()
+
+
+def backup_files(entry, paths: Iterable[str]) -> int:
+    """Backs up some files of a `multiple-files` entry, one by one.
+
+    Files which don't exist, are not regular files or are not selected by the
+    entry (root path, filter and metadata predicates) are skipped.
+
+    Args:
+        entry (BackupEntry): entry the files belong to.
+        paths (Iterable[str]): paths of the files.
+
+    Returns:
+        int: number of files backed up.
+    """
+
+    backed_up = 0
+    for path, stat in select_paths(entry, paths):
+        backup(path, get_mimetype(path, stat=stat), entry.folder, stat=stat)
+        backed_up += 1
+
+    return backed_up
+
+
+def select_paths(entry, paths: Iterable[str]) -> Iterator[Tuple[str, FileStat]]:
+    """Yields the path and stat data of the files of `paths` selected by a
+    `multiple-files` entry, sorted. Missing files are skipped."""
+
+    target = WalkTarget.from_entry(entry)
+    for path in sorted({Path(x).absolute().as_posix() for x in paths}):
+        dirpath = path.rsplit("/", 1)[0]
+        if not target.contains(dirpath) or not target.pattern.search(path):
+            continue
+
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            continue
+        if not S_ISREG(stat_result.st_mode) or not target.accepts(stat_result):
             continue
 
-        if entry.type == EntryType.multiple_files:
-            files = list_files(entry.root_path, entry.filter)
-
-            if not files:
-                raise NoFilesFoundError(
-                    "No files found for entry %r (path=%r, filter=%r)"
-                    % (entry.name, entry.root_path, entry.filter)
-                )
-
-            if not entry.zip:
-                for file in files:
-                    mimetype = get_mimetype(file)
-                    backup(file, mimetype, entry.folder)
-                continue
-
-            buffer = BytesIO()
-            min_file = min(files)
-            max_file = max(files)
-
-            while True:
-                try:
-                    Path(max_file).relative_to(min_file)
-                    break
-                except ValueError:
-                    min_file = Path(min_file).parent.as_posix()
-
-            with ZipFile(buffer, "w") as myzip:
-                for file in files:
-                    arcname = Path(file).relative_to(min_file).as_posix()
-                    myzip.write(file, arcname=arcname)
-
-            backup(buffer, ZIP_MIMETYPE, entry.folder, filename=entry.zipname)
-
-        elif entry.type == EntryType.single_file:
-            mimetype = get_mimetype(entry.root_path)
-            backup(entry.root_path, mimetype, entry.folder)
+        yield path, FileStat.from_stat(stat_result)
+
+
+def _backup_entry(entry, files, deadline: Deadline):
+    if entry.type == EntryType.multiple_files:
+        # Zip files can't be split, so their files are never deferred.
+        walk_deadline = None if entry.zip else deadline
+        stages = [
+            ("walk", lambda: _walk(entry, files, walk_deadline)),
+            ("read", lambda items: _read(items, mimetypes=not entry.zip), _release),
+        ]
+        if entry.zip:
+            root = WalkTarget.from_entry(entry).root
+            stages.append(("compress", lambda items: _compress(root, items)))
+            stages.append(("upload", lambda chunks: _upload_zip(entry, chunks)))
+            size = (QUEUE_SIZE + ZIP_BUFFERS) * CHUNK_SIZE
+            with memory_budget.reserve(size) as reserved:
+                queue_size = max(reserved // CHUNK_SIZE - ZIP_BUFFERS, 1)
+                pipeline = Pipeline(stages, queue_size, entry=entry.name)
+                utilization = pipeline.run()
+        else:
+            stages.append(
+                ("upload", lambda items: _upload_files(entry, items, deadline))
+            )
+            utilization = Pipeline(stages, entry=entry.name).run()
+
+        log(
+            "Utilization of the stages of entry %r: %s",
+            entry.name,
+            ", ".join(f"{k} {v:.0%}" for k, v in utilization.items()),
+        )
+
+    elif entry.type == EntryType.single_file:
+        metrics.set("backup_entry_files", 1)
+        mimetype = get_mimetype(entry.root_path)
+        backup(entry.root_path, mimetype, entry.folder)
+    else:
+        raise AutomaticEntryError(f"Invalid EntryType: {entry.type!r}")
+
+
+def _walk(entry, files=None, deadline: Deadline = None) -> Iterator:
+    """Yields the path and stat data of the files of an entry.
+
+    `files` can be the FileList of the entry, or a list of paths left by a
+    backup which reached its deadline. If it's None, the root of the entry is
+    walked now. Files found once the deadline is reached are deferred.
+    """
+
+    stats = None
+    if files is None:
+        stats = WalkStats()
+        items = iter_target(WalkTarget.from_entry(entry), stats)
+    elif isinstance(files, FileList):
+        items = files.items()
+    else:
+        items = select_paths(entry, files)
+
+    count = 0
+    for path, stat in items:
+        count += 1
+        path = Path(path).as_posix()
+        if deadline is not None and deadline.expired():
+            deadline.defer_file(entry.name, path)
         else:
-            raise AutomaticEntryError(f"Invalid EntryType: {entry.type!r}")
+            yield path, stat
+
+    if stats is not None:
+        metrics.inc("backup_walk_folders", stats.dirs)
+        metrics.inc("backup_walk_files", stats.files)
+    if not count and (files is None or isinstance(files, FileList)):
+        raise NoFilesFoundError(
+            "No files found for entry %r (path=%r, filter=%r)"
+            % (entry.name, entry.root_path, entry.filter)
+        )
+    metrics.set("backup_entry_files", count)
+
+
+def _read(items: Iterator, mimetypes: bool) -> Iterator:
+    """Reads the files up to `READ_AHEAD_SIZE`, and detects their MIME types
+    if `mimetypes` is True. Bigger files are read by the next stage, so they
+    are never loaded in the queues, and so are the files which don't fit in
+    `memory_budget`. The next stage releases the memory (see `_release`)."""
+
+    for path, stat in items:
+        mimetype = data = None
+        if mimetypes:
+            with metrics.stage("mimetype"):
+                mimetype = get_mimetype(path, stat=stat)
+
+        if (
+            stat is not None
+            and stat.size <= READ_AHEAD_SIZE
+            and memory_budget.try_acquire(stat.size)
+        ):
+            try:
+                with open(path, "rb") as file_handler:
+                    data = file_handler.read()
+            except BaseException:
+                memory_budget.release(stat.size, optional=True)
+                raise
+            metrics.inc("backup_entry_read_bytes", len(data))
+        yield path, stat, mimetype, data
+
+
+def _release(item):
+    """Releases the memory of a file read ahead by `_read`, if any."""
+
+    _, stat, _, data = item
+    if data is not None:
+        memory_budget.release(stat.size, optional=True)
+
+
+def _upload_files(entry, items: Iterator, deadline: Deadline):
+    for item in items:
+        path, stat, mimetype, data = item
+        try:
+            if deadline.expired():
+                deadline.defer_file(entry.name, path)
+            elif data is None:
+                backup(path, mimetype, entry.folder, stat=stat)
+            else:
+                filename = path.rsplit("/", 1)[-1]
+                media = BytesIO(data)
+                backup(media, mimetype, entry.folder, filename=filename, stat=stat)
+        finally:
+            _release(item)
+
+
+def _compress(root: str, items: Iterator) -> Iterator[bytes]:
+    """Builds a zip file with the files, yielding its content in chunks of
+    `CHUNK_SIZE` bytes (the last one can be smaller). Files are stored
+    relative to `root`."""
+
+    prefix_len = len(root.rstrip("/")) + 1
+    output = _ChunkWriter()
+
+    with ZipFile(output, "w") as zip_file:
+        for item in items:
+            path, _, _, data = item
+            try:
+                zinfo = ZipInfo.from_file(path, arcname=path[prefix_len:])
+                with zip_file.open(zinfo, "w") as dest:
+                    if data is not None:
+                        dest.write(data)
+                    else:
+                        metrics.inc("backup_entry_read_bytes", zinfo.file_size)
+                        yield from _compress_file(path, dest, output)
+            finally:
+                _release(item)
+            yield from output.pop(CHUNK_SIZE)
+
+    yield from output.pop(CHUNK_SIZE, final=True)
+
+
+def _compress_file(path: str, dest, output: "_ChunkWriter") -> Iterator[bytes]:
+    with open(path, "rb") as file_handler:
+        for block in iter(lambda: file_handler.read(CHUNK_SIZE), b""):
+            dest.write(block)
+            yield from output.pop(CHUNK_SIZE)
+
+
+def _upload_zip(entry, chunks: Iterator[bytes]):
+    chunks = _count_bytes(chunks, "backup_entry_compressed_bytes")
+    # Nothing is sent until the zip file has content, in case the walk fails.
+    first = next(chunks, b"")
+    media = ChunkedUpload(chain([first], chunks), ZIP_MIMETYPE)
+    backup(media, ZIP_MIMETYPE, entry.folder, filename=entry.zipname)
+
+
+def _count_bytes(chunks: Iterator[bytes], name: str) -> Iterator[bytes]:
+    for chunk in chunks:
+        metrics.inc(name, len(chunk))
+        yield chunk
+
+
+class _ChunkWriter:
+    """Unseekable file object keeping the data written until it's popped."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self, size: int, final: bool = False) -> List[bytes]:
+        """Returns the data written in chunks of exactly `size` bytes. The rest
+        is kept until it fills a chunk, unless `final` is True, in which case
+        it's returned as the last chunk."""
+
+        if self._size < size and not (final and self._size):
+            return []
+
+        data = b"".join(self._chunks)
+        end = len(data) if final else len(data) - len(data) % size
+        chunks = [data[x : x + size] for x in range(0, end, size)]
+        rest = data[end:]
+        self._chunks, self._size = ([rest] if rest else []), len(rest)
+        return chunks
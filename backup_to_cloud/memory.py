@@ -0,0 +1,125 @@
+"""Process-wide budget of the memory used by the buffers of the backups."""
+
+from contextlib import contextmanager
+from threading import Condition
+from time import perf_counter
+from typing import Iterator, Optional
+
+from .config import settings
+from .metrics import metrics
+
+# Part of the budget that optional buffers (read-ahead) can use. The rest is
+# always left to the buffers needed to go on, so they never wait forever.
+OPTIONAL_SHARE = 0.5
+
+
+class MemoryBudget:
+    """Bytes that the buffers of every running backup can use at the same time.
+
+    Before allocating a buffer, its size is reserved with `acquire` or
+    `reserve`, which wait while the budget is used up, and it's given back
+    with `release` once the buffer is freed. Buffers that only speed things
+    up, like files read ahead, use `try_acquire` instead: it doesn't wait,
+    and fails once the optional buffers use `OPTIONAL_SHARE` of the budget.
+
+    A buffer bigger than the memory left to the needed buffers counts as
+    that memory, so it waits until the other buffers are released instead
+    of waiting forever.
+
+    The budget is `settings.max_memory`, read on every reservation. If it's
+    None, reservations are only counted, and never wait.
+    """
+
+    def __init__(self):
+        self.used = 0
+        self.optional = 0
+        self._condition = Condition()
+
+    @staticmethod
+    def _get_limit() -> Optional[int]:
+        return settings.max_memory
+
+    def _count(self, size: int):
+        self.used += size
+        if self.used > metrics.get("backup_memory_peak_bytes"):
+            metrics.set("backup_memory_peak_bytes", self.used)
+
+    def acquire(self, size: int) -> int:
+        """Reserves memory for a buffer, waiting while the budget is used up.
+
+        Args:
+            size (int): size of the buffer, in bytes.
+
+        Returns:
+            int: bytes reserved, to be given back to `release`.
+        """
+
+        with self._condition:
+            limit = self._get_limit()
+            if limit is not None:
+                size = min(size, limit - int(limit * OPTIONAL_SHARE))
+                if self.used + size > limit:
+                    start = perf_counter()
+                    self._condition.wait_for(lambda: self.used + size <= limit)
+                    metrics.inc(
+                        "backup_entry_memory_wait_seconds", perf_counter() - start
+                    )
+            self._count(size)
+        return size
+
+    def try_acquire(self, size: int) -> bool:
+        """Reserves memory for an optional buffer, if there is enough.
+
+        Args:
+            size (int): size of the buffer, in bytes.
+
+        Returns:
+            bool: True if the memory was reserved. It must be given back to
+                `release` with `optional=True`.
+        """
+
+        with self._condition:
+            limit = self._get_limit()
+            if limit is not None and (
+                self.used + size > limit
+                or self.optional + size > limit * OPTIONAL_SHARE
+            ):
+                return False
+            self.optional += size
+            self._count(size)
+        return True
+
+    def release(self, size: int, optional: bool = False):
+        """Gives back the memory of a buffer that has been freed.
+
+        Args:
+            size (int): bytes reserved for the buffer.
+            optional (bool, optional): True if they were reserved by
+                `try_acquire`. Defaults to False.
+        """
+
+        with self._condition:
+            self.used -= size
+            if optional:
+                self.optional -= size
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, size: int) -> Iterator[int]:
+        """Reserves memory for a buffer while the context is active.
+
+        Args:
+            size (int): size of the buffer, in bytes.
+
+        Yields:
+            int: bytes reserved.
+        """
+
+        reserved = self.acquire(size)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+
+memory_budget = MemoryBudget()
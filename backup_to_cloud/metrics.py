@@ -0,0 +1,188 @@
+"""Metrics of the backups, exported in the Prometheus textfile format."""
+
+from contextlib import contextmanager
+from threading import Lock, local
+from time import perf_counter, time
+from typing import Dict, Iterator, Tuple
+
+from .config import settings
+from .state import atomic_write
+
+METRICS = {
+    "backup_entry_files": "Files selected by the entry.",
+    "backup_entry_read_bytes": "Bytes read from disk by the entry.",
+    "backup_entry_compressed_bytes": "Size of the zip files created by the entry.",
+    "backup_entry_uploaded_bytes": "Bytes uploaded to Google Drive by the entry.",
+    "backup_entry_api_calls": "Requests sent to the Google Drive API by the entry.",
+    "backup_entry_api_retries": "Requests to the Google Drive API retried by the entry.",
+    "backup_entry_stage_seconds": "Wall time spent by the entry in each stage.",
+    "backup_entry_estimated_seconds": "Duration of the entry estimated from history.",
+    "backup_entry_pipeline_busy_seconds": "Time each pipeline stage spent working.",
+    "backup_entry_pipeline_utilization": "Ratio of busy time of each pipeline stage.",
+    "backup_entry_memory_wait_seconds": "Time the entry waited for memory.",
+    "backup_walk_folders": "Folders scanned while listing the files of the entries.",
+    "backup_walk_files": "Files scanned while listing the files of the entries.",
+    "backup_memory_peak_bytes": "Peak memory reserved by the buffers of the backup.",
+    "backup_stage_seconds": "Wall time spent in each stage, outside the entries.",
+    "backup_last_run_duration_seconds": "Wall time of the last backup.",
+    "backup_last_run_success": "1 if the last backup finished without errors.",
+    "backup_last_run_timestamp_seconds": "Unix time when the last backup finished.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Registry of the metrics of a backup.
+
+    Every metric is a gauge, identified by its name and labels. Metrics whose
+    name starts with `backup_entry_` are labelled with the entry being backed
+    up by the current thread, set with `entry`.
+
+    The registry is thread safe. `write` exports it to `settings.metrics_path`
+    atomically, so the node_exporter textfile collector never reads a
+    partially written file.
+    """
+
+    def __init__(self):
+        self._values: Dict[Tuple[str, Labels], float] = {}
+        self._lock = Lock()
+        self._local = local()
+
+    def reset(self):
+        """Removes every metric."""
+
+        with self._lock:
+            self._values.clear()
+
+    @contextmanager
+    def entry(self, name: str) -> Iterator[None]:
+        """Labels the metrics recorded by the current thread with an entry.
+
+        Args:
+            name (str): name of the entry.
+        """
+
+        previous = getattr(self._local, "entry", None)
+        self._local.entry = name
+        try:
+            yield
+        finally:
+            self._local.entry = previous
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        """Increases a metric.
+
+        Args:
+            name (str): name of the metric. Must be defined in `METRICS`.
+            value (float, optional): increment. Defaults to 1.
+            **labels (str): labels of the metric, besides the entry.
+        """
+
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        """Sets the value of a metric.
+
+        Args:
+            name (str): name of the metric. Must be defined in `METRICS`.
+            value (float): new value.
+            **labels (str): labels of the metric, besides the entry.
+        """
+
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, name: str, **labels: str) -> float:
+        """Returns the value of a metric, or 0 if it wasn't recorded.
+
+        Args:
+            name (str): name of the metric.
+            **labels (str): labels of the metric, besides the entry.
+
+        Returns:
+            float: value of the metric.
+        """
+
+        with self._lock:
+            return self._values.get(self._key(name, labels), 0)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Adds the wall time of the block to the time spent in `stage`.
+
+        If the current thread is backing up an entry, the time is recorded
+        in `backup_entry_stage_seconds`, else in `backup_stage_seconds`.
+
+        Args:
+            stage (str): name of the stage.
+        """
+
+        if getattr(self._local, "entry", None) is None:
+            name = "backup_stage_seconds"
+        else:
+            name = "backup_entry_stage_seconds"
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, perf_counter() - start, stage=stage)
+
+    def render(self) -> str:
+        """Returns the metrics in the Prometheus text format."""
+
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), value in values:
+            if name != last_name:
+                lines.append(f"# HELP {name} {METRICS[name]}")
+                lines.append(f"# TYPE {name} gauge")
+                last_name = name
+
+            sample = name
+            if labels:
+                label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                sample += "{" + label_str + "}"
+            value = repr(value) if value % 1 else int(value)
+            lines.append(f"{sample} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def record_run(self, start: float, success: bool):
+        """Records the duration and the result of a backup.
+
+        Args:
+            start (float): value of `time.perf_counter` when the backup started.
+            success (bool): True if the backup finished without errors.
+        """
+
+        self.set("backup_last_run_duration_seconds", perf_counter() - start)
+        self.set("backup_last_run_success", int(success))
+        self.set("backup_last_run_timestamp_seconds", int(time()))
+
+    def write(self):
+        """Writes the metrics to `settings.metrics_path`, atomically."""
+
+        atomic_write(settings.metrics_path, self.render().encode("utf-8"))
+
+    def _key(self, name: str, labels: Dict[str, str]) -> Tuple[str, Labels]:
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric: {name!r}")
+
+        if name.startswith("backup_entry_"):
+            labels["entry"] = getattr(self._local, "entry", None) or ""
+        return name, tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+metrics = Metrics()
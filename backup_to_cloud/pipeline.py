@@ -0,0 +1,208 @@
+"""Runs the stages of a backup at the same time, connected by bounded queues."""
+
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import metrics
+
+QUEUE_SIZE = 8
+POLL_INTERVAL = 0.1
+
+StageFunc = Callable[..., Optional[Iterable]]
+_DONE = object()
+
+
+class _Aborted(Exception):
+    """Another stage of the pipeline failed."""
+
+
+class Stage:
+    """Stage of a pipeline and the time it spent working.
+
+    Args:
+        name (str): name of the stage.
+        func (StageFunc): function of the stage. It gets an iterator of the
+            items produced by the previous stage, and returns an iterable of
+            the items for the next stage. The function of the first stage is
+            called without arguments, and the last stage may return None.
+        discard (Callable, optional): called with every item produced by the
+            stage which the next stage never gets, because a stage ended
+            early or failed. Defaults to None.
+    """
+
+    def __init__(self, name: str, func: StageFunc, discard: Callable = None):
+        self.name = name
+        self.func = func
+        self.discard = discard
+        self.busy = 0.0
+        self.utilization = 0.0
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, utilization={self.utilization:.2f})"
+
+
+class Pipeline:
+    """Chain of stages, each one running in its own thread.
+
+    Consecutive stages are connected by queues of `queue_size` items. A stage
+    producing items faster than the next one consumes them blocks once the
+    queue is full, so the memory used by the items in flight is bounded.
+
+    If a stage fails, the other stages are stopped and `run` raises the
+    error. Items left in the queues are given to the `discard` function of
+    the stage which produced them. The time every stage spends waiting for
+    its neighbours is not counted as busy time. The utilization of a stage
+    is its busy time over the duration of the pipeline, so the stage with
+    the highest utilization is the bottleneck.
+
+    Args:
+        stages (List[Tuple]): name, function and optionally the discard
+            function of every stage, in order (see `Stage`).
+        queue_size (int, optional): max items between two stages. Defaults
+            to `QUEUE_SIZE`.
+        entry (str, optional): entry whose metrics are recorded by the
+            stages. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        stages: List[Tuple],
+        queue_size: int = QUEUE_SIZE,
+        entry: str = None,
+    ):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+
+        self.stages = [Stage(*stage) for stage in stages]
+        self.entry = entry
+        self._queues = [Queue(queue_size) for _ in self.stages[1:]]
+        self._abort = Event()
+        self._error: Optional[BaseException] = None
+        self._lock = Lock()
+
+    def run(self) -> Dict[str, float]:
+        """Runs the stages until all of them end.
+
+        Raises:
+            Exception: the first error raised by a stage.
+
+        Returns:
+            Dict[str, float]: utilization of every stage, by name.
+        """
+
+        start = perf_counter()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            inbox = self._queues[index - 1] if index else None
+            outbox = self._queues[index] if index < len(self._queues) else None
+            previous = self.stages[index - 1] if index else None
+            name = f"{self.entry or 'pipeline'}-{stage.name}"
+            thread = Thread(
+                target=self._run_stage,
+                args=(stage, inbox, outbox, previous),
+                name=name,
+            )
+            thread.daemon = True
+            threads.append(thread)
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for stage, queue in zip(self.stages, self._queues):
+            while not queue.empty():
+                _discard(stage, queue.get_nowait())
+
+        wall = perf_counter() - start
+        for stage in self.stages:
+            stage.utilization = stage.busy / wall if wall else 0.0
+            metrics.inc(
+                "backup_entry_pipeline_busy_seconds", stage.busy, stage=stage.name
+            )
+            metrics.set(
+                "backup_entry_pipeline_utilization",
+                stage.utilization,
+                stage=stage.name,
+            )
+
+        if self._error is not None:
+            raise self._error
+        return {stage.name: stage.utilization for stage in self.stages}
+
+    def _run_stage(
+        self,
+        stage: Stage,
+        inbox: Optional[Queue],
+        outbox: Optional[Queue],
+        previous: Optional[Stage],
+    ):
+        start = perf_counter()
+        waiting = [0.0]
+        try:
+            with metrics.entry(self.entry):
+                drained = []
+                if inbox is None:
+                    items = stage.func()
+                else:
+                    items = stage.func(self._iter(inbox, waiting, drained))
+
+                for item in items or ():
+                    if outbox is not None:
+                        self._put(outbox, waiting, item, stage)
+
+                if outbox is not None:
+                    self._put(outbox, waiting, _DONE, stage)
+                if inbox is not None and not drained:
+                    # Unblocks the previous stage if this one ended early.
+                    for item in self._iter(inbox, waiting, drained):
+                        _discard(previous, item)
+        except _Aborted:
+            pass
+        except BaseException as exc:  # pylint: disable=broad-except
+            with self._lock:
+                if self._error is None:
+                    self._error = exc
+            self._abort.set()
+        finally:
+            stage.busy = max(perf_counter() - start - waiting[0], 0.0)
+
+    def _iter(self, inbox: Queue, waiting: list, drained: list) -> Iterator:
+        while True:
+            start = perf_counter()
+            while True:
+                if self._abort.is_set():
+                    waiting[0] += perf_counter() - start
+                    raise _Aborted()
+                try:
+                    item = inbox.get(timeout=POLL_INTERVAL)
+                    break
+                except Empty:
+                    continue
+
+            waiting[0] += perf_counter() - start
+            if item is _DONE:
+                drained.append(True)
+                return
+            yield item
+
+    def _put(self, outbox: Queue, waiting: list, item, stage: Stage):
+        start = perf_counter()
+        try:
+            while True:
+                if self._abort.is_set():
+                    _discard(stage, item)
+                    raise _Aborted()
+                try:
+                    outbox.put(item, timeout=POLL_INTERVAL)
+                    return
+                except Full:
+                    continue
+        finally:
+            waiting[0] += perf_counter() - start
+
+
+def _discard(stage: Stage, item):
+    if item is not _DONE and stage.discard is not None:
+        stage.discard(item)
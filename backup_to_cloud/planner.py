@@ -0,0 +1,192 @@
+"""Plans a backup without uploading anything, estimating its cost."""
+
+import os
+from heapq import heapify, heapreplace
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from .automatic import EntryType
+from .filelist import FileList, FileStat
+from .main import order_entries, select_entries, select_paths
+from .state import load_resume_queue, run_history, upload_journal
+from .upload import CHUNK_SIZE, FILE_CHUNK_SIZE
+from .walker import WalkTarget, iter_target
+
+# Bytes of the end of central directory record of a zip file.
+ZIP_END_SIZE = 22
+# Bytes of the local header, data descriptor and central directory record of
+# every file of a zip file, besides its name (twice).
+ZIP_MEMBER_SIZE = 30 + 16 + 46
+
+
+class EntryPlan:
+    """Work of an entry in the next backup, and its estimated cost.
+
+    Args:
+        name (str): name of the entry.
+        zip (bool, optional): if True, the files are uploaded in a single zip
+            file. Defaults to False.
+        resumed (bool, optional): if True, the work was left by the last
+            backup when it reached its deadline. Defaults to False.
+
+    Attributes:
+        files (int): files to upload.
+        bytes (int): size of the files to upload.
+        skipped (int): files skipped as unchanged since an interrupted
+            backup uploaded them (see `upload_journal`).
+        skipped_bytes (int): size of the skipped files.
+        deleted (int): files expected by the entry which don't exist
+            anymore: its file, or files left by the last backup (also if
+            the entry doesn't select them anymore).
+        upload_bytes (int): bytes to upload: the size of the files, or of
+            the zip file.
+        api_calls (int): requests to the Google Drive API.
+        seconds (float): estimated duration of the backup of the entry.
+    """
+
+    def __init__(self, name: str, zip: bool = False, resumed: bool = False):
+        # pylint: disable=redefined-builtin
+        self.name = name
+        self.zip = zip
+        self.resumed = resumed
+        self.files = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.deleted = 0
+        self.upload_bytes = 0
+        self.api_calls = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        """Returns the attributes of the plan."""
+        return dict(vars(self))
+
+    def __repr__(self):
+        return f"EntryPlan({self.name!r}, files={self.files}, bytes={self.bytes})"
+
+
+def plan_backup(names: List[str] = None) -> List[EntryPlan]:
+    """Plans the backup that `create_backup` would do now, without uploading.
+
+    The entries are selected and walked as `create_backup` does, resuming
+    the work left by the last backup if it reached its deadline. Files are
+    not read: sizes come from the walk, zip sizes are computed from their
+    headers, and durations are estimated from `run_history`.
+
+    Args:
+        names (List[str], optional): names of the entries to plan. If None,
+            every entry is planned. Defaults to None.
+
+    Raises:
+        AutomaticEntryError, TypeError, ValueError: if the automatic file is
+            not valid (see `get_automatic_entries`).
+
+    Returns:
+        List[EntryPlan]: plan of every entry, in the order they would start.
+    """
+
+    queue = None
+    if names is None:
+        try:
+            queue = load_resume_queue()
+        except ValueError:
+            queue = None
+
+    entries, entries_files = select_entries(names, queue)
+    plans = {}
+    for entry in entries:
+        plan = EntryPlan(entry.name, entry.zip, resumed=queue is not None)
+        if entry.type == EntryType.single_file:
+            _plan_file(plan, entry, entry.root_path)
+        elif entry.zip:
+            _plan_zip(plan, entry, entries_files.get(entry.name))
+        else:
+            for path, stat in _iter_files(plan, entry, entries_files.get(entry.name)):
+                _plan_upload(plan, entry.folder, Path(path).name, stat)
+
+        plan.seconds = run_history.estimate(entry.name, plan.bytes)
+        plans[entry.name] = plan
+
+    estimates = {name: plan.seconds for name, plan in plans.items()}
+    return [plans[x.name] for x in order_entries(entries, estimates)]
+
+
+def _iter_files(plan: EntryPlan, entry, files) -> Iterator[Tuple[str, FileStat]]:
+    if files is None:
+        items = iter_target(WalkTarget.from_entry(entry))
+    elif isinstance(files, FileList):
+        items = files.items()
+    else:
+        items = select_paths(entry, files)
+
+    count = 0
+    for path, stat in items:
+        count += 1
+        if stat is None:
+            stat = FileStat.from_stat(os.stat(path))
+        yield Path(path).as_posix(), stat
+
+    if isinstance(files, list):
+        plan.deleted += len(set(files)) - count
+
+
+def _plan_file(plan: EntryPlan, entry, path: str):
+    try:
+        stat = FileStat.from_stat(os.stat(path))
+    except FileNotFoundError:
+        plan.deleted += 1
+        return
+    _plan_upload(plan, entry.folder, Path(path).name, stat)
+
+
+def _plan_upload(plan: EntryPlan, folder_id: str, filename: str, stat: FileStat):
+    if upload_journal.get_done(f"{folder_id}/{filename}", stat) is not None:
+        plan.skipped += 1
+        plan.skipped_bytes += stat.size
+        return
+
+    plan.files += 1
+    plan.bytes += stat.size
+    plan.upload_bytes += stat.size
+    # Search of the file, and a multipart upload or a resumable session.
+    if stat.size > FILE_CHUNK_SIZE:
+        plan.api_calls += 2 + -(-stat.size // FILE_CHUNK_SIZE)
+    else:
+        plan.api_calls += 2
+
+
+def _plan_zip(plan: EntryPlan, entry, files):
+    prefix_len = len(WalkTarget.from_entry(entry).root.rstrip("/")) + 1
+    size = ZIP_END_SIZE
+    for path, stat in _iter_files(plan, entry, files):
+        plan.files += 1
+        plan.bytes += stat.size
+        # Files are stored, not compressed.
+        size += ZIP_MEMBER_SIZE + 2 * len(path[prefix_len:].encode()) + stat.size
+
+    if plan.files:
+        plan.upload_bytes = size
+        # Search of the file, start of the session and its chunks.
+        plan.api_calls = 2 + size // CHUNK_SIZE + 1
+
+
+def estimate_duration(plans: List[EntryPlan], workers: int) -> float:
+    """Estimates the duration of a backup, running the entries in parallel.
+
+    Every entry starts, in order, on the first worker to be free.
+
+    Args:
+        plans (List[EntryPlan]): plans of the entries, in the order they
+            would start.
+        workers (int): entries backed up at the same time.
+
+    Returns:
+        float: estimated seconds until the last entry ends.
+    """
+
+    ends = [0.0] * max(min(workers, len(plans)), 1)
+    heapify(ends)
+    for plan in plans:
+        heapreplace(ends, ends[0] + (plan.seconds or 0))
+    return max(ends)
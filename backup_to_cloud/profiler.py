@@ -0,0 +1,284 @@
+"""Profiles the commands, producing flamegraph-ready output."""
+
+import sys
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, Thread, get_ident, setprofile
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+PROFILERS = ("sample", "cprofile")
+SAMPLE_INTERVAL = 0.005
+STAGES = ("walk", "sniff", "read", "compress", "upload", "api wait", "other")
+
+# Rules to find the stage of a stack. The innermost frame matching a rule
+# decides the stage. Each rule is (stage, filename suffixes, function names).
+_STAGE_RULES = (
+    ("api wait", ("/http/client.py", "/ssl.py", "/socket.py"), ()),
+    ("api wait", ("/httplib2/__init__.py",), ()),
+    ("compress", ("/zipfile.py", "/zipfile/__init__.py"), ()),
+    ("read", (), ("read_bytes", "read_text", "_read")),
+    ("sniff", (), ("get_mimetype", "sniff_mimetype")),
+    ("walk", ("/backup_to_cloud/walker.py", "/backup_to_cloud/filelist.py"), ()),
+    ("upload", ("/backup_to_cloud/upload.py", "/googleapiclient/http.py"), ()),
+)
+
+# Functions where threads wait for work or for other threads, as
+# (filename suffix, function names). Builtins are named like cProfile does.
+_IDLE_RULES = (
+    ("/threading.py", ("wait", "wait_for", "join", "_wait_for_tstate_lock")),
+    ("/concurrent/futures/thread.py", ("_worker",)),
+    ("/selectors.py", ("select",)),
+    ("~", ("<method 'acquire' of '_thread.lock' objects>",)),
+    ("~", ("<method 'get' of '_queue.SimpleQueue' objects>",)),
+)
+
+
+def get_stage(filename: str, function: str) -> Optional[str]:
+    """Returns the stage a function belongs to.
+
+    Args:
+        filename (str): file where the function is defined.
+        function (str): name of the function.
+
+    Returns:
+        Optional[str]: stage of the function, or None if it's unknown.
+    """
+
+    filename = filename.replace("\\", "/")
+    for stage, suffixes, functions in _STAGE_RULES:
+        if function in functions or filename.endswith(suffixes):
+            return stage
+    return None
+
+
+def is_idle(filename: str, function: str) -> bool:
+    """Checks if a thread running a function is waiting.
+
+    Args:
+        filename (str): file where the function is defined.
+        function (str): name of the function.
+
+    Returns:
+        bool: True if the function waits for work or for other threads.
+    """
+
+    filename = filename.replace("\\", "/")
+    for suffix, functions in _IDLE_RULES:
+        if function in functions and filename.endswith(suffix):
+            return True
+    return False
+
+
+class Profiler:
+    """Profiles the code run inside a `with` block.
+
+    If `profiler` is `sample`, the stacks of every thread are sampled every
+    `SAMPLE_INTERVAL` seconds by a background thread. The stacks are written
+    in the collapsed format (`<name>.folded`), which can be rendered with
+    flamegraph.pl or speedscope. If it's `cprofile`, the code and the threads
+    it starts are run under `cProfile`, and their stats are merged and
+    written to `<name>.pstats`.
+
+    In both cases, a summary of the time spent in each stage is written to
+    `<name>.txt`. The time of the threads waiting for work or for other
+    threads is left out of it.
+
+    Args:
+        name (str): name of the profiled command.
+        output_dir (Path): folder to write the results into.
+        profiler (str, optional): `sample` or `cprofile`. Defaults to `sample`.
+    """
+
+    def __init__(self, name: str, output_dir: Path, profiler: str = "sample"):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Invalid profiler: {profiler!r}")
+
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.name = name
+        self.profiler = profiler
+        self.base_path = Path(output_dir).joinpath(f"profile-{name}-{timestamp}")
+        self.paths: List[Path] = []
+        self.samples: Dict[Tuple, int] = Counter()
+        self.ticks = 0
+        self.wall_time = 0.0
+
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+        self._cprofile = None
+        self._cprofiles: list = []
+        self._lock = Lock()
+        self._start = 0.0
+
+    def __enter__(self) -> "Profiler":
+        self._start = perf_counter()
+        if self.profiler == "sample":
+            self._thread = Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        else:
+            import cProfile
+
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            self._cprofiles.append(self._cprofile)
+            setprofile(self._profile_thread)
+        return self
+
+    def __exit__(self, *args):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        else:
+            setprofile(None)
+            self._cprofile.disable()
+
+        self.wall_time = perf_counter() - self._start
+        self.write()
+
+    def _profile_thread(self, *args):
+        # Run by each thread started while profiling, on its first call.
+        import cProfile
+
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 only one profile can run, and it sees every thread.
+            return
+
+        with self._lock:
+            self._cprofiles.append(profile)
+
+    def _cprofile_stats(self):
+        import pstats
+
+        with self._lock:
+            return pstats.Stats(*self._cprofiles)
+
+    def _sample(self):
+        own_id = get_ident()
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.ticks += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stage_times(self) -> Dict[str, float]:
+        """Returns the seconds spent in each stage.
+
+        With the sampling profiler, the time of each stage is estimated from
+        its number of samples. The time of every thread is added up, so the
+        total can be bigger than the wall time. Idle threads are left out.
+
+        Returns:
+            Dict[str, float]: seconds spent in each stage of `STAGES`.
+        """
+
+        times = dict.fromkeys(STAGES, 0.0)
+        if self._cprofile is not None:
+            stats = self._cprofile_stats().stats
+            shares: Dict[Tuple, Dict[str, float]] = {}
+            for func, stat in stats.items():
+                if is_idle(func[0], func[2]):
+                    continue
+                for stage, share in _get_shares(stats, func, shares).items():
+                    times[stage] += stat[2] * share
+            return times
+
+        interval = self.wall_time / self.ticks if self.ticks else 0
+        for stack, count in self.samples.items():
+            if is_idle(*stack[-1][:2]):
+                continue
+
+            stage = "other"
+            for filename, function, _ in reversed(stack):
+                frame_stage = get_stage(filename, function)
+                if frame_stage:
+                    stage = frame_stage
+                    break
+            times[stage] += count * interval
+        return times
+
+    def write(self):
+        """Writes the results of the profiler."""
+
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        self.paths = []
+
+        if self._cprofile is not None:
+            path = self.base_path.with_suffix(".pstats")
+            self._cprofile_stats().dump_stats(path.as_posix())
+        else:
+            path = self.base_path.with_suffix(".folded")
+            lines = []
+            for stack, count in sorted(self.samples.items()):
+                frames = ";".join(_format_frame(*frame) for frame in stack)
+                lines.append(f"{frames} {count}")
+            path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        self.paths.append(path)
+
+        path = self.base_path.with_suffix(".txt")
+        path.write_text(self.summary(), encoding="utf-8")
+        self.paths.append(path)
+
+    def summary(self) -> str:
+        """Returns a summary of the time spent in each stage."""
+
+        times = self.stage_times()
+        total = sum(times.values())
+
+        lines = [f"Profile of {self.name} ({self.profiler})"]
+        lines.append(f"Wall time: {self.wall_time:.3f} s")
+        if self._cprofile is None:
+            samples = sum(self.samples.values())
+            idle = sum(
+                count
+                for stack, count in self.samples.items()
+                if is_idle(*stack[-1][:2])
+            )
+            lines.append(f"Samples: {samples} in {self.ticks} ticks ({idle} idle)")
+        lines.append("")
+        lines.append(f"{'Stage':<10} {'Time (s)':>10} {'Percent':>8}")
+        for stage in STAGES:
+            percent = 100 * times[stage] / total if total else 0
+            lines.append(f"{stage:<10} {times[stage]:>10.3f} {percent:>7.1f}%")
+
+        return "\n".join(lines) + "\n"
+
+
+def _get_shares(stats: dict, func: Tuple, shares: dict) -> Dict[str, float]:
+    # Functions without stage, like the builtins, take the stages of their
+    # callers, weighted by the time spent in the function by each caller.
+    if func in shares:
+        return shares[func]
+
+    filename, _, function = func
+    stage = get_stage(filename, function)
+    callers = stats[func][4] if func in stats else None
+    if stage or not callers:
+        shares[func] = {stage or "other": 1.0}
+        return shares[func]
+
+    shares[func] = {"other": 1.0}  # Recursive calls
+    total = sum(x[2] for x in callers.values())
+    result: Dict[str, float] = Counter()
+    for caller, caller_stat in callers.items():
+        weight = caller_stat[2] / total if total else 1 / len(callers)
+        for stage, share in _get_shares(stats, caller, shares).items():
+            result[stage] += weight * share
+
+    shares[func] = dict(result)
+    return shares[func]
+
+
+def _format_frame(filename: str, function: str, lineno: int) -> str:
+    return f"{function} ({Path(filename).name}:{lineno})".replace(";", ":")
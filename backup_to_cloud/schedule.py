@@ -0,0 +1,168 @@
+"""Cron-style schedules of the backup entries."""
+
+from datetime import datetime, timedelta
+from typing import FrozenSet, Optional
+
+# Name, minimum and maximum value of each field of a cron expression.
+FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+)
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+NAMES = {
+    "month": ("jan feb mar apr may jun jul aug sep oct nov dec", 1),
+    "weekday": ("sun mon tue wed thu fri sat", 0),
+}
+MAX_YEARS = 8
+
+
+class CronSchedule:
+    """Schedule defined by a cron expression, like `'30 2 * * 1-5'`.
+
+    The expression has five fields: minute, hour, day of the month, month
+    and day of the week (0 or 7 is Sunday). Each field can be `*`, a number,
+    a range (`1-5`), a list (`1,15`) and a step (`*/15`, `0-30/10`). Months
+    and days of the week can also be names (`jan`, `mon-fri`). The aliases
+    `@yearly`, `@monthly`, `@weekly`, `@daily` and `@hourly` are valid too.
+
+    Like cron, if both the day of the month and the day of the week are
+    restricted, a day matches if any of them matches. Times are local.
+
+    Args:
+        expression (str): cron expression.
+
+    Raises:
+        ValueError: if the expression is not valid.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != len(FIELDS):
+            raise ValueError(f"Invalid cron expression: {expression!r}")
+
+        values = [_parse_field(x, *y) for x, y in zip(fields, FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = values
+        self.weekdays = frozenset(x % 7 for x in weekdays)
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def __eq__(self, other):
+        if not isinstance(other, CronSchedule):
+            return NotImplemented
+        return self.expression == other.expression
+
+    def __hash__(self):
+        return hash(self.expression)
+
+    def __repr__(self):
+        return f"CronSchedule({self.expression!r})"
+
+    def _matches_day(self, date: datetime) -> bool:
+        day = date.day in self.days
+        weekday = (date.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, date: datetime) -> bool:
+        """Returns True if the schedule runs at the minute of `date`."""
+
+        return (
+            date.minute in self.minutes
+            and date.hour in self.hours
+            and date.month in self.months
+            and self._matches_day(date)
+        )
+
+    def next_after(self, date: datetime) -> datetime:
+        """Returns the first time the schedule runs after `date`.
+
+        Args:
+            date (datetime): reference time.
+
+        Raises:
+            ValueError: if the schedule never runs (like `0 0 30 2 *`).
+
+        Returns:
+            datetime: start of the next minute the schedule runs, later
+                than `date`.
+        """
+
+        date = date.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = date.replace(year=date.year + MAX_YEARS, day=1)
+        while date < limit:
+            if date.month not in self.months:
+                month = date.month % 12 + 1
+                year = date.year + (month == 1)
+                date = date.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._matches_day(date):
+                date = date.replace(hour=0, minute=0) + timedelta(days=1)
+            elif date.hour not in self.hours:
+                date = date.replace(minute=0) + timedelta(hours=1)
+            elif date.minute not in self.minutes:
+                date += timedelta(minutes=1)
+            else:
+                return date
+
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+def _parse_field(field: str, name: str, minimum: int, maximum: int) -> FrozenSet[int]:
+    values = set()
+    for part in field.lower().split(","):
+        interval, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if interval == "*":
+                start, end = minimum, maximum
+            elif "-" in interval:
+                start, end = (_parse_value(x, name) for x in interval.split("-", 1))
+            else:
+                start = end = _parse_value(interval, name)
+                if step != 1:
+                    end = maximum
+        except ValueError:
+            raise ValueError(f"Invalid {name}: {field!r}") from None
+
+        if step < 1 or not minimum <= start <= end <= maximum:
+            raise ValueError(f"Invalid {name}: {field!r}")
+        values.update(range(start, end + 1, step))
+
+    return frozenset(values)
+
+
+def _parse_value(value: str, name: str) -> int:
+    if name in NAMES and value.isalpha():
+        names, offset = NAMES[name]
+        return names.split().index(value) + offset
+    return int(value)
+
+
+def parse_schedule(schedule: Optional[str]) -> Optional[CronSchedule]:
+    """Parses a cron expression.
+
+    Args:
+        schedule (Optional[str]): cron expression to parse.
+
+    Raises:
+        ValueError: if `schedule` is not a valid cron expression.
+
+    Returns:
+        Optional[CronSchedule]: schedule, or None if `schedule` is None.
+    """
+
+    if schedule is None:
+        return None
+    return CronSchedule(schedule)
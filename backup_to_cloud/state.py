@@ -0,0 +1,440 @@
+"""Handles the files stored in the local state folder."""
+
+import json
+import os
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Dict, List, Optional, Set
+
+from .config import settings
+from .filelist import FileStat
+
+
+def atomic_write(path: Path, data: bytes):
+    """Writes `data` to `path` atomically.
+
+    The data is written to a temporary file in the same folder, which then
+    replaces `path`. Readers never see a partially written file. The parent
+    folder is created if it doesn't exist.
+
+    Args:
+        path (Path): path of the file to write.
+        data (bytes): content of the file.
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per thread, as entries backed up in parallel can write the same file.
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{get_ident()}.tmp")
+    with temp_path.open("wb") as file_handler:
+        file_handler.write(data)
+        file_handler.flush()
+        os.fsync(file_handler.fileno())
+    os.replace(temp_path, path)
+
+
+class MimeTypeCache:
+    """Persistent cache of the MIME types detected by content sniffing.
+
+    Results are keyed by filepath and only valid while the size and
+    modification time of the file don't change. The cache is loaded from
+    `settings.mimetype_cache_path` the first time it's used and written
+    back by `save`, which drops the files that no longer exist.
+    """
+
+    def __init__(self):
+        self._data: Optional[Dict[str, List]] = None
+        self._used: Set[str] = set()
+        self._dirty = False
+        self._lock = Lock()
+
+    def _load(self) -> Dict[str, List]:
+        if self._data is None:
+            try:
+                self._data = json.loads(settings.mimetype_cache_path.read_text())
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, filepath: str, stat: FileStat) -> Optional[str]:
+        """Returns the cached MIME type of a file.
+
+        Args:
+            filepath (str): path of the file.
+            stat (FileStat): current stat data of the file.
+
+        Returns:
+            Optional[str]: MIME type, or None if it's not cached or the file
+                changed since it was cached.
+        """
+
+        with self._lock:
+            cached = self._load().get(str(filepath))
+            self._used.add(str(filepath))
+        if cached and cached[0] == stat.size and cached[1] == stat.mtime_ns:
+            return cached[2]
+        return None
+
+    def set(self, filepath: str, stat: FileStat, mime_type: str):
+        """Stores the MIME type of a file.
+
+        Args:
+            filepath (str): path of the file.
+            stat (FileStat): current stat data of the file.
+            mime_type (str): MIME type of the file.
+        """
+
+        with self._lock:
+            self._load()[str(filepath)] = [stat.size, stat.mtime_ns, mime_type]
+            self._used.add(str(filepath))
+            self._dirty = True
+
+    def save(self):
+        """Writes the cache to disk, if it has changed since it was loaded.
+
+        Files not looked up since the last save are dropped from the cache
+        if they no longer exist. The others are kept, as the backups of
+        some entries don't look up the files of the rest.
+        """
+
+        with self._lock:
+            if self._data is None:
+                return
+
+            stale = [
+                x for x in self._data if x not in self._used and not os.path.exists(x)
+            ]
+            for filepath in stale:
+                del self._data[filepath]
+            self._used = set()
+            if not self._dirty and not stale:
+                return
+
+            data = json.dumps(self._data, separators=(",", ":")).encode("utf-8")
+            atomic_write(settings.mimetype_cache_path, data)
+            self._dirty = False
+
+    def unload(self):
+        """Forgets the loaded cache, without saving it.
+
+        The cache is loaded again the next time it's used, from the current
+        `settings.mimetype_cache_path`.
+        """
+
+        with self._lock:
+            self._data = None
+            self._used = set()
+            self._dirty = False
+
+
+mimetype_cache = MimeTypeCache()
+
+
+def load_resume_queue() -> Optional[Dict[str, Optional[List[str]]]]:
+    """Loads the work left by the last backup when its deadline was reached.
+
+    Returns:
+        Optional[Dict[str, Optional[List[str]]]]: files left of every entry,
+            by name (None if the whole entry was left), or None if there is
+            no work left.
+    """
+
+    try:
+        queue = json.loads(settings.resume_queue_path.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        raise ValueError(f"Invalid resume queue: {exc}") from exc
+
+    if not isinstance(queue, dict):
+        raise ValueError("Invalid resume queue: must be a mapping of entries")
+    return queue
+
+
+def save_resume_queue(queue: Optional[Dict[str, Optional[List[str]]]]):
+    """Saves the work left by a backup, for the next run.
+
+    Args:
+        queue (Optional[Dict[str, Optional[List[str]]]]): files left of every
+            entry, by name (None if the whole entry was left). If it's empty
+            or None, the saved queue is removed.
+    """
+
+    if queue:
+        data = json.dumps(queue, indent=2, sort_keys=True).encode("utf-8")
+        atomic_write(settings.resume_queue_path, data)
+        return
+
+    try:
+        settings.resume_queue_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# Weight of the last run in the averages of the run history.
+HISTORY_WEIGHT = 0.5
+# Bytes per second assumed for entries never backed up, if no entry was.
+DEFAULT_THROUGHPUT = 10 * 1024**2
+
+
+class RunHistory:
+    """Persistent history of the duration of the entries' backups.
+
+    For every entry, the duration, bytes read and files of its last
+    successful backups are kept as exponential moving averages, so the
+    estimates follow the entry when it grows or shrinks. The history is
+    loaded from `settings.history_path` the first time it's used and
+    written back by `save`.
+    """
+
+    def __init__(self):
+        self._data: Optional[Dict[str, Dict[str, float]]] = None
+        self._dirty = False
+        self._lock = Lock()
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        if self._data is None:
+            try:
+                self._data = json.loads(settings.history_path.read_text())
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def record(self, name: str, seconds: float, size: int, files: int):
+        """Records a successful backup of an entry.
+
+        Args:
+            name (str): name of the entry.
+            seconds (float): duration of the backup.
+            size (int): bytes read by the backup.
+            files (int): files backed up.
+        """
+
+        new = {"seconds": seconds, "bytes": size, "files": files}
+        with self._lock:
+            data = self._load()
+            old = data.get(name)
+            if old is not None:
+                new = {
+                    key: HISTORY_WEIGHT * value + (1 - HISTORY_WEIGHT) * old[key]
+                    for key, value in new.items()
+                }
+            new["runs"] = (old or {}).get("runs", 0) + 1
+            data[name] = new
+            self._dirty = True
+
+    def estimate(self, name: str, size: Optional[int] = None) -> Optional[float]:
+        """Estimates the duration of the next backup of an entry.
+
+        The duration of the previous backups is scaled to the current size
+        of the entry, if it's known. Entries never backed up are estimated
+        from their size and the throughput of the other entries.
+
+        Args:
+            name (str): name of the entry.
+            size (Optional[int], optional): current size of the entry, in
+                bytes, if it's known. Defaults to None.
+
+        Returns:
+            Optional[float]: estimated seconds, or None if the entry was
+                never backed up and its size is unknown.
+        """
+
+        with self._lock:
+            data = self._load()
+            record = data.get(name)
+            if record is not None:
+                if size is None or not record["bytes"]:
+                    return record["seconds"]
+                return record["seconds"] * size / record["bytes"]
+
+            if size is None:
+                return None
+            seconds = sum(x["seconds"] for x in data.values())
+            total_size = sum(x["bytes"] for x in data.values())
+
+        throughput = total_size / seconds if seconds and total_size else None
+        return size / (throughput or DEFAULT_THROUGHPUT)
+
+    def save(self):
+        """Writes the history to disk, if it has changed since it was loaded."""
+
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._data, separators=(",", ":")).encode("utf-8")
+            atomic_write(settings.history_path, data)
+            self._dirty = False
+
+    def unload(self):
+        """Forgets the loaded history, without saving it."""
+
+        with self._lock:
+            self._data = None
+            self._dirty = False
+
+
+run_history = RunHistory()
+
+
+class UploadJournal:
+    """Durable journal of the uploads of the running backups.
+
+    Every change of an upload is appended as a JSON line to
+    `settings.upload_journal_path`, and flushed before going on: `planned`
+    when it starts, `uploading` with the URI of its resumable session and
+    the last offset confirmed by the server after every chunk, and `done`
+    with the id of the file once it's uploaded. Uploads are keyed by their
+    target (folder id and filename), and only valid while the size and
+    modification time of the local file don't change.
+
+    If the process dies, the next backup skips the files already done and
+    resumes the interrupted sessions. When a backup ends, `compact` keeps
+    only the sessions that could be resumed.
+    """
+
+    def __init__(self):
+        self._data: Optional[Dict[str, dict]] = None
+        self._file = None
+        self._lock = Lock()
+
+    def _load(self) -> Dict[str, dict]:
+        if self._data is None:
+            self._data = {}
+            try:
+                lines = settings.upload_journal_path.read_bytes().splitlines()
+            except OSError:
+                lines = []
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                    self._data[record["key"]] = record
+                except (KeyError, TypeError, ValueError):
+                    # The last line is truncated if the process died writing it.
+                    continue
+        return self._data
+
+    def _append(self, key: str, stat: FileStat, status: str, **fields):
+        record = {"key": key, "status": status, "size": stat.size}
+        record.update(mtime_ns=stat.mtime_ns, **fields)
+        with self._lock:
+            self._load()[key] = record
+            if self._file is None:
+                settings.upload_journal_path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = settings.upload_journal_path.open("ab")
+            self._file.write(json.dumps(record, separators=(",", ":")).encode())
+            self._file.write(b"\n")
+            self._file.flush()
+
+    def _get(self, key: str, stat: FileStat, status: str) -> Optional[dict]:
+        with self._lock:
+            record = self._load().get(key)
+        if (
+            record is not None
+            and record["status"] == status
+            and record["size"] == stat.size
+            and record["mtime_ns"] == stat.mtime_ns
+        ):
+            return record
+        return None
+
+    def plan(self, key: str, stat: FileStat):
+        """Records that an upload is starting.
+
+        An interrupted session of the same file is kept, to be resumed.
+
+        Args:
+            key (str): target of the upload.
+            stat (FileStat): stat data of the file uploaded.
+        """
+
+        if self.get_session(key, stat) is None:
+            self._append(key, stat, "planned")
+
+    def progress(self, key: str, stat: FileStat, uri: str, offset: int):
+        """Records the progress of a resumable upload.
+
+        Args:
+            key (str): target of the upload.
+            stat (FileStat): stat data of the file uploaded.
+            uri (str): URI of the resumable session.
+            offset (int): bytes confirmed by the server.
+        """
+
+        self._append(key, stat, "uploading", uri=uri, offset=offset)
+
+    def done(self, key: str, stat: FileStat, file_id: Optional[str]):
+        """Records that an upload has ended.
+
+        Args:
+            key (str): target of the upload.
+            stat (FileStat): stat data of the file uploaded.
+            file_id (Optional[str]): id of the uploaded file.
+        """
+
+        self._append(key, stat, "done", id=file_id)
+
+    def get_done(self, key: str, stat: FileStat) -> Optional[dict]:
+        """Returns the record of an upload done, if the file didn't change.
+
+        Args:
+            key (str): target of the upload.
+            stat (FileStat): current stat data of the file.
+
+        Returns:
+            Optional[dict]: record of the upload, or None if the file was not
+                uploaded or it changed since then.
+        """
+
+        return self._get(key, stat, "done")
+
+    def get_session(self, key: str, stat: FileStat) -> Optional[str]:
+        """Returns the resumable session of an interrupted upload.
+
+        Args:
+            key (str): target of the upload.
+            stat (FileStat): current stat data of the file.
+
+        Returns:
+            Optional[str]: URI of the session, or None if there is no
+                interrupted upload or the file changed since it started.
+        """
+
+        record = self._get(key, stat, "uploading")
+        return record["uri"] if record else None
+
+    def compact(self):
+        """Rewrites the journal, keeping only the interrupted uploads.
+
+        Called when a backup ends, the uploads done are not needed anymore.
+        If no upload is left, the journal is removed.
+        """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+            sessions = [x for x in self._load().values() if x["status"] == "uploading"]
+            self._data = {x["key"]: x for x in sessions}
+            if sessions:
+                lines = (json.dumps(x, separators=(",", ":")) for x in sessions)
+                data = "".join(x + "\n" for x in lines).encode()
+                atomic_write(settings.upload_journal_path, data)
+                return
+
+            try:
+                settings.upload_journal_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def unload(self):
+        """Closes the journal and forgets it, without compacting it."""
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._data = None
+
+
+upload_journal = UploadJournal()
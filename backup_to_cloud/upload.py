@@ -1,61 +1,186 @@
 """Handles the upload of files to Google Drive via Google Drive API v3."""
 
+from contextlib import ExitStack
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from random import random
+from time import sleep
+from typing import BinaryIO, Iterable, Union
 
 from googleapiclient.discovery import Resource
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaIoBaseUpload, MediaUpload
 
+from .drive import get_google_drive_services
 from .exceptions import MultipleFilesError
-from .utils import get_google_drive_services, log
+from .filelist import FileStat
+from .memory import memory_budget
+from .metrics import metrics
+from .state import upload_journal
+from .utils import log
 
-FD = Union[Path, str, BytesIO]
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Chunks of resumable uploads must be multiples of 256 KiB.
+CHUNK_SIZE = 4 * 256 * 1024
+# Files bigger than a chunk are uploaded in resumable sessions.
+FILE_CHUNK_SIZE = 32 * 256 * 1024
+# Statuses of resumable sessions which expired or are unknown to the server.
+EXPIRED_STATUSES = {404, 410}
 
 
-def backup(file_data: FD, mimetype: str, folder_id: str, filename: str = None) -> dict:
+class ChunkedUpload(MediaUpload):
+    """Content of unknown size, produced while it's uploaded.
+
+    The content is sent in a resumable upload, in chunks of `chunksize`
+    bytes. Only the data not confirmed by the server yet is kept in memory,
+    so a chunk can be sent again if its request fails.
+
+    Args:
+        chunks (Iterable[bytes]): pieces of the content, of any size.
+        mimetype (str): MIME type of the content.
+        chunksize (int, optional): bytes sent in every request. Defaults
+            to `CHUNK_SIZE`.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], mimetype: str, chunksize=CHUNK_SIZE):
+        super().__init__()
+        self.bytes_read = 0
+        self._chunks = iter(chunks)
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return None
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        # Data before `begin` has been confirmed by the server.
+        del self._buffer[: begin - self._offset]
+        self._offset = begin
+
+        while len(self._buffer) < length:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+            self.bytes_read += len(chunk)
+
+        return bytes(self._buffer[:length])
+
+
+FD = Union[Path, str, BytesIO, ChunkedUpload]
+
+
+def backup(
+    file_data: FD,
+    mimetype: str,
+    folder_id: str,
+    filename: str = None,
+    stat: FileStat = None,
+) -> dict:
     """Backups the file.
 
+    If `file_data` is a path, the memory of the file read, or of a chunk of
+    it if it's streamed, is reserved from `memory_budget` while it's uploaded.
+
     Args:
         file_data (FD): file data. Can be a Path instance pointing to the
-            actual file, a str containing the filepath or a BytesIO instance
-            containing the file content.
+            actual file, a str containing the filepath, a BytesIO instance
+            containing the file content or a ChunkedUpload producing it.
         mimetype (str): MIME type of the file.
         folder_id (str): id of the Google Drive folder to upload the file to.
             To select the root folder, put `folder_id='root`.
         filename (str, optional): name of the file. If None, the filename will be
             generated from the filepath (if `file_data` is str or Path). Defaults to None.
+        stat (FileStat, optional): stat data of the file, collected while
+            listing it. If `file_data` is str or Path and it's provided, the
+            file is known to exist and is not stat'ed again. Uploads with stat
+            data are recorded in `upload_journal`. Defaults to None.
 
     Raises:
         FileNotFoundError: if `file_data` is str or Path and the filepath doesn't exist.
-        ValueError: if `file_data` is BytesIO and `filename` is undefined.
+        ValueError: if `file_data` is BytesIO or ChunkedUpload and `filename`
+            is undefined.
         MultipleFilesError: if there is more than one file in the target folder named ``filename``.
 
     Returns:
         dict: metadata of the file uploaded.
     """
 
+    filepath = None
     if isinstance(file_data, (str, Path)):
         filepath = Path(file_data)
-        if not filepath.exists():
-            exc = FileNotFoundError(filepath.as_posix())
-            log(exc)
-            raise exc
+        if stat is None:
+            try:
+                stat = FileStat.from_stat(filepath.stat())
+            except FileNotFoundError:
+                exc = FileNotFoundError(filepath.as_posix())
+                log(exc)
+                raise exc from None
 
         filename = filename or filepath.name
-        file_data = BytesIO(filepath.read_bytes())
-        del filepath
     else:
         if not filename:
             exc = ValueError("If file_data is BytesIO, filename is required")
             log(exc)
             raise exc
 
+    key = f"{folder_id}/{filename}"
+    if stat is not None:
+        done = upload_journal.get_done(key, stat)
+        if done is not None:
+            log("Skipping %s, uploaded before the last backup was interrupted", key)
+            return {"id": done["id"]}
+
+    streamed = filepath is not None and stat.size > FILE_CHUNK_SIZE
+    with ExitStack() as stack:
+        if filepath is not None:
+            # Small files are read whole, and big ones one chunk at a time.
+            size = min(stat.size, FILE_CHUNK_SIZE)
+            stack.enter_context(memory_budget.reserve(size))
+        if streamed:
+            # Read while it's uploaded, chunk by chunk.
+            file_data = stack.enter_context(filepath.open("rb"))
+            metrics.inc("backup_entry_read_bytes", stat.size)
+        elif filepath is not None:
+            file_data = BytesIO(filepath.read_bytes())
+            metrics.inc("backup_entry_read_bytes", len(file_data.getbuffer()))
+
+        response = _upload(file_data, mimetype, folder_id, filename, key, stat)
+
+    if isinstance(file_data, ChunkedUpload):
+        metrics.inc("backup_entry_uploaded_bytes", file_data.bytes_read)
+    elif streamed:
+        metrics.inc("backup_entry_uploaded_bytes", stat.size)
+    else:
+        metrics.inc("backup_entry_uploaded_bytes", len(file_data.getbuffer()))
+    return response
+
+
+def _upload(
+    file_data: Union[BinaryIO, ChunkedUpload],
+    mimetype: str,
+    folder_id: str,
+    filename: str,
+    key: str,
+    stat: FileStat = None,
+) -> dict:
     service = get_google_drive_services()
     query = f"name = {filename!r} and {folder_id!r} in parents"
 
     # pylint: disable=E1101
-    response = service.files().list(q=query, fields="files(id, name)").execute()
+    response = execute(service.files().list(q=query, fields="files(id, name)"))
     ids = [x.get("id") for x in response.get("files", [])]
 
     if len(ids) > 1:
@@ -67,22 +192,144 @@ def backup(file_data: FD, mimetype: str, folder_id: str, filename: str = None) -
         log(exc)
         raise exc
 
-    if ids:
-        return save_version(service, file_data, mimetype, ids[0], filename)
-    return save_new_file(service, file_data, mimetype, folder_id, filename)
+    if stat is not None:
+        upload_journal.plan(key, stat)
+
+    with metrics.stage("upload"):
+        if ids:
+            response = save_version(
+                service, file_data, mimetype, ids[0], filename, key=key, stat=stat
+            )
+        else:
+            response = save_new_file(
+                service, file_data, mimetype, folder_id, filename, key=key, stat=stat
+            )
+
+    if stat is not None:
+        upload_journal.done(key, stat, response.get("id"))
+    return response
+
+
+def execute(request: HttpRequest):
+    """Executes a request to the Google Drive API.
+
+    If the API returns a rate limit error (429) or a server error (5xx),
+    the request is retried up to `MAX_RETRIES` times, with exponential
+    backoff. The API calls and the retries are recorded in `metrics`.
+
+    Args:
+        request (HttpRequest): request to execute.
+
+    Raises:
+        HttpError: if the request fails `MAX_RETRIES + 1` times, or if
+            it fails with an error that can't be retried.
+
+    Returns:
+        Any: the response of the request.
+    """
+
+    for retry in range(MAX_RETRIES + 1):
+        metrics.inc("backup_entry_api_calls")
+        try:
+            return request.execute()
+        except HttpError as exc:
+            if exc.resp.status not in RETRY_STATUSES or retry == MAX_RETRIES:
+                raise
+
+            delay = 2**retry + random()
+            log("Retrying request in %.1f s: %r", delay, exc)
+            metrics.inc("backup_entry_api_retries")
+            sleep(delay)
+
+
+class _NextChunk:
+    """Request sending the next chunk of a resumable upload."""
+
+    def __init__(self, request: HttpRequest):
+        self.request = request
+
+    def execute(self):
+        return self.request.next_chunk()
+
+
+def execute_upload(
+    request: HttpRequest, key: str = None, stat: FileStat = None
+) -> dict:
+    """Executes a request uploading a file.
+
+    Resumable uploads of files with stat data are sent chunk by chunk, and
+    the URI of the session and the offset confirmed by the server are
+    recorded in `upload_journal` after every chunk. If the journal has an
+    interrupted session of the same file, the upload goes on from the offset
+    committed by the server. If the session expired, the upload starts
+    again. Other requests are executed by `execute`.
+
+    Args:
+        request (HttpRequest): request to execute.
+        key (str, optional): target of the upload in the journal. Defaults
+            to None.
+        stat (FileStat, optional): stat data of the file. Defaults to None.
+
+    Raises:
+        HttpError: if the request fails (see `execute`).
+
+    Returns:
+        dict: metadata of the uploaded file.
+    """
+
+    if not request.resumable or key is None or stat is None:
+        return execute(request)
+
+    # pylint: disable=protected-access
+    uri = upload_journal.get_session(key, stat)
+    if uri is not None:
+        log("Resuming the upload of %s", key)
+        request.resumable_uri = uri
+        # Asks the server for the committed offset before sending data.
+        request._in_error_state = True
+
+    while True:
+        try:
+            status, response = execute(_NextChunk(request))
+        except HttpError as exc:
+            if uri is None or exc.resp.status not in EXPIRED_STATUSES:
+                raise
+            log("Upload session of %s expired, starting again", key)
+            uri = None
+            request.resumable_uri = None
+            request.resumable_progress = 0
+            request._in_error_state = False
+            continue
+
+        if response is not None:
+            return response
+        upload_journal.progress(
+            key, stat, request.resumable_uri, status.resumable_progress
+        )
 
 
 def save_new_file(
-    gds: Resource, file_data: BytesIO, mimetype: str, folder_id: str, filename: str
+    gds: Resource,
+    file_data: Union[BinaryIO, ChunkedUpload],
+    mimetype: str,
+    folder_id: str,
+    filename: str,
+    key: str = None,
+    stat: FileStat = None,
 ) -> dict:
     """Uploads a new file to Google Drive.
 
     Args:
         gds (Resource): google drive service.
-        file_data (BytesIO): file content as a buffer.
+        file_data (Union[BinaryIO, ChunkedUpload]): file content as a buffer,
+            an open file (uploaded in a resumable session) or the upload
+            producing it.
         mimetype (str): MIME type of the file.
         folder_id (str): Google Drive's id of the folder.
         filename (str): filename of the file.
+        key (str, optional): target of the upload in the journal (see
+            `execute_upload`). Defaults to None.
+        stat (FileStat, optional): stat data of the file. Defaults to None.
 
     Returns:
         dict: metadata of the uploaded file.
@@ -91,35 +338,51 @@ def save_new_file(
     log("Saving new file: %s", filename)
     file_metadata = {"name": filename, "mimeType": mimetype, "parents": [folder_id]}
 
-    media = MediaIoBaseUpload(file_data, mimetype=mimetype)
-    res = (
-        gds.files().create(body=file_metadata, media_body=media, fields="id").execute()
-    )
-    return res
+    media = _get_media(file_data, mimetype)
+    request = gds.files().create(body=file_metadata, media_body=media, fields="id")
+    return execute_upload(request, key, stat)
 
 
 def save_version(
-    gds: Resource, file_data: BytesIO, mimetype: str, file_id: str, filename: str
+    gds: Resource,
+    file_data: Union[BinaryIO, ChunkedUpload],
+    mimetype: str,
+    file_id: str,
+    filename: str,
+    key: str = None,
+    stat: FileStat = None,
 ) -> dict:
     """Uploads a new version of an existing file to Google Drive.
 
     Args:
         gds (Resource): google drive services.
-        file_data (BytesIO): file content as a buffer.
+        file_data (Union[BinaryIO, ChunkedUpload]): file content as a buffer,
+            an open file (uploaded in a resumable session) or the upload
+            producing it.
         mimetype (str): MIME type of the file.
         file_id (str): Google Drive's id of the existing file.
         filename (str): filename of the file.
+        key (str, optional): target of the upload in the journal (see
+            `execute_upload`). Defaults to None.
+        stat (FileStat, optional): stat data of the file. Defaults to None.
 
     Returns:
         dict: metadata of the uploaded file.
     """
 
     log("Saving new version of %s", filename)
-    media = MediaIoBaseUpload(file_data, mimetype=mimetype)
-    response = (
-        gds.files()
-        .update(fileId=file_id, keepRevisionForever=False, media_body=media)
-        .execute()
+    media = _get_media(file_data, mimetype)
+    request = gds.files().update(
+        fileId=file_id, keepRevisionForever=False, media_body=media
     )
+    return execute_upload(request, key, stat)
 
-    return response
+
+def _get_media(file_data: Union[BinaryIO, ChunkedUpload], mimetype: str) -> MediaUpload:
+    if isinstance(file_data, ChunkedUpload):
+        return file_data
+    if isinstance(file_data, BytesIO):
+        return MediaIoBaseUpload(file_data, mimetype=mimetype)
+    return MediaIoBaseUpload(
+        file_data, mimetype=mimetype, chunksize=FILE_CHUNK_SIZE, resumable=True
+    )
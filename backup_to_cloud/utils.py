@@ -1,22 +1,14 @@
 """Useful functions for the backup_to_cloud package."""
 
+import codecs
 import mimetypes
-import pickle
-import re
-from datetime import datetime
-from os import walk
-from pathlib import Path
-from typing import Any, List, Union
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import Resource, build
-
-from .config import settings
-from .exceptions import TokenError
-
-SCOPES = ["https://www.googleapis.com/auth/drive"]
+from pathlib import Path, PurePath
+from typing import Any, Dict, Tuple, Union
+
+from .filelist import FileStat
+from .logger import log_writer
+from .state import mimetype_cache
+
 ZIP_MIMETYPE = "application/octet-stream"
 _EXTRA_MIME_TYPES = (
     ("application/arj", ".arj"),
@@ -40,149 +32,131 @@ _EXTRA_MIME_TYPES = (
     ("text/x-python", ".py"),
 )
 
+SNIFF_SIZE = 8192
+_MAGIC_NUMBERS = (
+    (0, b"SQLite format 3\x00", "application/x-sqlite3"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/x-rar-compressed"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"ID3", "audio/mpeg"),
+)
+
+_EXTENSION_CACHE: Dict[str, str] = {}
+
 Logable = Union[str, Exception]
 
 
 def log(template: Logable, *args: Any):
     """Logs a message to the LOG_FILE.
 
+    Messages are buffered, see `LogWriter`.
+
     Args:
         template (Logable): template to form the log message.
         *args (Any): arguments to form the log message.
     """
 
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    time_str = f"[{now}] "
     if isinstance(template, BaseException):
-        message = "ERROR: " + repr(template)
+        log_writer.write(repr(template), error=True)
     else:
-        message = template % args
-    with settings.log_path.open("at", encoding="utf-8") as file_handler:
-        file_handler.write(time_str + message + "\n")
-
-
-def gen_new_token():
-    """Generates a new token."""
-
-    if not settings.credentials_path.exists():
-        raise FileNotFoundError(settings.credentials_path.as_posix())
-
-    flow = InstalledAppFlow.from_client_secrets_file(
-        settings.credentials_path.as_posix(), SCOPES
-    )
-    creds = flow.run_local_server(port=0)
-
-    settings.token_path.write_bytes(pickle.dumps(creds))
-
-
-def get_google_drive_services(creds: Credentials = None) -> Resource:
-    """Returns an object to operate with the Google Drive API v3.
-
-    Args:
-        creds (Credentials, optional): credentials to use. If None, it
-            will be generated by get_creds_from_token(). Defaults to None.
-
-    Returns:
-        Resource: Google Drive API v3 operator.
-    """
-
-    if not creds:
-        creds = get_creds_from_token()
-
-    return build("drive", "v3", credentials=creds)
-
-
-def get_creds_from_token() -> Credentials:
-    """Returns the credentials for the Google Drive API v3.
-
-    Raises:
-        exc: if the token path doesn't exist.
-        exc: if the token path is not valid.
-
-    Returns:
-        Credentials: credentials for google drive.
-    """
-
-    if not settings.token_path.exists():
-        exc = TokenError(f"{settings.token_path.as_posix()!r} doesn't exist")
-        log(exc)
-        raise exc
-
-    creds = pickle.loads(settings.token_path.read_bytes())
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            log("Token updated (expires %s)", creds.expiry)
-            settings.token_path.write_bytes(pickle.dumps(creds))
-        else:
-            exc = TokenError(f"Invalid token: {settings.token_path.as_posix()!r}")
-            log(exc)
-            raise exc
+        log_writer.write(template % args)
 
-    return creds
 
-
-def get_mimetype(filepath: str) -> str:
+def get_mimetype(filepath: str, stat: FileStat = None) -> str:
     """Returns the mimetype of the `filepath` based on its extension.
 
+    If the extension is unknown, the mimetype is guessed from the file
+    content. If `stat` is provided, the guess is stored in the persistent
+    mimetype cache and reused while the file doesn't change. Only fresh
+    results are logged.
+
     Args:
         filepath (str): input filepath.
+        stat (FileStat, optional): stat data of the file, if it's already
+            known. If provided, the file is not stat'ed again. Defaults to None.
 
     Returns:
         str: mimetype of `filepath`.
     """
 
+    extension = "".join(PurePath(filepath).suffixes[-2:])
+    mime_type = _EXTENSION_CACHE.get(extension)
+    if mime_type:
+        return mime_type
+
     mime_type = mimetypes.guess_type(filepath)[0]
     reason = "database"
 
-    if not mime_type:
+    if mime_type:
+        _EXTENSION_CACHE[extension] = mime_type
+    else:
         path = Path(filepath)
-        if not path.is_file():
+        if stat is None and not path.is_file():
             reason = "file not found"
             mime_type = "application/octet-stream"
         else:
-            try:
-                path.read_bytes().decode()
-                mime_type = "text/plain"
-                reason = "plain content"
-            except UnicodeDecodeError:
-                mime_type = "application/octet-stream"
-                reason = "unknown content"
+            mime_type = mimetype_cache.get(filepath, stat) if stat else None
+            if mime_type:
+                return mime_type
+
+            with path.open("rb") as file_handler:
+                header = file_handler.read(SNIFF_SIZE)
+            mime_type, reason = sniff_mimetype(header, len(header) < SNIFF_SIZE)
+            if stat:
+                mimetype_cache.set(filepath, stat, mime_type)
 
     log("Mimetype of %r is %r [%s]", filepath, mime_type, reason)
     return mime_type
 
 
-def _improve_mimetypes():
-    """Adds extra MIME types."""
-
-    for mime_type, extension in _EXTRA_MIME_TYPES:
-        mimetypes.add_type(mime_type, extension, strict=True)
-
+def sniff_mimetype(header: bytes, complete: bool) -> Tuple[str, str]:
+    """Guesses the mimetype of a file from the first bytes of its content.
 
-def list_files(root_dir: str, regex_filter: str) -> List[str]:
-    """Recursively find all files within root_dir that match regex_filter.
+    Common binary formats are detected by their magic number. Otherwise,
+    the file is considered plain text if `header` is valid UTF-8 and
+    doesn't contain null bytes.
 
     Args:
-        root_dir (str): root dir to search files.
-        regex_filter (str): regex to filter files.
+        header (bytes): first bytes of the file (up to `SNIFF_SIZE`).
+        complete (bool): True if `header` is the whole content of the file.
+            If False, a multibyte character cut at the end of `header` is
+            not considered an error.
 
     Returns:
-        List[str]: files that match regex_filter within root_dir.
+        Tuple[str, str]: mimetype and the reason it was chosen.
     """
 
-    path = Path(root_dir).absolute()
-    pattern = re.compile(regex_filter, re.IGNORECASE)
-    files = []
+    for offset, magic_number, mime_type in _MAGIC_NUMBERS:
+        if header.startswith(magic_number, offset):
+            return mime_type, "magic number"
+
+    if b"\x00" not in header:
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(header, final=complete)
+            return "text/plain", "plain content"
+        except UnicodeDecodeError:
+            pass
 
-    for root, _, temp_files in walk(path.as_posix()):
-        for file in temp_files:
-            filepath = Path(root).joinpath(file)
-            if pattern.search(filepath.as_posix()):
-                files.append(filepath)
+    return "application/octet-stream", "unknown content"
 
-    return files
+
+def _improve_mimetypes():
+    """Adds extra MIME types."""
+
+    for mime_type, extension in _EXTRA_MIME_TYPES:
+        mimetypes.add_type(mime_type, extension, strict=True)
 
 
 _improve_mimetypes()
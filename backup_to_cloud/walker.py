@@ -0,0 +1,369 @@
+"""Lists the files selected by the backup entries, walking each tree only once."""
+
+import re
+from os import scandir
+from pathlib import Path
+from time import perf_counter, time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .exceptions import AutomaticEntryError
+from .filelist import FileList, FileStat
+
+try:
+    from pwd import getpwnam
+except ImportError:  # pragma: no cover
+    getpwnam = None
+
+
+class WalkTarget:
+    """Root folder, regex filter and metadata predicates whose matching
+    files must be collected.
+
+    Args:
+        root_path (str): root folder to search files.
+        regex_filter (str): regex to filter files.
+        max_size (int, optional): max size of the files, in bytes.
+            Defaults to None.
+        min_size (int, optional): min size of the files, in bytes.
+            Defaults to None.
+        newer_than (float, optional): files must have been modified within
+            this number of seconds. Defaults to None.
+        older_than (float, optional): files must not have been modified within
+            this number of seconds. Defaults to None.
+        owner (Union[str, int], optional): name or uid of the owner of the files.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        root_path: str,
+        regex_filter: str,
+        max_size: int = None,
+        min_size: int = None,
+        newer_than: float = None,
+        older_than: float = None,
+        owner: Union[str, int] = None,
+    ):
+        self.root = Path(root_path).absolute().as_posix()
+        self.pattern = re.compile(regex_filter, re.IGNORECASE)
+        self.files = FileList()
+        self._prefix = self.root.rstrip("/") + "/"
+
+        now = time()
+        self.max_size = max_size
+        self.min_size = min_size
+        self.min_mtime = now - newer_than if newer_than is not None else None
+        self.max_mtime = now - older_than if older_than is not None else None
+        self.uid = _get_uid(owner)
+
+    @classmethod
+    def from_entry(cls, entry) -> "WalkTarget":
+        """Builds the WalkTarget of a BackupEntry.
+
+        Args:
+            entry (BackupEntry): entry of type `multiple-files`.
+
+        Returns:
+            WalkTarget: target selecting the files of `entry`.
+        """
+
+        return cls(
+            entry.root_path,
+            entry.filter,
+            max_size=entry.max_size,
+            min_size=entry.min_size,
+            newer_than=entry.newer_than,
+            older_than=entry.older_than,
+            owner=entry.owner,
+        )
+
+    def contains(self, dirpath: str) -> bool:
+        """Checks if the folder `dirpath` is located below the target's root.
+
+        Args:
+            dirpath (str): folder path, in posix format.
+
+        Returns:
+            bool: True if `dirpath` is the root or a subfolder of the root.
+        """
+
+        return dirpath == self.root or dirpath.startswith(self._prefix)
+
+    def accepts(self, stat_result) -> bool:
+        """Checks if a file passes the metadata predicates of the target.
+
+        Args:
+            stat_result (os.stat_result): stat result of the file.
+
+        Returns:
+            bool: True if the file must be selected.
+        """
+
+        if self.max_size is not None and stat_result.st_size > self.max_size:
+            return False
+        if self.min_size is not None and stat_result.st_size < self.min_size:
+            return False
+        if self.min_mtime is not None and stat_result.st_mtime < self.min_mtime:
+            return False
+        if self.max_mtime is not None and stat_result.st_mtime > self.max_mtime:
+            return False
+        if self.uid is not None and stat_result.st_uid != self.uid:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"WalkTarget(root={self.root!r}, filter={self.pattern.pattern!r})"
+
+
+class WalkStats:
+    """Counters of a walk, updated while the folders are scanned."""
+
+    def __init__(self):
+        self.dirs = 0
+        self.files = 0
+        self.matched = 0
+        self.bytes = 0
+        self._start = perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the walk started."""
+
+        return perf_counter() - self._start
+
+    def __repr__(self):
+        return (
+            f"WalkStats(dirs={self.dirs}, files={self.files}, "
+            f"matched={self.matched}, bytes={self.bytes})"
+        )
+
+
+def _get_uid(owner: Union[str, int, None]) -> Optional[int]:
+    if owner is None:
+        return None
+    if str(owner).isdigit():
+        return int(owner)
+    if getpwnam is None:  # pragma: no cover
+        raise AutomaticEntryError(f"Can't resolve owner {owner!r} in this platform")
+    try:
+        return getpwnam(owner).pw_uid
+    except KeyError as exc:
+        raise AutomaticEntryError(f"Unknown owner: {owner!r}") from exc
+
+
+def scan_tree(root: str) -> Iterator[Tuple[str, list]]:
+    """Walks `root` top-down, like `os.walk`, using `os.scandir`.
+
+    Folders and files are sorted by name. Symlinks to folders are not
+    followed. Folders that can't be read are ignored.
+
+    Args:
+        root (str): folder to start the walk.
+
+    Yields:
+        Tuple[str, List[os.DirEntry]]: each folder and the entries of the
+            files located inside it.
+    """
+
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        files, subdirs = [], []
+        try:
+            with scandir(dirpath) as iterator:
+                for entry in iterator:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if not is_dir:
+                        files.append(entry)
+                    elif not entry.is_symlink():
+                        subdirs.append(entry.path)
+        except OSError:
+            continue
+
+        files.sort(key=lambda x: x.name)
+        yield dirpath, files
+        stack.extend(sorted(subdirs, reverse=True))
+
+
+def plan_walks(targets: Iterable[WalkTarget]) -> List[Tuple[str, List[WalkTarget]]]:
+    """Groups the targets whose roots overlap, so each tree is walked once.
+
+    A target overlaps another one if its root is the same folder or a
+    subfolder of the other target's root, reached without following
+    symlinks (`scan_tree` doesn't follow them). Each group is walked from
+    the outermost root.
+
+    Args:
+        targets (Iterable[WalkTarget]): targets to group.
+
+    Returns:
+        List[Tuple[str, List[WalkTarget]]]: list of (root, targets) to walk.
+    """
+
+    plan = []
+    for target in sorted(targets, key=lambda x: Path(x.root).parts):
+        for root, group in plan:
+            if group[0].contains(target.root) and _is_reached(root, target.root):
+                group.append(target)
+                break
+        else:
+            plan.append((target.root, [target]))
+    return plan
+
+
+def _is_reached(root: str, dirpath: str) -> bool:
+    """Checks if a walk of `root` reaches its subfolder `dirpath`, that is,
+    if no folder between them is a symlink."""
+
+    path = Path(root)
+    for part in Path(dirpath).relative_to(root).parts:
+        path = path.joinpath(part)
+        if path.is_symlink():
+            return False
+    return True
+
+
+def _select(target: WalkTarget, prefix: str, entries: list) -> Tuple[list, list]:
+    names, stats = [], []
+    for entry in entries:
+        if not target.pattern.search(prefix + entry.name):
+            continue
+
+        try:
+            stat_result = entry.stat()
+        except OSError:
+            continue
+
+        if target.accepts(stat_result):
+            names.append(entry.name)
+            stats.append(stat_result)
+
+    return names, stats
+
+
+def walk_targets(root: str, targets: List[WalkTarget], stats: WalkStats = None):
+    """Walks `root` recursively once, collecting the files of every target.
+
+    Each file is tested against the filters of the targets containing its
+    folder and added to their `files`, along with its stat result. The stat
+    result is cached by `os.DirEntry`, so every file is stat'ed at most once,
+    no matter how many targets select it.
+
+    Args:
+        root (str): folder to start the walk.
+        targets (List[WalkTarget]): targets located below `root`.
+        stats (WalkStats, optional): counters to update. Defaults to None.
+    """
+
+    stats = stats or WalkStats()
+    for dirpath, entries in scan_tree(root):
+        dirpath = Path(dirpath).as_posix()
+        prefix = dirpath.rstrip("/") + "/"
+        stats.dirs += 1
+        stats.files += len(entries)
+
+        for target in targets:
+            if not target.contains(dirpath):
+                continue
+
+            names, file_stats = _select(target, prefix, entries)
+            target.files.add_dir(dirpath, names, file_stats)
+            stats.matched += len(names)
+            stats.bytes += sum(x.st_size for x in file_stats)
+
+    for target in targets:
+        target.files.freeze()
+
+
+def iter_target(
+    target: WalkTarget, stats: WalkStats = None
+) -> Iterator[Tuple[str, FileStat]]:
+    """Walks the root of a target, yielding its files as soon as their folder
+    is scanned.
+
+    Args:
+        target (WalkTarget): target whose files must be found.
+        stats (WalkStats, optional): counters to update. Defaults to None.
+
+    Yields:
+        Tuple[str, FileStat]: posix path and stat data of each file.
+    """
+
+    stats = stats or WalkStats()
+    for dirpath, entries in scan_tree(target.root):
+        prefix = Path(dirpath).as_posix().rstrip("/") + "/"
+        stats.dirs += 1
+        stats.files += len(entries)
+
+        for name, stat_result in zip(*_select(target, prefix, entries)):
+            stats.matched += 1
+            stats.bytes += stat_result.st_size
+            yield prefix + name, FileStat.from_stat(stat_result)
+
+
+def iter_matches(
+    root_dir: str, regex_filter: str, stats: WalkStats = None
+) -> Iterator[Tuple[str, FileStat]]:
+    """Recursively find all files within root_dir that match regex_filter,
+    yielding them as soon as their folder is scanned.
+
+    Args:
+        root_dir (str): root dir to search files.
+        regex_filter (str): regex to filter files.
+        stats (WalkStats, optional): counters to update. Defaults to None.
+
+    Yields:
+        Tuple[str, FileStat]: posix path and stat data of each file.
+    """
+
+    return iter_target(WalkTarget(root_dir, regex_filter), stats)
+
+
+def walk_entries(
+    entries: Iterable, stats: WalkStats = None, overlapping_only: bool = False
+) -> Dict[str, FileList]:
+    """Lists the files of several entries, walking overlapping roots once.
+
+    Args:
+        entries (Iterable[BackupEntry]): entries of type `multiple-files`.
+        stats (WalkStats, optional): counters to update. Defaults to None.
+        overlapping_only (bool, optional): if True, only the entries whose
+            root overlaps the root of another entry are walked. The others
+            can be walked on their own, with `iter_target`. Defaults to False.
+
+    Returns:
+        Dict[str, FileList]: files of each entry walked, by entry name.
+    """
+
+    targets = {entry.name: WalkTarget.from_entry(entry) for entry in entries}
+
+    walked = set()
+    for root, group in plan_walks(targets.values()):
+        if overlapping_only and len(group) == 1:
+            continue
+        walk_targets(root, group, stats)
+        walked.update(id(target) for target in group)
+
+    return {
+        name: target.files for name, target in targets.items() if id(target) in walked
+    }
+
+
+def list_files(root_dir: str, regex_filter: str) -> FileList:
+    """Recursively find all files within root_dir that match regex_filter.
+
+    Args:
+        root_dir (str): root dir to search files.
+        regex_filter (str): regex to filter files.
+
+    Returns:
+        FileList: files that match regex_filter within root_dir.
+    """
+
+    target = WalkTarget(root_dir, regex_filter)
+    walk_targets(target.root, [target])
+    return target.files
@@ -0,0 +1,345 @@
+"""Backs up the entries when their files change, using Linux's inotify."""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+from pathlib import Path
+from threading import Event
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .automatic import EntryType
+from .logger import log_writer
+from .main import backup_files, create_backup
+from .state import mimetype_cache, upload_journal
+from .utils import log
+from .walker import scan_tree
+
+DEBOUNCE = 2.0
+MAX_DELAY = 60.0
+POLL_INTERVAL = 1.0
+
+# Constants of <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+)
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """Minimal wrapper of the inotify API of Linux, through ctypes.
+
+    Raises:
+        OSError: if inotify is not available.
+    """
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno("inotify_init1")
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """Watches a folder.
+
+        Args:
+            path (str): folder to watch.
+            mask (int, optional): events to watch. Defaults to WATCH_MASK.
+
+        Raises:
+            OSError: if the folder can't be watched.
+
+        Returns:
+            int: watch descriptor of the folder.
+        """
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        """Stops watching a folder. Errors are ignored."""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        """Waits for events.
+
+        Args:
+            timeout (float): max seconds to wait.
+
+        Returns:
+            List[Tuple[int, int, str]]: watch descriptor, mask and filename of
+                every event, or an empty list if there are no events.
+        """
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        """Closes the inotify file descriptor."""
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def _raise_errno(filename: str):
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code), filename)
+
+
+class Watcher:
+    """Backs up the files of some entries shortly after they change.
+
+    The root folder of every `multiple-files` entry is watched recursively,
+    and the parent folder of every `single-file` entry. Bursts of events are
+    coalesced: changes are backed up once no event arrives for `debounce`
+    seconds, or after `max_delay` seconds if the events don't stop.
+
+    Files of `multiple-files` entries without zip are backed up one by one,
+    only the changed files. Entries with zip are rebuilt completely, as
+    `single-file` entries. If the kernel drops events (queue overflow), every
+    entry is backed up completely.
+
+    Args:
+        entries (Iterable[BackupEntry]): entries to watch.
+        debounce (float, optional): seconds without events to wait before
+            backing up the changes. Defaults to `DEBOUNCE`.
+        max_delay (float, optional): max seconds to wait since the first
+            change. Defaults to `MAX_DELAY`.
+
+    Raises:
+        OSError: if inotify is not available, or a folder can't be watched.
+    """
+
+    def __init__(
+        self,
+        entries: Iterable,
+        debounce: float = DEBOUNCE,
+        max_delay: float = MAX_DELAY,
+    ):
+        self.entries = {entry.name: entry for entry in entries}
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.dirs: Dict[int, str] = {}
+        self.changed: Dict[str, Set[str]] = {}
+        self.rebuild: Set[str] = set()
+
+        self._roots = {}
+        self._first_change: Optional[float] = None
+        self._last_change: Optional[float] = None
+        self._stop = Event()
+        self.inotify = Inotify()
+
+        try:
+            for entry in self.entries.values():
+                root = Path(entry.root_path).absolute().as_posix()
+                self._roots[entry.name] = root
+                if entry.type == EntryType.multiple_files:
+                    self._watch_tree(root)
+                else:
+                    self._watch_dir(root.rsplit("/", 1)[0] or "/")
+        except Exception:
+            self.close()
+            raise
+
+    def _watch_dir(self, dirpath: str):
+        try:
+            wd = self.inotify.add_watch(dirpath)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            if exc.errno != errno.ENOSPC:
+                raise
+            msg = "Limit of inotify watches reached (fs.inotify.max_user_watches)"
+            raise OSError(exc.errno, msg, dirpath) from exc
+        self.dirs[wd] = dirpath
+
+    def _watch_tree(self, root: str) -> List[str]:
+        """Watches `root` and its subfolders, returning the files inside."""
+
+        files = []
+        for dirpath, entries in scan_tree(root):
+            dirpath = Path(dirpath).as_posix()
+            self._watch_dir(dirpath)
+            files.extend(f"{dirpath}/{x.name}" for x in entries)
+        return files
+
+    def _unwatch_tree(self, root: str):
+        prefix = root + "/"
+        for wd, dirpath in list(self.dirs.items()):
+            if dirpath == root or dirpath.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.dirs[wd]
+
+    def handle_event(self, wd: int, mask: int, name: str):
+        """Records the changes described by an inotify event.
+
+        Args:
+            wd (int): watch descriptor.
+            mask (int): mask of the event.
+            name (str): name of the file, inside the watched folder.
+        """
+
+        if mask & IN_Q_OVERFLOW:
+            log("Inotify events lost, backing up every entry")
+            self._touch()
+            self.rebuild.update(self.entries)
+            return
+
+        dirpath = self.dirs.get(wd)
+        if dirpath is None:
+            return
+        if mask & IN_IGNORED:
+            del self.dirs[wd]
+            return
+
+        path = f"{dirpath.rstrip('/')}/{name}"
+        deleted = bool(mask & (IN_DELETE | IN_MOVED_FROM))
+        if not mask & IN_ISDIR:
+            self._mark(path, deleted)
+        elif deleted:
+            self._unwatch_tree(path)
+            self._mark(path, True)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            # Files created before the folder was watched don't send events
+            for file in self._watch_tree(path):
+                self._mark(file, False)
+
+    def _mark(self, path: str, deleted: bool):
+        for name, entry in self.entries.items():
+            root = self._roots[name]
+            if entry.type == EntryType.single_file:
+                if path == root and not deleted:
+                    self._touch()
+                    self.rebuild.add(name)
+                continue
+
+            if not path.startswith(root.rstrip("/") + "/"):
+                continue
+
+            if entry.zip:
+                self._touch()
+                self.rebuild.add(name)
+            elif not deleted:
+                self._touch()
+                self.changed.setdefault(name, set()).add(path)
+
+    def _touch(self):
+        now = monotonic()
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+
+    def get_timeout(self, now: Optional[float] = None) -> float:
+        """Returns the seconds to wait until the changes must be backed up."""
+
+        if self._first_change is None:
+            return POLL_INTERVAL
+
+        now = monotonic() if now is None else now
+        timeout = min(
+            self._last_change + self.debounce - now,
+            self._first_change + self.max_delay - now,
+        )
+        return max(timeout, 0)
+
+    def poll(self, timeout: float) -> int:
+        """Waits for events and records the changes.
+
+        Args:
+            timeout (float): max seconds to wait.
+
+        Returns:
+            int: number of events received.
+        """
+
+        events = self.inotify.read(timeout)
+        for event in events:
+            self.handle_event(*event)
+        return len(events)
+
+    def flush(self):
+        """Backs up the changes recorded, and forgets them.
+
+        Errors are logged, they don't stop the watcher.
+        """
+
+        rebuild, changed = sorted(self.rebuild), self.changed
+        self.rebuild, self.changed = set(), {}
+        self._first_change = self._last_change = None
+
+        if rebuild:
+            log("Backing up changed entries: %s", ", ".join(rebuild))
+            try:
+                create_backup(rebuild)
+            except Exception as exc:  # pylint: disable=broad-except
+                log(exc)
+
+        for name, paths in sorted(changed.items()):
+            if name in rebuild:
+                continue
+            try:
+                backed_up = backup_files(self.entries[name], paths)
+                log("Backed up %d changed files of entry %r", backed_up, name)
+            except Exception as exc:  # pylint: disable=broad-except
+                log(exc)
+
+        mimetype_cache.save()
+        upload_journal.compact()
+        log_writer.flush()
+
+    def run(self):
+        """Watches the entries until `stop` is called."""
+
+        while not self._stop.is_set():
+            self.poll(self.get_timeout())
+            if self._first_change is not None and self.get_timeout() == 0:
+                self.flush()
+
+    def stop(self):
+        """Stops the watcher, after the running backup ends."""
+        self._stop.set()
+
+    def close(self):
+        """Stops watching the folders."""
+        self.inotify.close()
@@ -0,0 +1,37 @@
+"""check_yaml_entry against the number of entries."""
+
+from backup_to_cloud.automatic import check_yaml_entry
+from run import measure
+
+ENTRY_COUNTS = (1000, 10000, 100000)
+ENTRIES = {
+    "single-file": {
+        "type": "single-file",
+        "root-path": "/srv/data/file.db",
+        "cloud-folder-id": "1iMBCIOtVuGRXVhxD1lFVPZdcQ0mL5jMz",
+    },
+    "multiple-files": {
+        "type": "multiple-files",
+        "root-path": "/srv/data",
+        "filter": ".log$",
+        "zip": True,
+        "zipname": "logs.zip",
+        "max-size": "100MB",
+        "newer-than": "7d",
+        "owner": "1000",
+        "cloud-folder-id": "1iMBCIOtVuGRXVhxD1lFVPZdcQ0mL5jMz",
+    },
+}
+
+
+def run(workdir):
+    for kind, entry in ENTRIES.items():
+        for count in ENTRY_COUNTS:
+            entries = [dict(entry, name=f"entry-{i}") for i in range(count)]
+
+            def check():
+                for yaml_entry in entries:
+                    check_yaml_entry(**yaml_entry)
+
+            result = measure(check, repeat=3)
+            yield {"params": {"kind": kind, "entries": count}, **result}
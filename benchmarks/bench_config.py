@@ -0,0 +1,34 @@
+"""Load time of .automatic.yml against the number of entries."""
+
+from backup_to_cloud.automatic import get_automatic_entries
+from backup_to_cloud.config import settings
+from run import measure
+
+ENTRY_COUNTS = (10, 100, 1000, 10000)
+ENTRY_TEMPLATE = """entry-{index}:
+  type: multiple-files
+  root-path: /srv/data/{index}
+  filter: .log$
+  zip: true
+  zipname: entry-{index}.zip
+  max-size: 100MB
+  newer-than: 7d
+  cloud-folder-id: 1iMBCIOtVuGRXVhxD1lFVPZdcQ0mL5jMz
+"""
+
+
+def run(workdir):
+    for count in ENTRY_COUNTS:
+        content = "\n".join(ENTRY_TEMPLATE.format(index=i) for i in range(count))
+        settings.automatic_path.write_text(content)
+
+        def remove_cache():
+            settings.automatic_cache_path.unlink()
+
+        get_automatic_entries()
+        repeat = 3 if count >= 10000 else 5
+        cold = measure(get_automatic_entries, repeat, setup=remove_cache)
+        warm = measure(get_automatic_entries, repeat)
+
+        yield {"params": {"entries": count, "cache": "cold"}, **cold}
+        yield {"params": {"entries": count, "cache": "warm"}, **warm}
@@ -0,0 +1,50 @@
+"""get_mimetype against the type and size of the files."""
+
+import gzip
+import os
+
+from backup_to_cloud import utils
+from backup_to_cloud.filelist import FileStat
+from backup_to_cloud.state import mimetype_cache
+from backup_to_cloud.utils import get_mimetype
+from run import measure
+
+FILES = 200
+SIZES = (1024, 1024**2)
+KINDS = {
+    # Detected by the extension
+    "known-extension": (".pdf", lambda size: os.urandom(size)),
+    # Sniffed: plain text, gzip magic number and unknown binary content
+    "text": (".data", lambda size: b"lorem ipsum\n" * (size // 12)),
+    "gzip": (".data", lambda size: gzip.compress(b"") + os.urandom(size)),
+    "binary": (".data", lambda size: os.urandom(size)),
+}
+
+
+def clear_caches():
+    utils._EXTENSION_CACHE.clear()
+    mimetype_cache._data = {}
+
+
+def run(workdir):
+    for kind, (suffix, generate) in KINDS.items():
+        for size in SIZES:
+            folder = workdir.joinpath(f"{kind}-{size}")
+            folder.mkdir()
+            paths = []
+            content = generate(size)
+            for index in range(FILES):
+                path = folder.joinpath(f"file-{index}{suffix}")
+                path.write_bytes(content)
+                paths.append((path.as_posix(), FileStat.from_stat(path.stat())))
+
+            def detect():
+                for path, stat in paths:
+                    get_mimetype(path, stat=stat)
+
+            cold = measure(detect, setup=clear_caches)
+            warm = measure(detect)
+
+            params = {"kind": kind, "size": size, "files": FILES}
+            yield {"params": {**params, "cache": "cold"}, **cold}
+            yield {"params": {**params, "cache": "warm"}, **warm}
@@ -0,0 +1,25 @@
+"""list_files against the shape of the tree and the regex filter."""
+
+from backup_to_cloud.walker import list_files
+from run import measure
+from synthetic import make_tree
+
+# name: (depth, fanout, files per folder)
+SHAPES = {
+    "flat": (0, 0, 20000),
+    "balanced": (3, 10, 18),
+    "deep": (12, 2, 2),
+}
+FILTERS = (".", r"\.log$", r"/1/.*\.(txt|pdf)$")
+
+
+def run(workdir):
+    for shape, (depth, fanout, files_per_dir) in SHAPES.items():
+        root = workdir.joinpath(shape)
+        files = make_tree(root, depth, fanout, files_per_dir)
+
+        for regex in FILTERS:
+            matched = len(list_files(root.as_posix(), regex))
+            result = measure(lambda: list_files(root.as_posix(), regex))
+            params = {"shape": shape, "files": files, "filter": regex}
+            yield {"params": params, "matched": matched, **result}
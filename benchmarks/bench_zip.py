@@ -0,0 +1,32 @@
+"""Zip building with many small files against a few large files."""
+
+from backup_to_cloud.main import _compress
+from backup_to_cloud.walker import list_files
+from run import measure
+from synthetic import make_tree
+
+# name: (depth, fanout, files per folder, size of each file)
+LAYOUTS = {
+    "many-small": (2, 10, 40, 4 * 1024),
+    "few-large": (0, 0, 4, 4 * 1024**2),
+}
+
+
+def run(workdir):
+    for layout, (depth, fanout, files_per_dir, size) in LAYOUTS.items():
+        root = workdir.joinpath(layout)
+        make_tree(root, depth, fanout, files_per_dir, size)
+        files = list_files(root.as_posix(), ".")
+
+        compressed = stream_zip(root, files)
+        result = measure(lambda: stream_zip(root, files), repeat=3)
+        params = {"layout": layout, "files": len(files), "bytes": files.total_size()}
+        yield {"params": params, "compressed": compressed, **result}
+
+
+def stream_zip(root, files):
+    """Streams the zip file of a backup, reading the files from disk like
+    the `compress` stage does, and returns its size."""
+
+    items = ((path, None, None, None) for path in files.iter_posix())
+    return sum(len(chunk) for chunk in _compress(root.as_posix(), items))
@@ -0,0 +1,99 @@
+"""Runs the benchmarks of backup_to_cloud and prints the results as JSON.
+
+Usage:
+    python benchmarks/run.py [--output results.json] [benchmark ...]
+
+Each benchmark is a module `bench_<name>.py` in this folder, defining a
+function `run(workdir)` which yields result dicts. Every result contains
+the benchmark name, its parameters and the timings in seconds.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+BENCHMARKS_DIR = Path(__file__).parent
+sys.path.insert(0, BENCHMARKS_DIR.parent.as_posix())
+
+
+def measure(func, repeat=5, setup=None):
+    """Runs `func` `repeat` times and returns its timings.
+
+    Args:
+        func (Callable): function to measure.
+        repeat (int, optional): number of runs. Defaults to 5.
+        setup (Callable, optional): function called before every run, not
+            included in the timings. Defaults to None.
+
+    Returns:
+        dict: min, median and max time of the runs, in seconds.
+    """
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+
+    return {
+        "runs": repeat,
+        "min": min(timings),
+        "median": median(timings),
+        "max": max(timings),
+    }
+
+
+def available_benchmarks():
+    return sorted(x.stem[len("bench_") :] for x in BENCHMARKS_DIR.glob("bench_*.py"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run (all)")
+    parser.add_argument("--output", help="file to write the results to")
+    args = parser.parse_args()
+
+    names = args.benchmarks or available_benchmarks()
+    unknown = set(names) - set(available_benchmarks())
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="btc-bench-") as workdir:
+        root_path = Path(workdir, "root")
+        root_path.mkdir()
+        root_path.joinpath("credentials.json").touch()
+        os.environ["BTC_ROOT_PATH"] = root_path.as_posix()
+
+        for name in names:
+            module = importlib.import_module("bench_" + name)
+            benchdir = Path(workdir, name)
+            benchdir.mkdir()
+            for result in module.run(benchdir):
+                result = {"benchmark": name, **result}
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Generators of synthetic data for the benchmarks."""
+
+import os
+from pathlib import Path
+
+SUFFIXES = (".log", ".txt", ".pdf", ".dat")
+
+
+def make_tree(root, depth, fanout, files_per_dir, size=0):
+    """Creates a tree of folders and files.
+
+    Every folder contains `files_per_dir` files, with the extensions of
+    `SUFFIXES` in turn, and `fanout` subfolders, down to `depth` levels.
+
+    Args:
+        root (Path): folder to create the tree into.
+        depth (int): number of levels of subfolders.
+        fanout (int): subfolders of each folder.
+        files_per_dir (int): files of each folder.
+        size (int, optional): size of each file, in bytes. Defaults to 0.
+
+    Returns:
+        int: number of files created.
+    """
+
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    content = os.urandom(size)
+    for index in range(files_per_dir):
+        suffix = SUFFIXES[index % len(SUFFIXES)]
+        root.joinpath(f"file-{index}{suffix}").write_bytes(content)
+
+    created = files_per_dir
+    if depth > 0:
+        for index in range(fanout):
+            subdir = root.joinpath(str(index))
+            created += make_tree(subdir, depth - 1, fanout, files_per_dir, size)
+    return created
@@ -1,17 +1,24 @@
+import os
+import pickle
 from itertools import permutations
+from pathlib import Path
 from unittest import mock
 
 import pytest
 
 from backup_to_cloud.automatic import (
     ATTRS_TYPES,
+    COMPILED_CACHE_VERSION,
     REQUIRED_ATTRS,
     BackupEntry,
     EntryType,
     check_yaml_entry,
     get_automatic_entries,
+    parse_age,
+    parse_size,
 )
 from backup_to_cloud.exceptions import AutomaticEntryError
+from backup_to_cloud.schedule import CronSchedule
 
 
 class TestBackupEntry:
@@ -24,6 +31,12 @@ class TestBackupEntry:
         assert entry.zip is False
         assert entry.zipname is None
         assert entry.filter == "."
+        assert entry.max_size is None
+        assert entry.min_size is None
+        assert entry.newer_than is None
+        assert entry.older_than is None
+        assert entry.owner is None
+        assert entry.schedule is None
 
     def test_init_all(self):
         entry = BackupEntry(
@@ -52,19 +65,103 @@ class TestBackupEntry:
         attrs = vars(entry)
         assert repr(entry) == "BackupEntry(attrs=%s)" % attrs
 
+    def test_init_predicates(self):
+        entry = BackupEntry(
+            "<name>",
+            "multiple-files",
+            "<root-path>",
+            max_size="100MB",
+            min_size="1k",
+            newer_than="7d",
+            older_than="2h",
+            owner="<owner>",
+            schedule="0 3 * * *",
+        )
+        assert entry.max_size == 100 * 1024**2
+        assert entry.min_size == 1024
+        assert entry.newer_than == 7 * 86400
+        assert entry.older_than == 2 * 3600
+        assert entry.owner == "<owner>"
+        assert entry.schedule == CronSchedule("0 3 * * *")
+
+    def test_init_numeric_predicates(self):
+        entry = BackupEntry(
+            "<name>",
+            "multiple-files",
+            "<root-path>",
+            max_size=1048576,
+            min_size=0,
+            newer_than=3600,
+            older_than=1.5,
+            owner=1000,
+        )
+        assert entry.max_size == 1048576
+        assert entry.min_size == 0
+        assert entry.newer_than == 3600
+        assert entry.older_than == 1.5
+        assert entry.owner == 1000
+
+
+@pytest.mark.parametrize(
+    "size,expected",
+    [
+        (None, None),
+        ("0", 0),
+        ("1024", 1024),
+        ("10b", 10),
+        ("1k", 1024),
+        ("1 KB", 1024),
+        ("1.5MiB", 1536 * 1024),
+        ("2g", 2 * 1024**3),
+        ("1TB", 1024**4),
+    ],
+)
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["", "MB", "-1", "10 PB", "1.2.3k"])
+def test_parse_size_error(size):
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size(size)
+
+
+@pytest.mark.parametrize(
+    "age,expected",
+    [
+        (None, None),
+        ("30", 30),
+        ("30s", 30),
+        ("5m", 300),
+        ("1.5h", 5400),
+        ("7d", 604800),
+        ("2W", 1209600),
+    ],
+)
+def test_parse_age(age, expected):
+    assert parse_age(age) == expected
+
+
+@pytest.mark.parametrize("age", ["", "d", "-1d", "7 days", "1y"])
+def test_parse_age_error(age):
+    with pytest.raises(ValueError, match="Invalid time span"):
+        parse_age(age)
+
 
 class TestGetAuto:
     @pytest.fixture(autouse=True)
-    def mocks(self):
+    def mocks(self, tmp_path):
         self.settings_m = mock.patch("backup_to_cloud.automatic.settings").start()
         self.check_m = mock.patch("backup_to_cloud.automatic.check_yaml_entry").start()
         self.be_m = mock.patch("backup_to_cloud.automatic.BackupEntry").start()
+        self.settings_m.automatic_path = tmp_path / ".automatic.yml"
+        self.settings_m.automatic_cache_path = tmp_path / ".automatic.cache"
         yield
         mock.patch.stopall()
 
     def test_get_auto(self):
         self.check_m.return_value = {"a": 1, "b": 2, "c": 3}
-        self.settings_m.automatic_path.read_text.return_value = (
+        self.settings_m.automatic_path.write_text(
             "name1:\n  type: <type1>\n  zip: true\n  root-path: <path1>\n  "
             "zipname: <zipname1>\n  cloud-folder-id: <folder-id1>\n  filter:"
             " .\n\nname2:\n  type: <type2>\n  zip: false\n  root-path: "
@@ -101,6 +198,85 @@ class TestGetAuto:
         assert auto == [self.be_m.return_value] * 2
 
 
+class TestCompiledCache:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.automatic.settings").start()
+        self.check_m = mock.patch(
+            "backup_to_cloud.automatic.check_yaml_entry", wraps=check_yaml_entry
+        ).start()
+        self.yaml_path = tmp_path / ".automatic.yml"
+        self.cache_path = tmp_path / ".automatic.cache"
+        self.settings_m.automatic_path = self.yaml_path
+        self.settings_m.automatic_cache_path = self.cache_path
+
+        self.yaml_path.write_text("name:\n  type: single-file\n  root-path: /a\n")
+        yield
+        mock.patch.stopall()
+
+    def get_root_paths(self):
+        return [entry.root_path for entry in get_automatic_entries()]
+
+    def test_cache_created(self):
+        assert self.get_root_paths() == ["/a"]
+        assert self.check_m.call_count == 1
+
+        snapshot = pickle.loads(self.cache_path.read_bytes())
+        assert snapshot["version"] == COMPILED_CACHE_VERSION
+        assert snapshot["entries"] == [
+            {"name": "name", "type": "single-file", "root_path": "/a"}
+        ]
+
+    def test_cache_hit(self):
+        self.get_root_paths()
+        read_bytes = Path.read_bytes
+        with mock.patch("pathlib.Path.read_bytes", autospec=True) as read_bytes_m:
+            read_bytes_m.side_effect = read_bytes
+            assert self.get_root_paths() == ["/a"]
+
+        # Only the snapshot is read
+        read_bytes_m.assert_called_once_with(self.cache_path)
+        assert self.check_m.call_count == 1
+
+    def test_cache_touched(self):
+        self.get_root_paths()
+        os.utime(self.yaml_path, ns=(0, 0))
+
+        assert self.get_root_paths() == ["/a"]
+        assert self.check_m.call_count == 1
+        assert pickle.loads(self.cache_path.read_bytes())["stat"][0] == 0
+
+    def test_cache_modified(self):
+        self.get_root_paths()
+        self.yaml_path.write_text("name:\n  type: single-file\n  root-path: /bb\n")
+
+        assert self.get_root_paths() == ["/bb"]
+        assert self.check_m.call_count == 2
+
+    @pytest.mark.parametrize("content", [b"<invalid-pickle>", b""])
+    def test_cache_invalid(self, content):
+        self.cache_path.write_bytes(content)
+
+        assert self.get_root_paths() == ["/a"]
+        assert self.check_m.call_count == 1
+
+    def test_cache_old_version(self):
+        self.get_root_paths()
+        snapshot = pickle.loads(self.cache_path.read_bytes())
+        snapshot["version"] -= 1
+        self.cache_path.write_bytes(pickle.dumps(snapshot))
+
+        assert self.get_root_paths() == ["/a"]
+        assert self.check_m.call_count == 2
+
+    def test_invalid_entries_not_cached(self):
+        self.yaml_path.write_text("name:\n  type: single-file\n")
+
+        with pytest.raises(AutomaticEntryError, match="Missing required"):
+            get_automatic_entries()
+        assert not self.cache_path.exists()
+
+
 class TestCheckYamlEntry:
     @pytest.fixture
     def attrs(self):
@@ -191,6 +367,37 @@ class TestCheckYamlEntry:
             "zipname": "a.zip",
         }
 
+    @pytest.mark.parametrize(
+        "attribute, value",
+        [
+            ("max-size", 1048576),
+            ("min-size", 0),
+            ("newer-than", 3600),
+            ("older-than", 1.5),
+            ("owner", 1000),
+        ],
+    )
+    def test_numeric_predicates(self, attrs, attribute, value):
+        attrs[attribute] = value
+        result = check_yaml_entry(**attrs)
+        assert result[attribute.replace("-", "_")] == value
+
+    @pytest.mark.parametrize("attribute", ["max-size", "min-size"])
+    def test_invalid_falsy_type(self, attrs, attribute):
+        attrs[attribute] = []
+        match = f"If defined, {attribute.replace('-', '_')!r} must be"
+        with pytest.raises(TypeError, match=match):
+            check_yaml_entry(**attrs)
+
+    @pytest.mark.parametrize(
+        "attribute", ["max-size", "min-size", "newer-than", "older-than", "schedule"]
+    )
+    def test_invalid_predicates(self, attrs, attribute):
+        attrs[attribute] = "invalid"
+        key = attribute.replace("-", "_")
+        with pytest.raises(AutomaticEntryError, match=f"Invalid {key!r}"):
+            check_yaml_entry(**attrs)
+
     def test_invalid_entry_type(self, attrs):
         attrs["type"] = "invalid-type"
         with pytest.raises(TypeError, match="'invalid-type' is not a valid Entrytype"):
@@ -203,12 +410,21 @@ class TestCheckYamlEntry:
                 continue
             if attr in attrs:
                 continue
-            attrs[attr] = ATTRS_TYPES[attr](2)
+            attr_type = ATTRS_TYPES[attr]
+            if isinstance(attr_type, tuple):
+                attr_type = attr_type[0]
+            attrs[attr] = attr_type(2)
         attrs[attribute] = 1 + 2j
 
-        match = (
-            f"{attribute!r} must be {ATTRS_TYPES[attribute].__name__!r}, not 'complex'"
-        )
+        names = {
+            "max_size": "'str', 'int' or 'float'",
+            "min_size": "'str', 'int' or 'float'",
+            "newer_than": "'str', 'int' or 'float'",
+            "older_than": "'str', 'int' or 'float'",
+            "owner": "'str' or 'int'",
+        }
+        type_name = names.get(attribute) or repr(ATTRS_TYPES[attribute].__name__)
+        match = f"{attribute!r} must be {type_name}, not 'complex'"
         if attribute not in REQUIRED_ATTRS:
             match = "If defined, " + match
         with pytest.raises(TypeError, match=match):
@@ -0,0 +1,187 @@
+import json
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.bench import (
+    Workload,
+    compare,
+    format_comparison,
+    format_report,
+    get_peak_rss,
+    percentile,
+    run_bench,
+)
+from backup_to_cloud.config import settings
+
+
+class TestWorkload:
+    @pytest.mark.parametrize("distribution", ["fixed", "uniform", "lognormal"])
+    def test_sizes(self, distribution):
+        workload = Workload(2000, 1000, distribution, seed=3)
+        sizes = workload.sizes()
+
+        assert len(sizes) == 2000
+        assert sizes == Workload(2000, 1000, distribution, seed=3).sizes()
+        assert 900 < sum(sizes) / len(sizes) < 1100
+        if distribution == "fixed":
+            assert set(sizes) == {1000}
+        else:
+            assert len(set(sizes)) > 100
+
+    def test_sizes_seed(self):
+        assert (
+            Workload(10, 1000, "uniform").sizes()
+            != Workload(10, 1000, "uniform", seed=1).sizes()
+        )
+
+    def test_create(self, tmp_path):
+        workload = Workload(150, 1000, "uniform", compressibility=0.25)
+        total = workload.create(tmp_path / "a")
+        Workload(150, 1000, "uniform", compressibility=0.25).create(tmp_path / "b")
+
+        files = sorted(tmp_path.joinpath("a").rglob("*.dat"))
+        assert len(files) == 150
+        assert sorted(x.name for x in tmp_path.joinpath("a").iterdir()) == [
+            "dir-0",
+            "dir-1",
+        ]
+        assert total == sum(workload.sizes()) == sum(x.stat().st_size for x in files)
+        for file in files:
+            content = file.read_bytes()
+            zeros = int(len(content) * 0.25)
+            assert (
+                content
+                == tmp_path.joinpath("b", file.relative_to(tmp_path / "a")).read_bytes()
+            )
+            assert content.endswith(bytes(zeros))
+
+    def test_create_blocks(self, tmp_path):
+        with mock.patch("backup_to_cloud.bench.RANDOM_BLOCK_SIZE", 64):
+            workload = Workload(3, 1000, compressibility=0.3)
+            workload.create(tmp_path)
+
+        for file in tmp_path.rglob("*.dat"):
+            content = file.read_bytes()
+            assert len(content) == 1000
+            assert content[700:] == bytes(300)
+            # The random data is a block of 64 bytes, repeated.
+            assert content[:636] == content[64:700]
+            assert len(set(content[:64])) > 10
+
+    @pytest.mark.parametrize(
+        "kwargs, match",
+        [
+            (dict(files=0, size=10), "number of files"),
+            (dict(files=1, size=-1), "size"),
+            (dict(files=1, size=1, distribution="normal"), "distribution"),
+            (dict(files=1, size=1, compressibility=1.5), "compressibility"),
+        ],
+    )
+    def test_invalid(self, kwargs, match):
+        with pytest.raises(ValueError, match=match):
+            Workload(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "values, percent, expected",
+    [
+        ([], 50, 0),
+        ([5], 99, 5),
+        ([3, 1, 2], 50, 2),
+        ([1, 2, 3, 4], 50, 2.5),
+        ([1, 2, 3, 4], 100, 4),
+        (list(range(101)), 90, 90),
+    ],
+)
+def test_percentile(values, percent, expected):
+    assert percentile(values, percent) == pytest.approx(expected)
+
+
+def test_get_peak_rss():
+    assert get_peak_rss() > 1024**2
+
+
+@pytest.mark.parametrize("use_zip", [False, True])
+def test_run_bench(tmp_path, use_zip):
+    previous = settings._settings
+    workload = Workload(12, 2000, "lognormal", zip=use_zip)
+
+    report = run_bench(workload, tmp_path)
+
+    assert settings._settings is previous
+    assert report["workload"] == workload.as_dict()
+    assert report["files"] == 12
+    assert report["bytes"] == sum(workload.sizes())
+    assert report["uploads"] == (1 if use_zip else 12)
+    # The zip file is streamed in a resumable upload, which takes a request
+    # to start the session.
+    assert report["api_requests"] == (3 if use_zip else 24)
+    assert report["wall_time"] > 0
+    assert report["peak_rss"] > 1024**2
+    assert report["throughput_files"] == pytest.approx(12 / report["wall_time"])
+    assert 0 < report["latency_p50"] <= report["latency_p99"] <= report["latency_max"]
+    assert json.loads(json.dumps(report)) == report
+
+    root_path = tmp_path / "root"
+    assert root_path.joinpath("cloud-backup.log").exists()
+    assert root_path.joinpath("state", "metrics.prom").exists()
+
+
+def test_compare():
+    baseline = {
+        "throughput_bytes": 100,
+        "wall_time": 10,
+        "cpu_time": 5,
+        "peak_rss": None,
+        "latency_p50": 0,
+    }
+    report = {
+        "throughput_bytes": 80,
+        "wall_time": 10.5,
+        "cpu_time": 4,
+        "peak_rss": 1000,
+        "latency_p50": 0.1,
+    }
+
+    results = compare(report, baseline, 10)
+
+    assert [x["metric"] for x in results] == [
+        "throughput_bytes",
+        "wall_time",
+        "cpu_time",
+    ]
+    assert [x["regression"] for x in results] == [True, False, False]
+    assert [x["change"] for x in results] == pytest.approx([-20, 5, -20])
+    assert [x["regression"] for x in compare(report, baseline, 25)] == [False] * 3
+
+    table = format_comparison(results)
+    assert table.count("REGRESSION") == 1
+    assert "-20.0%  REGRESSION" in table
+
+
+def test_format_report():
+    report = {
+        "files": 10,
+        "bytes": 2048,
+        "uploads": 1,
+        "uploaded_bytes": 1024,
+        "api_requests": 2,
+        "wall_time": 0.5,
+        "cpu_time": 0.25,
+        "peak_rss": 50 * 1024**2,
+        "throughput_bytes": 4096,
+        "throughput_files": 20,
+        "latency_p50": 0.01,
+        "latency_p90": 0.02,
+        "latency_p99": 0.03,
+        "latency_max": 0.04,
+    }
+
+    text = format_report(report)
+    assert "Peak RSS: 50.0 MiB" in text
+    assert "20.0 files/s" in text
+    assert "p50 10.0 ms, p90 20.0 ms, p99 30.0 ms, max 40.0 ms" in text
+
+    report["peak_rss"] = None
+    assert "Peak RSS: -" in format_report(report)
@@ -1,5 +1,10 @@
 """Main module to handle start of execution."""
 
+import json
+import os
+import re
+import subprocess
+import sys
 from unittest import mock
 
 import pytest
@@ -19,9 +24,9 @@ def test_help(arg):
 
 
 @pytest.mark.parametrize("args", [["<root-path>"], ["<root-path>", "<regex>"]])
-@mock.patch("backup_to_cloud.cli.list_files")
-def test_check_regex_command(list_files_m, args):
-    list_files_m.return_value.__iter__.return_value = list("abcdef")
+@mock.patch("backup_to_cloud.walker.iter_matches")
+def test_check_regex_command(iter_matches_m, args):
+    iter_matches_m.return_value = iter([(x, None) for x in "abcdef"])
 
     runner = CliRunner()
     result = runner.invoke(main, ["check-regex"] + args)
@@ -29,13 +34,33 @@ def test_check_regex_command(list_files_m, args):
     assert result.exit_code == 0
     assert result.output == "\n".join("abcdef") + "\n"
 
-    if len(args) == 1:
-        list_files_m.assert_called_once_with("<root-path>", ".")
-    else:
-        list_files_m.assert_called_once_with("<root-path>", "<regex>")
+    regex = "." if len(args) == 1 else "<regex>"
+    iter_matches_m.assert_called_once_with("<root-path>", regex, mock.ANY)
 
 
-@mock.patch("backup_to_cloud.cli.gen_new_token")
+def test_check_regex_command_summary(tmp_path):
+    tmp_path.joinpath("a").mkdir()
+    tmp_path.joinpath("a/x.log").write_bytes(b"x" * 2000)
+    tmp_path.joinpath("y.log").write_bytes(b"y" * 48)
+    tmp_path.joinpath("z.txt").write_bytes(b"z")
+
+    runner = CliRunner()
+    args = ["check-regex", tmp_path.as_posix(), ".log$", "--summary"]
+    result = runner.invoke(main, args)
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[:4] == [
+        "Matched files: 2",
+        "Total size: 2.0 KB (2048 bytes)",
+        "Folders scanned: 2",
+        "Files scanned: 3",
+    ]
+    assert re.match(r"Elapsed time: [\d.]+ s \(\d+ files/s\)", lines[4])
+    assert len(lines) == 5
+
+
+@mock.patch("backup_to_cloud.drive.gen_new_token")
 def test_gen_token_command(gen_new_token_m):
     runner = CliRunner()
     result = runner.invoke(main, ["gen-token"])
@@ -45,17 +70,285 @@ def test_gen_token_command(gen_new_token_m):
     gen_new_token_m.assert_called_once_with()
 
 
-@mock.patch("backup_to_cloud.cli.create_backup")
+@mock.patch("backup_to_cloud.main.create_backup")
 def test_create_backup_command(create_backup_m):
+    create_backup_m.return_value = {}
     runner = CliRunner()
     result = runner.invoke(main, ["create-backup"])
 
     assert result.exit_code == 0
     assert result.output == ""
-    create_backup_m.assert_called_once_with()
+    create_backup_m.assert_called_once_with(deadline=None)
+
+
+@mock.patch("backup_to_cloud.main.create_backup")
+def test_create_backup_command_deadline(create_backup_m):
+    create_backup_m.return_value = {"a": None, "b": ["/home/b.txt"]}
+    result = CliRunner().invoke(main, ["create-backup", "--deadline", "2h"])
+
+    assert result.exit_code == 0
+    assert "Deadline reached, 2 entries left for the next run" in result.output
+    create_backup_m.assert_called_once_with(deadline=7200)
+
+
+@mock.patch("backup_to_cloud.main.create_backup")
+def test_create_backup_command_invalid_deadline(create_backup_m):
+    result = CliRunner().invoke(main, ["create-backup", "--deadline", "soon"])
+
+    assert result.exit_code == 2
+    create_backup_m.assert_not_called()
+
+
+@pytest.mark.parametrize("profiler", [None, "sample", "cprofile"])
+@mock.patch("backup_to_cloud.main.create_backup")
+def test_create_backup_command_profile(create_backup_m, profiler, tmp_path):
+    args = ["create-backup", "--profile"]
+    if profiler:
+        args += ["--profiler", profiler]
+
+    with mock.patch("backup_to_cloud.config.settings") as settings_m:
+        settings_m.root_path = tmp_path
+        result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 0
+    create_backup_m.assert_called_once_with(deadline=None)
+
+    suffix = ".pstats" if profiler == "cprofile" else ".folded"
+    files = sorted(x.suffix for x in tmp_path.iterdir())
+    assert files == sorted([suffix, ".txt"])
+    assert "Profile saved to" in result.output
+
+
+@mock.patch("backup_to_cloud.walker.iter_matches")
+def test_check_regex_command_profile(iter_matches_m, tmp_path):
+    iter_matches_m.return_value = iter([("a", None)])
+
+    with mock.patch("backup_to_cloud.config.settings") as settings_m:
+        settings_m.root_path = tmp_path
+        args = ["check-regex", "<root-path>", "--profile"]
+        result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 0
+    assert len(list(tmp_path.glob("profile-check-regex-*"))) == 2
+
+
+@mock.patch("signal.signal")
+@mock.patch("backup_to_cloud.daemon.Daemon")
+def test_daemon_command(daemon_m, signal_m):
+    daemon_m.return_value.schedules = {"a": "<schedule>"}
+    daemon_m.return_value.run.side_effect = KeyboardInterrupt
+
+    result = CliRunner().invoke(main, ["daemon", "--poll-interval", "1"])
+
+    assert result.exit_code == 0
+    assert "Running 1 scheduled entries" in result.output
+    daemon_m.assert_called_once_with(1)
+    daemon_m.return_value.reload.assert_called_once_with()
+    daemon_m.return_value.run.assert_called_once_with()
+
+    handler = signal_m.call_args[0][1]
+    handler(15, None)
+    daemon_m.return_value.stop.assert_called_once_with()
+
+
+@mock.patch("signal.signal")
+@mock.patch("backup_to_cloud.main.create_backup")
+@mock.patch("backup_to_cloud.automatic.get_automatic_entries")
+@mock.patch("backup_to_cloud.watcher.Watcher")
+def test_watch_command(watcher_m, get_autentr_m, create_backup_m, signal_m):
+    entries = [mock.MagicMock(root_path="/" + x) for x in "abc"]
+    for entry, name in zip(entries, "abc"):
+        entry.name = name
+    entries[2].root_path = None
+    get_autentr_m.return_value = entries
+    watcher_m.return_value.dirs = {1: "/a", 2: "/b"}
+    watcher_m.return_value.run.side_effect = KeyboardInterrupt
+
+    args = ["watch", "a", "--initial", "--debounce", "5"]
+    result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 0
+    assert "Watching 1 entries (2 folders)" in result.output
+    create_backup_m.assert_called_once_with(["a"])
+    watcher_m.assert_called_once_with([entries[0]], 5, 60)
+    watcher_m.return_value.close.assert_called_once_with()
+
+    signal_m.call_args[0][1](15, None)
+    watcher_m.return_value.stop.assert_called_once_with()
+
+    result = CliRunner().invoke(main, ["watch", "c"])
+    assert result.exit_code == 2
+    assert "Unknown entries: c" in result.output
+
+    watcher_m.reset_mock()
+    watcher_m.side_effect = OSError("inotify is only available on Linux")
+    result = CliRunner().invoke(main, ["watch"])
+    assert result.exit_code == 1
+    assert "inotify is only available on Linux" in result.output
+    assert watcher_m.call_args[0][0] == entries[:2]
+
+
+@mock.patch("backup_to_cloud.emulator.DriveEmulator")
+def test_drive_emulator_command(emulator_m):
+    emulator_m.return_value.url = "<url>"
+    emulator_m.return_value.serve_forever.side_effect = KeyboardInterrupt
+
+    args = ["drive-emulator", "--port", "9000", "--error-rate", "0.1"]
+    result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 0
+    assert "Serving on <url>" in result.output
+    emulator_m.assert_called_once_with("127.0.0.1", 9000, 0, 0, 0.1, seed=0)
+    emulator_m.return_value.stop.assert_called_once_with()
 
 
 @mock.patch("backup_to_cloud.cli.main")
 def test_cli(main_m):
     cli()
     main_m.assert_called_once_with(prog_name="backup-to-cloud")
+
+
+def test_lightweight_import():
+    env = {k: v for k, v in os.environ.items() if k != "BTC_ROOT_PATH"}
+    code = "import backup_to_cloud.cli"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    modules = {x.split("|")[-1].strip() for x in result.stderr.splitlines()}
+    assert "backup_to_cloud.cli" in modules
+    for heavy in ("googleapiclient", "google_auth_oauthlib", "ruamel", "pydantic"):
+        assert heavy not in modules
+
+
+def test_check_regex_without_settings(tmp_path):
+    tmp_path.joinpath("file.txt").touch()
+    env = {k: v for k, v in os.environ.items() if k != "BTC_ROOT_PATH"}
+    args = [sys.executable, "-m", "backup_to_cloud", "check-regex", str(tmp_path)]
+    result = subprocess.run(
+        args, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True
+    )
+
+    assert result.stdout == tmp_path.joinpath("file.txt").as_posix() + "\n"
+
+
+@mock.patch("backup_to_cloud.bench.run_bench")
+def test_bench_command(run_bench_m, tmp_path):
+    report = {
+        "workload": {"files": 10},
+        "files": 10,
+        "bytes": 2048,
+        "uploads": 10,
+        "uploaded_bytes": 2048,
+        "api_requests": 20,
+        "wall_time": 0.5,
+        "cpu_time": 0.25,
+        "peak_rss": 1024**2,
+        "throughput_bytes": 4096,
+        "throughput_files": 20,
+        "latency_p50": 0.01,
+        "latency_p90": 0.02,
+        "latency_p99": 0.03,
+        "latency_max": 0.04,
+    }
+    run_bench_m.return_value = report
+    output = tmp_path / "report.json"
+
+    args = ["bench", "--files", "10", "--size", "1KB", "--output", str(output)]
+    result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 0
+    assert "Throughput: 0.00 MiB/s, 20.0 files/s" in result.output
+    workload = run_bench_m.call_args[0][0]
+    assert (workload.files, workload.size, workload.zip) == (10, 1024, False)
+    assert json.loads(output.read_text()) == report
+
+    baseline = dict(report, throughput_files=25, workload={"files": 20})
+    output.write_text(json.dumps(baseline))
+    args = ["bench", "--baseline", str(output)]
+    result = CliRunner().invoke(main, args)
+
+    assert result.exit_code == 1
+    assert "REGRESSION" in result.output
+    assert "another workload" in result.output
+    assert "Regressions found" in result.output
+
+    result = CliRunner().invoke(main, args + ["--threshold", "25"])
+    assert result.exit_code == 0
+
+
+def test_bench_command_invalid():
+    result = CliRunner().invoke(main, ["bench", "--compressibility", "2"])
+    assert result.exit_code == 2
+    assert "Invalid compressibility" in result.output
+
+
+@mock.patch("backup_to_cloud.config.settings")
+@mock.patch("backup_to_cloud.planner.estimate_duration")
+@mock.patch("backup_to_cloud.planner.plan_backup")
+def test_plan_command(plan_backup_m, estimate_duration_m, settings_m):
+    from backup_to_cloud.planner import EntryPlan
+
+    plan = EntryPlan("docs", resumed=True)
+    plan.files, plan.bytes, plan.upload_bytes = 3, 2048, 2048
+    plan.skipped, plan.deleted, plan.api_calls, plan.seconds = 1, 2, 6, 1.5
+    plan_backup_m.return_value = [plan]
+    estimate_duration_m.return_value = 1.5
+    settings_m.workers = 4
+
+    result = CliRunner().invoke(main, ["plan", "docs"])
+
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert lines[0] == "Resuming the work left by the last backup"
+    assert lines[1].split() == [
+        "Entry",
+        "Files",
+        "Size",
+        "Upload",
+        "Skipped",
+        "Deleted",
+        "API",
+        "Time",
+    ]
+    assert lines[2].split() == [
+        "docs",
+        "3",
+        "2.0",
+        "KB",
+        "2.0",
+        "KB",
+        "1",
+        "2",
+        "6",
+    ] + [
+        "1.5",
+        "s",
+    ]
+    assert "Files to upload: 3 (2.0 KB)" in lines
+    assert "Estimated duration: 1.5 s (4 workers)" in lines
+    plan_backup_m.assert_called_once_with(["docs"])
+    estimate_duration_m.assert_called_once_with([plan], 4)
+
+
+@mock.patch("backup_to_cloud.config.settings")
+@mock.patch("backup_to_cloud.planner.estimate_duration")
+@mock.patch("backup_to_cloud.planner.plan_backup")
+def test_plan_command_json(plan_backup_m, estimate_duration_m, settings_m):
+    from backup_to_cloud.planner import EntryPlan
+
+    plan_backup_m.return_value = [EntryPlan("docs")]
+    estimate_duration_m.return_value = 0.0
+    settings_m.workers = 2
+
+    result = CliRunner().invoke(main, ["plan", "--json"])
+
+    assert result.exit_code == 0
+    report = json.loads(result.output)
+    assert report["entries"][0]["name"] == "docs"
+    assert report["workers"] == 2
+    plan_backup_m.assert_called_once_with(None)
@@ -4,17 +4,32 @@ from pathlib import Path
 import pytest
 from pydantic import DirectoryPath, FilePath, ValidationError
 
-from backup_to_cloud.config import Settings, settings
+from backup_to_cloud.config import LazySettings, Settings, settings
 
 
 def test_settings_fields():
     fields = Settings.__fields__
-    assert set(fields) == {"root_path", "credentials_path"}
+    assert set(fields) == {
+        "root_path",
+        "credentials_path",
+        "metrics_path",
+        "drive_api_url",
+        "log_format",
+        "log_max_size",
+        "log_backups",
+        "workers",
+        "max_memory",
+    }
 
     assert fields["root_path"].required is True
     assert fields["credentials_path"].required is False
     assert fields["root_path"].type_ == DirectoryPath
     assert fields["credentials_path"].type_ == FilePath
+    assert fields["log_format"].default == "text"
+    assert fields["log_max_size"].default == 10 * 1024**2
+    assert fields["log_backups"].default == 3
+    assert fields["workers"].default == 4
+    assert fields["max_memory"].default is None
 
 
 def test_root_path():
@@ -69,3 +84,103 @@ def test_token_path():
         settings.token_path.name
     )
     assert settings.token_path.suffix == ".pickle"
+
+
+def test_state_path():
+    assert isinstance(settings.state_path, Path)
+    assert settings.state_path.relative_to(settings.root_path) == Path(
+        settings.state_path.name
+    )
+
+
+def test_history_path():
+    assert settings.history_path == settings.state_path.joinpath("history.json")
+
+
+def test_resume_queue_path():
+    assert settings.resume_queue_path == settings.state_path.joinpath("resume.json")
+
+
+def test_upload_journal_path():
+    assert settings.upload_journal_path == settings.state_path.joinpath("uploads.jsonl")
+
+
+def test_mimetype_cache_path():
+    assert isinstance(settings.mimetype_cache_path, Path)
+    assert settings.mimetype_cache_path.parent == settings.state_path
+    assert settings.mimetype_cache_path.suffix == ".json"
+
+
+def test_lazy_settings(monkeypatch):
+    monkeypatch.delenv("BTC_ROOT_PATH")
+    lazy_settings = LazySettings()
+    assert repr(lazy_settings) == "LazySettings(None)"
+
+    with pytest.raises(ValidationError, match="value_error.missing"):
+        lazy_settings.root_path
+
+    monkeypatch.setenv("BTC_ROOT_PATH", settings.root_path.as_posix())
+    assert lazy_settings.root_path == settings.root_path
+    assert repr(lazy_settings).startswith("LazySettings(Settings(")
+
+
+def test_automatic_cache_path():
+    assert isinstance(settings.automatic_cache_path, Path)
+    assert settings.automatic_cache_path.parent == settings.automatic_path.parent
+
+
+def test_discovery_cache_path():
+    assert isinstance(settings.discovery_cache_path, Path)
+    assert settings.discovery_cache_path.parent == settings.state_path
+    assert settings.discovery_cache_path.suffix == ".json"
+
+
+@pytest.mark.parametrize("log_format", ["text", "json", "JSON"])
+def test_log_format(monkeypatch, log_format):
+    monkeypatch.setenv("BTC_LOG_FORMAT", log_format)
+    assert Settings().log_format == log_format.lower()
+
+
+def test_log_format_invalid(monkeypatch):
+    monkeypatch.setenv("BTC_LOG_FORMAT", "xml")
+    with pytest.raises(ValidationError, match="must be 'text' or 'json'"):
+        Settings()
+
+
+@pytest.mark.parametrize("field", ["log_max_size", "log_backups"])
+def test_log_rotation_negative(monkeypatch, field):
+    monkeypatch.setenv(f"BTC_{field.upper()}", "-1")
+    with pytest.raises(ValidationError, match="must not be negative"):
+        Settings()
+
+
+@pytest.mark.parametrize("workers", ["0", "-1"])
+def test_workers_invalid(monkeypatch, workers):
+    monkeypatch.setenv("BTC_WORKERS", workers)
+    with pytest.raises(ValidationError, match="must be at least 1"):
+        Settings()
+
+
+@pytest.mark.parametrize(
+    "max_memory, expected", [("512MB", 512 * 1024**2), ("16777216", 16 * 1024**2)]
+)
+def test_max_memory(monkeypatch, max_memory, expected):
+    monkeypatch.setenv("BTC_MAX_MEMORY", max_memory)
+    assert Settings().max_memory == expected
+
+
+@pytest.mark.parametrize(
+    "max_memory, message",
+    [("1MB", "must be at least 16MB"), ("lots", "Invalid size")],
+)
+def test_max_memory_invalid(monkeypatch, max_memory, message):
+    monkeypatch.setenv("BTC_MAX_MEMORY", max_memory)
+    with pytest.raises(ValidationError, match=message):
+        Settings()
+
+
+def test_metrics_path(monkeypatch, tmp_path):
+    assert settings.metrics_path == settings.state_path.joinpath("metrics.prom")
+
+    monkeypatch.setenv("BTC_METRICS_PATH", (tmp_path / "btc.prom").as_posix())
+    assert Settings().metrics_path == tmp_path / "btc.prom"
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+from threading import Thread
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.automatic import BackupEntry
+from backup_to_cloud.daemon import Daemon
+from backup_to_cloud.exceptions import AutomaticEntryError
+
+NOW = datetime(2021, 3, 4, 10, 20, 30)
+
+
+class TestDaemon:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.daemon.settings").start()
+        self.get_autentr_m = mock.patch(
+            "backup_to_cloud.daemon.get_automatic_entries"
+        ).start()
+        self.create_backup_m = mock.patch(
+            "backup_to_cloud.daemon.create_backup"
+        ).start()
+        self.log_m = mock.patch("backup_to_cloud.daemon.log").start()
+        self.writer_m = mock.patch("backup_to_cloud.daemon.log_writer").start()
+
+        self.path = tmp_path / ".automatic.yml"
+        self.path.write_text("<v1>")
+        self.settings_m.automatic_path = self.path
+        self.get_autentr_m.return_value = [
+            BackupEntry("a", "single-file", "/a", schedule="*/15 * * * *"),
+            BackupEntry("b", "single-file", "/b", schedule="0 * * * *"),
+            BackupEntry("c", "single-file", "/c"),
+        ]
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_reload(self):
+        daemon = Daemon()
+
+        assert daemon.reload(NOW) is True
+        assert sorted(daemon.schedules) == ["a", "b"]
+        assert daemon.next_runs == {
+            "a": datetime(2021, 3, 4, 10, 30),
+            "b": datetime(2021, 3, 4, 11, 0),
+        }
+        self.log_m.assert_any_call("Entry %r has no schedule, skipping it", "c")
+        self.log_m.assert_called_with("Loaded %d scheduled entries", 2)
+
+        assert daemon.reload(NOW) is False
+        self.get_autentr_m.assert_called_once_with()
+
+    def test_reload_changed(self):
+        daemon = Daemon()
+        daemon.reload(NOW)
+
+        self.path.write_text("<version-2>")
+        self.get_autentr_m.return_value = [
+            BackupEntry("a", "single-file", "/a", schedule="*/15 * * * *"),
+            BackupEntry("b", "single-file", "/b", schedule="45 * * * *"),
+            BackupEntry("d", "single-file", "/d", schedule="@daily"),
+        ]
+        later = NOW + timedelta(minutes=20)
+
+        assert daemon.reload(later) is True
+        assert daemon.next_runs == {
+            "a": datetime(2021, 3, 4, 10, 30),
+            "b": datetime(2021, 3, 4, 10, 45),
+            "d": datetime(2021, 3, 5, 0, 0),
+        }
+
+    def test_reload_invalid(self):
+        daemon = Daemon()
+        daemon.reload(NOW)
+        next_runs = dict(daemon.next_runs)
+
+        self.path.write_text("<invalid>")
+        self.get_autentr_m.side_effect = AutomaticEntryError("<error>")
+
+        with pytest.raises(AutomaticEntryError):
+            daemon.reload(NOW)
+        assert daemon.next_runs == next_runs
+        assert daemon.reload(NOW) is False
+
+    def test_run_pending(self):
+        daemon = Daemon()
+        daemon.reload(NOW)
+
+        assert daemon.run_pending(NOW) == []
+        self.create_backup_m.assert_not_called()
+
+        now = datetime(2021, 3, 4, 11, 0, 5)
+        assert daemon.run_pending(now) == ["a", "b"]
+        self.create_backup_m.assert_called_once_with(["a", "b"])
+        assert daemon.next_runs == {
+            "a": datetime(2021, 3, 4, 11, 15),
+            "b": datetime(2021, 3, 4, 12, 0),
+        }
+
+    def test_run_pending_error(self):
+        daemon = Daemon()
+        daemon.reload(NOW)
+        exc = FileNotFoundError("/a")
+        self.create_backup_m.side_effect = exc
+
+        assert daemon.run_pending(NOW + timedelta(minutes=10)) == ["a"]
+        self.log_m.assert_called_with(exc)
+        assert daemon.next_runs["a"] == datetime(2021, 3, 4, 10, 45)
+
+    def test_get_timeout(self):
+        daemon = Daemon(poll_interval=5)
+        assert daemon.get_timeout(NOW) == 5
+
+        daemon.reload(NOW)
+        assert daemon.get_timeout(datetime(2021, 3, 4, 10, 29, 58)) == 2
+        assert daemon.get_timeout(datetime(2021, 3, 4, 10, 31)) == 0
+        assert daemon.get_timeout(NOW) == 5
+
+    def test_run_stop(self):
+        daemon = Daemon(poll_interval=0.01)
+        exc = AutomaticEntryError("<error>")
+        self.get_autentr_m.side_effect = exc
+        self.writer_m.flush.side_effect = lambda: daemon.stop()
+
+        thread = Thread(target=daemon.run)
+        thread.start()
+        thread.join(5)
+
+        assert not thread.is_alive()
+        self.log_m.assert_called_once_with(exc)
+        self.create_backup_m.assert_not_called()
@@ -0,0 +1,32 @@
+from unittest import mock
+
+from backup_to_cloud.deadline import Deadline
+
+
+@mock.patch("backup_to_cloud.deadline.monotonic")
+def test_expired(monotonic_m):
+    monotonic_m.return_value = 100
+    deadline = Deadline(60)
+    assert deadline.end == 160
+    assert not deadline.expired()
+
+    monotonic_m.return_value = 160
+    assert deadline.expired()
+
+
+def test_no_deadline():
+    deadline = Deadline()
+    assert deadline.end is None
+    assert not deadline.expired()
+    assert Deadline(0).expired()
+
+
+def test_defer():
+    deadline = Deadline()
+    deadline.defer_file("a", "/home/a/1.txt")
+    deadline.defer_file("a", "/home/a/2.txt")
+    deadline.defer_entry("b")
+    deadline.defer_file("b", "/home/b/1.txt")
+
+    assert deadline.pending == {"a": ["/home/a/1.txt", "/home/a/2.txt"], "b": None}
+    assert repr(deadline) == "Deadline(expired=False, pending=2)"
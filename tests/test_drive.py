@@ -0,0 +1,487 @@
+import os
+from datetime import datetime, timedelta, timezone
+from threading import Barrier, Thread
+from time import sleep, time
+from unittest import mock
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.auth.exceptions import RefreshError, TransportError
+
+from backup_to_cloud.drive import (
+    DISCOVERY_MAX_AGE,
+    DISCOVERY_URL,
+    REFRESH_MARGIN,
+    SCOPES,
+    CredentialManager,
+    _fetch_discovery_document,
+    clear_services_cache,
+    gen_new_token,
+    get_creds_from_token,
+    get_discovery_document,
+    get_google_drive_services,
+)
+from backup_to_cloud.exceptions import TokenError
+
+
+def test_module_constants():
+    assert isinstance(SCOPES, list)
+    assert len(SCOPES) == 1
+    assert isinstance(SCOPES[0], str)
+    assert "googleapis" in SCOPES[0]
+
+
+class TestGenNewToken:
+    @pytest.fixture(autouse=True)
+    def mocks(self):
+        secrets_path = "backup_to_cloud.drive.InstalledAppFlow.from_client_secrets_file"
+        self.fcsf_m = mock.patch(secrets_path).start()
+        self.pkl_dumps_m = mock.patch("backup_to_cloud.drive.pickle.dumps").start()
+        self.scopes_m = mock.patch("backup_to_cloud.drive.SCOPES").start()
+        self.settings_m = mock.patch("backup_to_cloud.drive.settings").start()
+        self.creds_m = mock.patch("backup_to_cloud.drive.credentials").start()
+
+        yield
+        mock.patch.stopall()
+
+    @pytest.mark.parametrize("exists", [True, False])
+    def test_gen_new_token(self, exists):
+        self.settings_m.credentials_path.exists.return_value = exists
+        self.settings_m.credentials_path.as_posix.return_value = "<creds-path>"
+
+        if not exists:
+            with pytest.raises(FileNotFoundError, match="<creds-path>"):
+                gen_new_token()
+            self.fcsf_m.assert_not_called()
+            return
+
+        gen_new_token()
+
+        self.fcsf_m.assert_called_once_with(
+            self.settings_m.credentials_path.as_posix.return_value, self.scopes_m
+        )
+        self.fcsf_m.return_value.run_local_server.assert_called_once_with(port=0)
+        flow = self.fcsf_m.return_value.run_local_server.return_value
+
+        self.pkl_dumps_m.assert_called_once_with(flow)
+        self.creds_m.invalidate.assert_called_once_with()
+        self.settings_m.token_path.write_bytes.assert_called_once_with(
+            self.pkl_dumps_m.return_value
+        )
+
+
+@pytest.fixture(autouse=True)
+def services_cache():
+    clear_services_cache()
+    yield
+    clear_services_cache()
+
+
+@pytest.mark.parametrize("creds", [None, "<creds>"])
+@mock.patch("backup_to_cloud.drive.get_discovery_document")
+@mock.patch("backup_to_cloud.drive.get_creds_from_token")
+@mock.patch("backup_to_cloud.drive.build_from_document")
+def test_get_google_drive_services(bfd_m, gcft_m, gdd_m, creds):
+    gdd_m.return_value = {"name": "drive", "resources": {"files": {}}}
+    get_google_drive_services(creds)
+
+    gdd_m.assert_called_once_with()
+    if not creds:
+        gcft_m.assert_called_once_with()
+        bfd_m.assert_called_once_with(
+            gdd_m.return_value, credentials=gcft_m.return_value
+        )
+    else:
+        gcft_m.assert_not_called()
+        bfd_m.assert_called_once_with(gdd_m.return_value, credentials="<creds>")
+
+    document = bfd_m.call_args[0][0]
+    assert document is not gdd_m.return_value
+    assert document["resources"] is not gdd_m.return_value["resources"]
+
+
+@mock.patch("backup_to_cloud.drive.get_discovery_document")
+@mock.patch("backup_to_cloud.drive.get_creds_from_token")
+@mock.patch("backup_to_cloud.drive.build_from_document")
+def test_get_google_drive_services_document_unchanged(bfd_m, gcft_m, gdd_m):
+    gdd_m.return_value = {"name": "drive", "resources": {"files": {}}}
+
+    def build(document, **kwargs):
+        document["resources"]["files"]["methods"] = {}
+        return mock.MagicMock()
+
+    bfd_m.side_effect = build
+    get_google_drive_services()
+
+    assert gdd_m.return_value == {"name": "drive", "resources": {"files": {}}}
+
+
+@pytest.mark.parametrize("creds", [None, "<creds>"])
+@mock.patch("backup_to_cloud.drive.settings")
+@mock.patch("backup_to_cloud.drive.get_discovery_document")
+@mock.patch("backup_to_cloud.drive.get_creds_from_token")
+@mock.patch("backup_to_cloud.drive.build_from_document")
+def test_get_google_drive_services_api_url(bfd_m, gcft_m, gdd_m, settings_m, creds):
+    gdd_m.return_value = {"rootUrl": "https://www.googleapis.com/", "name": "drive"}
+    settings_m.drive_api_url = "http://127.0.0.1:8000"
+
+    get_google_drive_services(creds)
+
+    gcft_m.assert_not_called()
+    document = bfd_m.call_args[0][0]
+    assert document["rootUrl"] == "http://127.0.0.1:8000/"
+    assert document["name"] == "drive"
+    assert gdd_m.return_value["rootUrl"] == "https://www.googleapis.com/"
+
+    credentials = bfd_m.call_args[1]["credentials"]
+    if creds:
+        assert credentials == "<creds>"
+    else:
+        assert isinstance(credentials, AnonymousCredentials)
+
+
+@mock.patch("backup_to_cloud.drive.settings")
+@mock.patch("backup_to_cloud.drive.get_discovery_document")
+@mock.patch("backup_to_cloud.drive.get_creds_from_token")
+@mock.patch("backup_to_cloud.drive.build_from_document")
+def test_get_google_drive_services_cached(bfd_m, gcft_m, gdd_m, settings_m):
+    settings_m.drive_api_url = None
+    bfd_m.side_effect = lambda *args, **kwargs: mock.MagicMock()
+
+    service = get_google_drive_services()
+    assert get_google_drive_services() is service
+    assert bfd_m.call_count == 1
+
+    gcft_m.return_value = mock.MagicMock()
+    assert get_google_drive_services() is not service
+    settings_m.drive_api_url = "http://127.0.0.1:8000"
+    assert get_google_drive_services() is not service
+    assert bfd_m.call_count == 3
+
+    thread_services = []
+    thread = Thread(target=lambda: thread_services.append(get_google_drive_services()))
+    thread.start()
+    thread.join()
+    assert thread_services[0] is not get_google_drive_services()
+    assert bfd_m.call_count == 4
+
+
+@mock.patch("backup_to_cloud.drive.settings")
+@mock.patch("backup_to_cloud.drive.get_discovery_document")
+@mock.patch("backup_to_cloud.drive.get_creds_from_token")
+@mock.patch("backup_to_cloud.drive.build_from_document")
+def test_get_google_drive_services_pool(bfd_m, gcft_m, gdd_m, settings_m):
+    settings_m.drive_api_url = None
+    bfd_m.side_effect = lambda *args, **kwargs: mock.MagicMock()
+
+    def run_threads(count):
+        barrier = Barrier(count)
+        thread_services = []
+
+        def target():
+            thread_services.append(get_google_drive_services())
+            barrier.wait()
+
+        threads = [Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return thread_services
+
+    first = run_threads(2)
+    assert len(set(map(id, first))) == 2
+    assert bfd_m.call_count == 2
+
+    # The services outlive their threads.
+    second = run_threads(3)
+    assert set(map(id, first)) < set(map(id, second))
+    assert bfd_m.call_count == 3
+
+    # Services of other credentials are not reused.
+    gcft_m.return_value = mock.MagicMock()
+    third = run_threads(1)
+    assert not set(map(id, second)) & set(map(id, third))
+    assert bfd_m.call_count == 4
+
+    clear_services_cache()
+    run_threads(1)
+    assert bfd_m.call_count == 5
+
+
+class TestGetDiscoveryDocument:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.drive.settings").start()
+        self.fetch_m = mock.patch(
+            "backup_to_cloud.drive._fetch_discovery_document"
+        ).start()
+        self.log_m = mock.patch("backup_to_cloud.drive.log").start()
+        self.path = tmp_path / "state" / "discovery.json"
+        self.settings_m.discovery_cache_path = self.path
+        self.fetch_m.return_value = '{"version": "new"}'
+        get_discovery_document.cache_clear()
+
+        yield
+
+        get_discovery_document.cache_clear()
+        mock.patch.stopall()
+
+    def test_not_cached(self):
+        assert get_discovery_document() == {"version": "new"}
+        assert get_discovery_document() == {"version": "new"}
+
+        self.fetch_m.assert_called_once_with()
+        assert self.path.read_text() == '{"version": "new"}'
+
+    def test_cached(self):
+        self.path.parent.mkdir()
+        self.path.write_text('{"version": "cached"}')
+
+        assert get_discovery_document() == {"version": "cached"}
+        self.fetch_m.assert_not_called()
+
+    def test_cached_outdated(self):
+        self.path.parent.mkdir()
+        self.path.write_text('{"version": "cached"}')
+        old = time() - DISCOVERY_MAX_AGE - 1
+        os.utime(self.path, (old, old))
+
+        assert get_discovery_document() == {"version": "new"}
+        self.fetch_m.assert_called_once_with()
+        assert self.path.read_text() == '{"version": "new"}'
+
+    def test_cached_outdated_fetch_error(self):
+        self.path.parent.mkdir()
+        self.path.write_text('{"version": "cached"}')
+        old = time() - DISCOVERY_MAX_AGE - 1
+        os.utime(self.path, (old, old))
+        self.fetch_m.side_effect = OSError("<error>")
+
+        assert get_discovery_document() == {"version": "cached"}
+        self.log_m.assert_called_once_with(
+            "Using outdated discovery document: %r", self.fetch_m.side_effect
+        )
+
+    def test_fetch_error(self):
+        self.fetch_m.side_effect = OSError("<error>")
+
+        with pytest.raises(OSError, match="<error>"):
+            get_discovery_document()
+        assert not self.path.exists()
+
+
+@mock.patch("googleapiclient.discovery_cache.get_static_doc")
+@mock.patch("backup_to_cloud.drive.httplib2.Http")
+def test_fetch_discovery_document(http_m, gsd_m):
+    gsd_m.return_value = "<static-doc>"
+    assert _fetch_discovery_document() == "<static-doc>"
+    gsd_m.assert_called_once_with("drive", "v3")
+    http_m.assert_not_called()
+
+    gsd_m.return_value = None
+    http_m.return_value.request.return_value = (mock.Mock(status=200), b"<doc>")
+    assert _fetch_discovery_document() == "<doc>"
+    http_m.return_value.request.assert_called_once_with(DISCOVERY_URL)
+
+    http_m.return_value.request.return_value = (mock.Mock(status=404), b"")
+    with pytest.raises(OSError, match="Can't download discovery document"):
+        _fetch_discovery_document()
+
+
+class TestGetCredsFromToken:
+    @pytest.fixture(autouse=True)
+    def mocks(self):
+        self.settings_m = mock.patch("backup_to_cloud.drive.settings").start()
+        self.pkl_loads_m = mock.patch("backup_to_cloud.drive.pickle.loads").start()
+        self.pkl_dumps_m = mock.patch("backup_to_cloud.drive.pickle.dumps").start()
+        self.log_m = mock.patch("backup_to_cloud.drive.log").start()
+        self.req_m = mock.patch("backup_to_cloud.drive.Request").start()
+        self.aw_m = mock.patch("backup_to_cloud.drive.atomic_write").start()
+        self.credentials = CredentialManager()
+        mock.patch("backup_to_cloud.drive.credentials", self.credentials).start()
+
+        self.settings_m.token_path.as_posix.return_value = "<token-path>"
+        self.settings_m.token_path.read_bytes.return_value = b"<pickle-data>"
+        self.pkl_dumps_m.return_value = b"<new-pickle-data>"
+        self.pkl_loads_m.return_value.expiry = None
+
+        yield
+
+        mock.patch.stopall()
+
+    @pytest.fixture(params=[True, False])
+    def valid(self, request):
+        return request.param
+
+    @pytest.fixture(params=[True, False])
+    def exists(self, request):
+        return request.param
+
+    @pytest.fixture(params=[True, False])
+    def expired(self, request):
+        return request.param
+
+    @pytest.fixture(params=[None, "<refresh-token>"])
+    def refresh_token(self, request):
+        return request.param
+
+    def test_get_creds_from_token(self, exists, valid, expired, refresh_token):
+        self.settings_m.token_path.exists.return_value = exists
+        self.pkl_loads_m.return_value.valid = valid
+        self.pkl_loads_m.return_value.expired = expired
+        self.pkl_loads_m.return_value.refresh_token = refresh_token
+
+        do_refresh = expired and bool(refresh_token) and not valid and exists
+        error = not valid and (not expired or not bool(refresh_token)) and exists
+
+        if not exists:
+            with pytest.raises(TokenError, match="'<token-path>' doesn't exist") as exc:
+                get_creds_from_token()
+
+            self.pkl_loads_m.assert_not_called()
+            self.pkl_dumps_m.assert_not_called()
+            self.log_m.assert_called_with(exc.value)
+            return
+
+        if error:
+            with pytest.raises(
+                TokenError, match="Invalid token: '<token-path>'"
+            ) as exc:
+                get_creds_from_token()
+
+            self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
+            self.pkl_dumps_m.assert_not_called()
+            self.log_m.assert_called_with(exc.value)
+            return
+
+        creds = get_creds_from_token()
+        assert creds == self.pkl_loads_m.return_value
+
+        self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
+
+        if do_refresh:
+            self.req_m.assert_called_once_with()
+            self.pkl_loads_m.return_value.refresh.assert_called_once_with(
+                self.req_m.return_value
+            )
+            self.pkl_dumps_m.assert_called_once_with(self.pkl_loads_m.return_value)
+            self.aw_m.assert_called_once_with(
+                self.settings_m.token_path, b"<new-pickle-data>"
+            )
+            self.log_m.assert_called_once_with(
+                "Token updated (expires %s)", self.pkl_loads_m.return_value.expiry
+            )
+        else:
+            self.req_m.assert_not_called()
+            self.pkl_dumps_m.assert_not_called()
+            self.aw_m.assert_not_called()
+            self.log_m.assert_not_called()
+
+    def test_loaded_once(self):
+        self.pkl_loads_m.return_value.valid = True
+
+        for _ in range(5):
+            assert get_creds_from_token() == self.pkl_loads_m.return_value
+
+        self.settings_m.token_path.read_bytes.assert_called_once_with()
+        self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
+
+    @pytest.mark.parametrize("expires_in", [60, 299, 301, 3600])
+    def test_proactive_refresh(self, expires_in):
+        creds = self.pkl_loads_m.return_value
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        creds.valid = True
+        creds.refresh_token = "<refresh-token>"
+        creds.expiry = now + timedelta(seconds=expires_in)
+
+        get_creds_from_token()
+
+        if expires_in < REFRESH_MARGIN:
+            creds.refresh.assert_called_once_with(self.req_m.return_value)
+            self.aw_m.assert_called_once()
+        else:
+            creds.refresh.assert_not_called()
+            self.aw_m.assert_not_called()
+
+    @pytest.mark.parametrize("error", [RefreshError, TransportError])
+    def test_proactive_refresh_error(self, error):
+        creds = self.pkl_loads_m.return_value
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        creds.valid = True
+        creds.refresh_token = "<refresh-token>"
+        creds.expiry = now + timedelta(seconds=60)
+        creds.refresh.side_effect = error("<error>")
+
+        assert get_creds_from_token() == creds
+
+        creds.refresh.assert_called_once_with(self.req_m.return_value)
+        self.log_m.assert_called_once_with(
+            "Token refresh failed, using the current token: %r",
+            creds.refresh.side_effect,
+        )
+        self.aw_m.assert_not_called()
+
+    def test_expired_refresh_error(self):
+        creds = self.pkl_loads_m.return_value
+        creds.valid = False
+        creds.expired = True
+        creds.refresh_token = "<refresh-token>"
+        creds.refresh.side_effect = RefreshError("<error>")
+
+        with pytest.raises(RefreshError, match="<error>"):
+            get_creds_from_token()
+
+        creds.refresh.assert_called_once_with(self.req_m.return_value)
+        self.aw_m.assert_not_called()
+
+    def test_token_unchanged(self):
+        creds = self.pkl_loads_m.return_value
+        creds.valid = False
+        creds.expired = True
+        creds.refresh_token = "<refresh-token>"
+        self.pkl_dumps_m.return_value = b"<pickle-data>"
+
+        get_creds_from_token()
+
+        creds.refresh.assert_called_once_with(self.req_m.return_value)
+        self.aw_m.assert_not_called()
+
+    def test_concurrent_refresh(self):
+        creds = self.pkl_loads_m.return_value
+        creds.valid = False
+        creds.expired = True
+        creds.refresh_token = "<refresh-token>"
+        barrier = Barrier(8)
+
+        def refresh(request):
+            sleep(0.05)
+            creds.valid = True
+
+        def worker():
+            barrier.wait()
+            results.append(get_creds_from_token())
+
+        creds.refresh.side_effect = refresh
+        results = []
+        threads = [Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == [creds] * 8
+        creds.refresh.assert_called_once_with(self.req_m.return_value)
+        self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
+        self.aw_m.assert_called_once_with(
+            self.settings_m.token_path, b"<new-pickle-data>"
+        )
+
+    def test_invalidate(self):
+        self.pkl_loads_m.return_value.valid = True
+
+        get_creds_from_token()
+        self.credentials.invalidate()
+        get_creds_from_token()
+
+        assert self.pkl_loads_m.call_count == 2
@@ -0,0 +1,280 @@
+import os
+from hashlib import md5
+from io import BytesIO
+from time import perf_counter
+from unittest import mock
+
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+
+from backup_to_cloud.config import settings
+from backup_to_cloud.drive import clear_services_cache, get_google_drive_services
+from backup_to_cloud.emulator import (
+    DriveEmulator,
+    DriveError,
+    _parse_fields,
+    _parse_query,
+)
+from backup_to_cloud.upload import backup
+
+
+@pytest.fixture
+def emulator():
+    with DriveEmulator() as emu:
+        settings.drive_api_url = emu.url
+        yield emu
+    settings.drive_api_url = None
+    clear_services_cache()
+
+
+@pytest.fixture
+def service(emulator):
+    return get_google_drive_services()
+
+
+@pytest.fixture(autouse=True)
+def mocks():
+    with mock.patch("backup_to_cloud.upload.log"):
+        yield
+
+
+def test_backup_new_file_and_version(emulator, service):
+    backup(BytesIO(b"first"), "text/plain", "<folder>", filename="a.txt")
+    backup(BytesIO(b"second"), "text/plain", "<folder>", filename="a.txt")
+    backup(BytesIO(b"other"), "text/plain", "<other-folder>", filename="a.txt")
+
+    assert len(emulator.files) == 2
+    query = "name = 'a.txt' and '<folder>' in parents"
+    fields = "files(id, name, md5Checksum, size, parents)"
+    files = service.files().list(q=query, fields=fields).execute()["files"]
+    assert len(files) == 1
+    assert files[0]["md5Checksum"] == md5(b"second").hexdigest()
+    assert files[0]["size"] == "6"
+    assert files[0]["parents"] == ["<folder>"]
+
+    file_id = files[0]["id"]
+    assert service.files().get_media(fileId=file_id).execute() == b"second"
+    revisions = service.revisions().list(fileId=file_id).execute()["revisions"]
+    assert len(revisions) == 2
+
+
+@pytest.mark.parametrize("end", [b"", b"\n", b"\r\n", b"\n\n", b"\r\n\r\nline2\r\n"])
+def test_multipart_binary(emulator, service, end):
+    content = os.urandom(300000) + b"\r\n--boundary\r\n" + os.urandom(1000) + end
+    media = MediaIoBaseUpload(BytesIO(content), mimetype="application/octet-stream")
+    body = {"name": "data.bin", "parents": ["root"]}
+    result = service.files().create(body=body, media_body=media, fields="*").execute()
+
+    assert result["md5Checksum"] == md5(content).hexdigest()
+    assert result["mimeType"] == "application/octet-stream"
+    assert emulator.files[result["id"]]["content"] == content
+
+
+def test_multipart_crlf_text(emulator, service):
+    content = b"line1\r\n\r\nline2\r\n"
+    media = MediaIoBaseUpload(BytesIO(content), mimetype="text/plain")
+    result = service.files().create(body={"name": "a.txt"}, media_body=media).execute()
+
+    assert emulator.files[result["id"]]["content"] == content
+
+
+@pytest.mark.parametrize("size", [0, 1000, 3 * 1024**2 + 17])
+def test_resumable(emulator, service, size):
+    content = os.urandom(size)
+    media = MediaIoBaseUpload(
+        BytesIO(content),
+        mimetype="application/octet-stream",
+        chunksize=1024**2,
+        resumable=True,
+    )
+    body = {"name": "big.bin"}
+    request = service.files().create(body=body, media_body=media, fields="id,size")
+    result = request.execute()
+
+    assert result["size"] == str(size)
+    assert emulator.files[result["id"]]["content"] == content
+    assert not emulator._sessions
+
+
+@pytest.mark.parametrize("resumable", [False, True])
+def test_no_content(emulator, service, resumable):
+    emulator.keep_content = False
+    content = os.urandom(3 * 1024**2 + 17)
+    media = MediaIoBaseUpload(
+        BytesIO(content),
+        mimetype="application/octet-stream",
+        chunksize=1024**2,
+        resumable=resumable,
+    )
+    body = {"name": "big.bin"}
+    request = service.files().create(body=body, media_body=media, fields="*")
+    result = request.execute()
+
+    assert result["size"] == str(len(content))
+    assert result["md5Checksum"] == md5(content).hexdigest()
+    assert emulator.files[result["id"]]["content"] is None
+    with pytest.raises(HttpError, match="content of the files is not kept"):
+        service.files().get_media(fileId=result["id"]).execute()
+
+
+def test_resumable_update(emulator, service):
+    file_id = backup(BytesIO(b"v1"), "text/plain", "root", filename="a.txt")["id"]
+
+    media = MediaIoBaseUpload(BytesIO(b"v2"), mimetype="text/plain", resumable=True)
+    service.files().update(fileId=file_id, media_body=media).execute()
+
+    assert emulator.files[file_id]["content"] == b"v2"
+    assert len(emulator.files[file_id]["revisions"]) == 2
+
+
+def test_batch(emulator, service):
+    file_id = backup(BytesIO(b"data"), "text/plain", "root", filename="a.txt")["id"]
+    responses = {}
+
+    def callback(request_id, response, exception):
+        responses[request_id] = (response, exception)
+
+    batch = service.new_batch_http_request(callback=callback)
+    batch.add(service.files().list(q="name contains 'a'"), request_id="list")
+    request = service.files().get(fileId=file_id, fields="md5Checksum")
+    batch.add(request, request_id="get")
+    request = service.files().update(fileId=file_id, body={"name": "b.txt"})
+    batch.add(request, request_id="up")
+    batch.add(service.files().get(fileId="<invalid-id>"), request_id="missing")
+    batch.execute()
+
+    assert responses["list"][0]["files"][0]["id"] == file_id
+    assert responses["get"][0] == {"md5Checksum": md5(b"data").hexdigest()}
+    assert responses["up"][0]["name"] == "b.txt"
+    assert responses["missing"][0] is None
+    assert responses["missing"][1].resp.status == 404
+    assert emulator.stats["batch_requests"] == 4
+
+
+def test_delete(emulator, service):
+    file_id = backup(BytesIO(b"data"), "text/plain", "root", filename="a.txt")["id"]
+    service.files().delete(fileId=file_id).execute()
+
+    assert not emulator.files
+    with pytest.raises(HttpError) as exc:
+        service.files().delete(fileId=file_id).execute()
+    assert exc.value.resp.status == 404
+
+
+def test_pagination(emulator, service):
+    for index in range(5):
+        service.files().create(body={"name": f"file-{index}"}).execute()
+
+    result = service.files().list(pageSize=2).execute()
+    assert len(result["files"]) == 2
+    result = service.files().list(pageSize=2, pageToken="4").execute()
+    assert len(result["files"]) == 1
+    assert "nextPageToken" not in result
+
+
+@mock.patch("backup_to_cloud.upload.sleep")
+@mock.patch("backup_to_cloud.upload.metrics")
+def test_injected_errors(metrics_m, sleep_m):
+    with DriveEmulator(error_rate=0.5, error_statuses=(429, 503), seed=1) as emu:
+        settings.drive_api_url = emu.url
+        try:
+            for index in range(10):
+                backup(BytesIO(b"data"), "text/plain", "root", filename=f"{index}")
+        finally:
+            settings.drive_api_url = None
+            clear_services_cache()
+
+    assert len(emu.files) == 10
+    assert emu.stats["errors"] > 0
+    assert sleep_m.call_count == emu.stats["errors"]
+    retries = metrics_m.inc.call_args_list.count(mock.call("backup_entry_api_retries"))
+    assert retries == emu.stats["errors"]
+
+
+def test_injected_errors_reproducible():
+    def run():
+        emulator = DriveEmulator(error_rate=0.3, seed=42)
+        emulator.stop()
+        results = []
+        for _ in range(50):
+            results.append(emulator.handle("GET", "/drive/v3/files", {}, b"")[0])
+        return results
+
+    results = run()
+    assert results == run()
+    assert {429, 500, 503, 200} >= set(results)
+    assert 200 in results and len(set(results)) > 1
+
+
+def test_latency_and_bandwidth():
+    emulator = DriveEmulator(latency=0.05, bandwidth=1024**2)
+    emulator.stop()
+
+    start = perf_counter()
+    headers = {"content-type": "text/plain"}
+    url = "/upload/drive/v3/files?uploadType=media"
+    status, _, _ = emulator.handle("POST", url, headers, b"x" * 100 * 1024)
+    elapsed = perf_counter() - start
+
+    assert status == 200
+    assert 0.14 < elapsed < 1
+
+
+def test_not_found():
+    emulator = DriveEmulator()
+    emulator.stop()
+
+    status, _, content = emulator.handle("GET", "/invalid", {}, b"")
+    assert status == 404
+    assert b"notFound" in content
+
+
+@pytest.mark.parametrize(
+    "query, names",
+    [
+        ("", ["a.txt", "b.pdf", "it's.txt"]),
+        ("name = 'a.txt'", ["a.txt"]),
+        ("name != 'a.txt'", ["b.pdf", "it's.txt"]),
+        ("name contains '.txt'", ["a.txt", "it's.txt"]),
+        ("name = 'it\\'s.txt'", ["it's.txt"]),
+        ('name = "it\'s.txt"', ["it's.txt"]),
+        ("'folder' in parents", ["a.txt", "b.pdf"]),
+        ("'folder' in parents and name = 'b.pdf'", ["b.pdf"]),
+        ("name = 'a and b' and trashed = false", []),
+        ("mimeType = 'application/pdf' and trashed = false", ["b.pdf"]),
+        ("trashed = true", []),
+    ],
+)
+def test_parse_query(query, names):
+    files = [
+        {"name": "a.txt", "mimeType": "text/plain", "parents": ["folder"]},
+        {"name": "b.pdf", "mimeType": "application/pdf", "parents": ["folder"]},
+        {"name": "it's.txt", "mimeType": "text/plain", "parents": ["root"]},
+    ]
+    for file in files:
+        file["trashed"] = False
+
+    predicates = _parse_query(query)
+    result = [x["name"] for x in files if all(p(x) for p in predicates)]
+    assert result == names
+
+
+def test_parse_query_invalid():
+    with pytest.raises(DriveError, match="Invalid query"):
+        _parse_query("modifiedTime > '2020-01-01'")
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        ("*", None),
+        ("id", {"id": None}),
+        ("id, name", {"id": None, "name": None}),
+        ("files(id, name),kind", {"files": {"id": None, "name": None}, "kind": None}),
+        ("files/id", {"files": {"id": None}}),
+        ("files(*)", {"files": None}),
+    ],
+)
+def test_parse_fields(fields, expected):
+    assert _parse_fields(fields) == expected
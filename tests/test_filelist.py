@@ -0,0 +1,41 @@
+from pathlib import Path
+
+import pytest
+
+from backup_to_cloud.filelist import FileList
+
+
+class TestFileList:
+    @pytest.fixture
+    def files(self):
+        file_list = FileList()
+        file_list.add_dir("/home/test/public", ["error.log", "access.log"])
+        file_list.add_dir("/home/test/index", ["error.log", "access.log"])
+        file_list.add_dir("/home/test/empty", [])
+        file_list.add_dir("/home/test/index/a", ["a.txt"])
+        yield file_list
+
+    def test_iter(self, files):
+        expected = [
+            "/home/test/index/access.log",
+            "/home/test/index/error.log",
+            "/home/test/index/a/a.txt",
+            "/home/test/public/access.log",
+            "/home/test/public/error.log",
+        ]
+        assert list(files.iter_posix()) == expected
+        assert list(files) == [Path(x) for x in expected]
+        assert list(files) == [Path(x) for x in expected]
+
+    def test_len(self, files):
+        assert len(files) == 5
+        assert bool(files) is True
+        assert len(FileList()) == 0
+        assert bool(FileList()) is False
+
+    def test_repr(self, files):
+        assert repr(files) == "FileList(files=5, folders=3)"
+
+    def test_from_paths(self):
+        files = FileList.from_paths(["/a/b/c.txt", Path("/a/d.txt"), "/a/b/a.txt"])
+        assert list(files.iter_posix()) == ["/a/d.txt", "/a/b/a.txt", "/a/b/c.txt"]
@@ -0,0 +1,122 @@
+import json
+from threading import Thread
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.logger import LogWriter
+
+
+class TestLogWriter:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.logger.settings").start()
+        self.settings_m.log_path = tmp_path / "cloud-backup.log"
+        self.settings_m.log_format = "text"
+        self.settings_m.log_max_size = 0
+        self.settings_m.log_backups = 3
+        self.time_m = mock.patch("backup_to_cloud.logger.time").start()
+        self.time_m.return_value = 1600000000.5
+        self.path = self.settings_m.log_path
+        self.writer = LogWriter()
+
+        yield
+
+        self.writer.close()
+        mock.patch.stopall()
+
+    def test_text(self):
+        self.writer.write("first message")
+        self.writer.write("<exc>", error=True)
+
+        # Buffered until flushed
+        assert self.path.read_text() == ""
+        self.writer.flush()
+
+        lines = self.path.read_text().splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith("] first message")
+        assert lines[1].endswith("] ERROR: <exc>")
+        assert lines[0].startswith("[2020-09-1")
+
+    def test_json(self):
+        self.settings_m.log_format = "json"
+        self.writer.write("first message")
+        self.writer.write("<exc>", error=True)
+        self.writer.close()
+
+        lines = self.path.read_text().splitlines()
+        records = [json.loads(x) for x in lines]
+        assert [x["level"] for x in records] == ["INFO", "ERROR"]
+        assert [x["message"] for x in records] == ["first message", "<exc>"]
+        assert records[0]["time"] == records[1]["time"]
+
+    def test_opened_once(self):
+        with mock.patch.object(
+            type(self.path), "open", autospec=True, side_effect=type(self.path).open
+        ) as open_m:
+            for i in range(100):
+                self.writer.write(f"message {i}")
+            self.writer.flush()
+
+        open_m.assert_called_once_with(self.path, "at", encoding="utf-8")
+        assert len(self.path.read_text().splitlines()) == 100
+
+    def test_timestamp_cached(self):
+        with mock.patch("backup_to_cloud.logger.datetime") as dt_m:
+            dt_m.fromtimestamp.return_value.strftime.return_value = "<datetime>"
+            for _ in range(10):
+                self.writer.write("message")
+            self.time_m.return_value += 1
+            self.writer.write("message")
+
+        assert dt_m.fromtimestamp.call_count == 2
+        self.writer.flush()
+        assert self.path.read_text().startswith("[<datetime>] message\n")
+
+    def test_append(self):
+        self.path.write_text("old message\n")
+        self.writer.write("new message")
+        self.writer.close()
+
+        lines = self.path.read_text().splitlines()
+        assert lines[0] == "old message"
+        assert lines[1].endswith("new message")
+
+    @pytest.mark.parametrize("backups", [0, 1, 3])
+    def test_rotation(self, backups):
+        self.settings_m.log_max_size = 100
+        self.settings_m.log_backups = backups
+
+        for i in range(20):
+            self.writer.write(f"message {i:02d}")
+        self.writer.close()
+
+        logs = sorted(x.name for x in self.path.parent.iterdir())
+        expected = ["cloud-backup.log"]
+        expected += [f"cloud-backup.log.{i}" for i in range(1, backups + 1)]
+        assert logs == expected
+
+        for name in logs:
+            assert self.path.with_name(name).stat().st_size <= 100
+        assert self.path.read_text().splitlines()[-1].endswith("message 19")
+        if backups:
+            first_line = self.path.with_name("cloud-backup.log.1").read_text()
+            assert "message 1" in first_line
+
+    def test_threads(self):
+        def worker(thread_id):
+            for i in range(200):
+                self.writer.write(f"thread {thread_id} message {i}")
+
+        threads = [Thread(target=worker, args=(x,)) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.writer.close()
+
+        lines = self.path.read_text().splitlines()
+        assert len(lines) == 1600
+        for line in lines:
+            assert line.startswith("[") and "] thread " in line
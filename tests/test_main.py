@@ -1,11 +1,27 @@
+import os
 import random
+from io import BytesIO
+from threading import Barrier, Lock, current_thread
+from time import sleep
 from unittest import mock
+from zipfile import ZipFile
 
 import pytest
 
 from backup_to_cloud.automatic import BackupEntry
+from backup_to_cloud.deadline import Deadline
 from backup_to_cloud.exceptions import AutomaticEntryError, NoFilesFoundError
-from backup_to_cloud.main import create_backup
+from backup_to_cloud.filelist import FileList, FileStat
+from backup_to_cloud.main import (
+    ZIP_BUFFERS,
+    _compress,
+    backup_files,
+    create_backup,
+    order_entries,
+)
+from backup_to_cloud.memory import MemoryBudget
+from backup_to_cloud.pipeline import QUEUE_SIZE
+from backup_to_cloud.upload import CHUNK_SIZE, ChunkedUpload
 from backup_to_cloud.utils import ZIP_MIMETYPE
 
 
@@ -17,10 +33,18 @@ class TestCreateBackup:
         self.get_autentr_m = mock.patch(
             "backup_to_cloud.main.get_automatic_entries"
         ).start()
-        self.list_files_m = mock.patch("backup_to_cloud.main.list_files").start()
-        self.zipfile_m = mock.patch("backup_to_cloud.main.ZipFile").start()
-        self.bytesio_m = mock.patch("backup_to_cloud.main.BytesIO").start()
+        self.walk_entries_m = mock.patch("backup_to_cloud.main.walk_entries").start()
         self.log_m = mock.patch("backup_to_cloud.main.log").start()
+        self.cache_m = mock.patch("backup_to_cloud.main.mimetype_cache").start()
+        self.history_m = mock.patch("backup_to_cloud.main.run_history").start()
+        self.journal_m = mock.patch("backup_to_cloud.main.upload_journal").start()
+        self.history_m.estimate.return_value = None
+        self.load_queue_m = mock.patch("backup_to_cloud.main.load_resume_queue").start()
+        self.load_queue_m.return_value = None
+        self.save_queue_m = mock.patch("backup_to_cloud.main.save_resume_queue").start()
+        self.writer_m = mock.patch("backup_to_cloud.main.log_writer").start()
+        self.metrics_m = mock.patch("backup_to_cloud.main.metrics").start()
+        self.walk_stats_m = mock.patch("backup_to_cloud.main.WalkStats").start()
 
         yield
 
@@ -36,8 +60,29 @@ class TestCreateBackup:
         self.backup_m.assert_not_called()
         self.get_mt_m.assert_not_called()
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.assert_not_called()
+        self.walk_entries_m.assert_called_once_with(
+            [], self.walk_stats_m.return_value, overlapping_only=True
+        )
         self.log_m.assert_called_once_with("Excluding entry %r", "<name>")
+        self.cache_m.save.assert_called_once_with()
+        self.journal_m.compact.assert_called_once_with()
+        self.writer_m.flush.assert_called_once_with()
+        self.metrics_m.reset.assert_called_once_with()
+        self.metrics_m.record_run.assert_called_once_with(mock.ANY, True)
+        self.metrics_m.write.assert_called_once_with()
+
+    def test_metrics_write_error(self):
+        self.get_autentr_m.return_value = []
+        exc = PermissionError("<metrics-path>")
+        self.metrics_m.write.side_effect = exc
+
+        create_backup()
+
+        self.log_m.assert_called_once_with(exc)
+        self.walk_stats_m.assert_called_once_with()
+        self.metrics_m.inc.assert_any_call(
+            "backup_walk_files", self.walk_stats_m.return_value.files
+        )
 
     def test_single_file(self):
         entry = BackupEntry("<name>", "single-file", "/home/file.pdf", "<folder-id>")
@@ -51,8 +96,11 @@ class TestCreateBackup:
         )
         self.get_mt_m.assert_called_once_with("/home/file.pdf")
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.assert_not_called()
+        self.walk_entries_m.assert_called_once_with(
+            [], self.walk_stats_m.return_value, overlapping_only=True
+        )
         self.log_m.assert_not_called()
+        assert self.writer_m.flush.call_count == 2
 
     @pytest.mark.parametrize("nulls", range(11))
     def test_single_file_mix(self, nulls):
@@ -67,7 +115,9 @@ class TestCreateBackup:
         create_backup()
 
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.assert_not_called()
+        self.walk_entries_m.assert_called_once_with(
+            [], self.walk_stats_m.return_value, overlapping_only=True
+        )
 
         if nulls != 10:
             self.backup_m.assert_called_with(
@@ -81,11 +131,84 @@ class TestCreateBackup:
         if nulls != 0:
             self.log_m.assert_called_with("Excluding entry %r", "<name>")
 
-        self.bytesio_m.assert_not_called()
         assert self.backup_m.call_count == 10 - nulls
         assert self.get_mt_m.call_count == 10 - nulls
         assert self.log_m.call_count == nulls
 
+    def test_names(self):
+        entries = [
+            BackupEntry("a", "single-file", "/home/a.pdf", "<folder-id>"),
+            BackupEntry("b", "single-file", "/home/b.pdf", "<folder-id>"),
+            BackupEntry("c", "single-file", "/home/c.pdf", "<folder-id>"),
+        ]
+        self.get_autentr_m.return_value = entries
+        self.get_mt_m.return_value = "<mimetype>"
+
+        create_backup(["c", "a", "<unknown>"])
+
+        assert self.backup_m.call_args_list == [
+            mock.call("/home/a.pdf", "<mimetype>", "<folder-id>"),
+            mock.call("/home/c.pdf", "<mimetype>", "<folder-id>"),
+        ]
+
+    def test_parallel(self):
+        entries = [
+            BackupEntry(str(x), "single-file", f"/home/{x}.pdf", "<folder-id>")
+            for x in range(4)
+        ]
+        self.get_autentr_m.return_value = entries
+        barrier = Barrier(4, timeout=5)
+        threads = set()
+
+        def backup(filepath, *args):
+            threads.add(current_thread().name)
+            barrier.wait()
+            if filepath.endswith(("1.pdf", "2.pdf")):
+                raise OSError(filepath)
+
+        self.backup_m.side_effect = backup
+
+        with mock.patch("backup_to_cloud.main.settings") as settings_m:
+            settings_m.workers = 4
+            with pytest.raises(OSError, match="/home/1.pdf"):
+                create_backup()
+
+        assert self.backup_m.call_count == 4
+        assert len(threads) == 4
+        assert current_thread().name not in threads
+        self.log_m.assert_any_call("Entry %r failed: %r", "1", mock.ANY)
+        self.log_m.assert_any_call("Entry %r failed: %r", "2", mock.ANY)
+        assert self.log_m.call_count == 2
+        assert self.writer_m.flush.call_count == 3
+        self.metrics_m.record_run.assert_called_once_with(mock.ANY, False)
+        assert self.metrics_m.entry.call_count == 4
+
+    def test_workers(self):
+        entries = [
+            BackupEntry(str(x), "single-file", f"/home/{x}.pdf", "<folder-id>")
+            for x in range(6)
+        ]
+        self.get_autentr_m.return_value = entries
+        running, max_running = [0], [0]
+        lock = Lock()
+
+        def backup(*args):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        self.backup_m.side_effect = backup
+
+        with mock.patch("backup_to_cloud.main.settings") as settings_m:
+            settings_m.workers = 2
+            create_backup()
+
+        assert self.backup_m.call_count == 6
+        assert max_running[0] == 2
+
     def test_invalid_type(self):
         entry = BackupEntry("<name>", "single-file", None, "<folder-id>")
         entry = mock.MagicMock(
@@ -104,10 +227,137 @@ class TestCreateBackup:
             create_backup()
 
         self.backup_m.assert_not_called()
-        self.bytesio_m.assert_not_called()
         self.get_mt_m.assert_not_called()
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.assert_not_called()
+        self.walk_entries_m.assert_called_once_with(
+            [], self.walk_stats_m.return_value, overlapping_only=True
+        )
+
+    def test_order(self, tmp_path):
+        tmp_path.joinpath("b.pdf").write_bytes(b"b" * 100)
+        entries = [
+            BackupEntry(x, "single-file", f"{tmp_path}/{x}.pdf", "<folder-id>")
+            for x in "abcd"
+        ]
+        self.get_autentr_m.return_value = entries
+        estimates = {"a": 1, "b": 5, "c": None, "d": 3}
+        self.history_m.estimate.side_effect = lambda name, size: estimates[name]
+        self.metrics_m.get.return_value = 10
+
+        with mock.patch("backup_to_cloud.main.settings") as settings_m:
+            settings_m.workers = 1
+            create_backup()
+
+        self.history_m.estimate.assert_any_call("a", None)
+        self.history_m.estimate.assert_any_call("b", 100)
+        assert [x[0][0][-5] for x in self.backup_m.call_args_list] == list("cbda")
+        assert self.history_m.record.call_args_list == [
+            mock.call(x, mock.ANY, 10, 10) for x in "cbda"
+        ]
+        self.metrics_m.set.assert_any_call("backup_entry_estimated_seconds", 5)
+        self.history_m.save.assert_called_once_with()
+
+    def test_order_failed_entry(self):
+        entries = [
+            BackupEntry(x, "single-file", f"/home/{x}.pdf", "<folder-id>") for x in "ab"
+        ]
+        self.get_autentr_m.return_value = entries
+        self.backup_m.side_effect = [OSError("<error>"), None]
+
+        with mock.patch("backup_to_cloud.main.settings") as settings_m:
+            settings_m.workers = 1
+            with pytest.raises(OSError):
+                create_backup()
+
+        self.history_m.record.assert_called_once_with("b", mock.ANY, mock.ANY, mock.ANY)
+        self.history_m.save.assert_called_once_with()
+
+    def test_deadline_expired(self):
+        entries = [
+            BackupEntry(x, "single-file", f"/home/{x}.pdf", "<folder-id>") for x in "ab"
+        ]
+        self.get_autentr_m.return_value = entries
+
+        assert create_backup(deadline=0) == {"a": None, "b": None}
+
+        self.backup_m.assert_not_called()
+        self.save_queue_m.assert_called_once_with({"a": None, "b": None})
+        self.log_m.assert_any_call(
+            "Deadline reached, %d entries left for the next backup", 2
+        )
+
+    def test_deadline_names(self):
+        entry = BackupEntry("a", "single-file", "/home/a.pdf", "<folder-id>")
+        self.get_autentr_m.return_value = [entry]
+
+        assert create_backup(["a"], deadline=0) == {"a": None}
+
+        self.load_queue_m.assert_not_called()
+        self.save_queue_m.assert_not_called()
+
+    def test_deadline_files(self, tree):
+        root, files = tree
+        entries = [
+            BackupEntry("a", "multiple-files", root.as_posix(), "<folder-id>"),
+            BackupEntry("b", "multiple-files", root.as_posix(), "<id>", zip=True),
+        ]
+        self.get_autentr_m.return_value = entries
+        self.walk_entries_m.return_value = {}
+        expired = [False]
+
+        def backup(file_data, *args, **kwargs):
+            if isinstance(file_data, ChunkedUpload):
+                file_data.getbytes(0, 1024**2)
+            expired[0] = True
+
+        self.backup_m.side_effect = backup
+        with mock.patch("backup_to_cloud.main.settings") as settings_m:
+            settings_m.workers = 2
+            with mock.patch.object(Deadline, "expired", lambda x: expired[0]):
+                pending = create_backup(deadline=60)
+
+        # The zip file is uploaded completely.
+        assert self.backup_m.call_count == 2
+        assert sorted(pending) == ["a"]
+        assert len(pending["a"]) == 3
+        assert root.joinpath("doc.pdf").as_posix() not in pending["a"]
+        self.save_queue_m.assert_called_once_with(pending)
+
+    def test_resume(self, tree):
+        root, _ = tree
+        entries = [
+            BackupEntry("a", "multiple-files", root.as_posix(), "<folder-id>"),
+            BackupEntry("b", "multiple-files", root.as_posix(), "<folder-id>"),
+            BackupEntry("c", "single-file", "/home/c.pdf", "<folder-id>"),
+            BackupEntry("d", "single-file", "/home/d.pdf", "<folder-id>"),
+        ]
+        self.get_autentr_m.return_value = entries
+        self.walk_entries_m.return_value = {"b": FileList.from_paths([root])}
+        paths = [root.joinpath("doc.pdf").as_posix(), "/home/missing.pdf"]
+        self.load_queue_m.return_value = {"a": paths, "b": None, "c": None}
+        uploaded = []
+        self.backup_m.side_effect = lambda *args, **kwargs: uploaded.append(
+            kwargs.get("filename") or args[0]
+        )
+
+        assert create_backup() == {}
+
+        self.walk_entries_m.assert_called_once_with(
+            [entries[1]], self.walk_stats_m.return_value, overlapping_only=True
+        )
+        assert sorted(uploaded) == sorted(["doc.pdf", root.as_posix(), "/home/c.pdf"])
+        self.log_m.assert_any_call("Resuming the last backup, %d entries left", 3)
+        self.save_queue_m.assert_called_once_with({})
+
+    def test_resume_invalid(self):
+        self.get_autentr_m.return_value = []
+        exc = ValueError("Invalid resume queue")
+        self.load_queue_m.side_effect = exc
+
+        create_backup()
+
+        self.log_m.assert_called_once_with(exc)
+        self.save_queue_m.assert_called_once_with({})
 
     @pytest.mark.parametrize("use_zip", [True, False])
     def test_multiple_no_files_found(self, use_zip):
@@ -120,76 +370,291 @@ class TestCreateBackup:
             filter="<filter>",
         )
         self.get_autentr_m.return_value = [entry]
-        self.list_files_m.return_value = []
+        self.walk_entries_m.return_value = {"<name>": FileList()}
 
         with pytest.raises(
             NoFilesFoundError, match="No files found for entry '<name>'"
         ):
             create_backup()
 
+        self.cache_m.save.assert_called_once_with()
+        self.writer_m.flush.assert_called_with()
+        self.metrics_m.record_run.assert_called_once_with(mock.ANY, False)
+        self.metrics_m.write.assert_called_once_with()
         self.backup_m.assert_not_called()
         self.get_mt_m.assert_not_called()
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.assert_called_once_with("/home/test", "<filter>")
-        self.zipfile_m.assert_not_called()
-        self.bytesio_m.assert_not_called()
+        self.walk_entries_m.assert_called_once_with(
+            [entry], self.walk_stats_m.return_value, overlapping_only=True
+        )
 
+    @pytest.fixture
+    def tree(self, tmp_path):
+        files = {
+            "doc.pdf": b"<doc>",
+            "proyect/doc.pdf": b"<proyect-doc>",
+            "proyect/specs.pdf": b"<specs>" * 1000,
+            "trash/unused/delete.py": b"<delete>",
+        }
+        for name, content in files.items():
+            tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.joinpath(name).write_bytes(content)
+        return tmp_path, files
+
+    @pytest.mark.parametrize("read_ahead", [1024**2, 100])
     @pytest.mark.parametrize("zipname", ["myzip.zip", None])
-    def test_multiple_zip(self, zipname):
+    def test_multiple_zip(self, tree, zipname, read_ahead):
+        root, files = tree
         entry = BackupEntry(
             "<name>",
             "multiple-files",
-            "/home/test",
+            root.as_posix(),
             "<folder-id>",
             zip=True,
             zipname=zipname,
         )
         self.get_autentr_m.return_value = [entry]
-        self.list_files_m.return_value = [
-            "/home/test/doc.pdf",
-            "/home/test/proyect/doc.pdf",
-            "/home/test/proyect/specs.pdf",
-            "/home/test/trash/unused/delete.py",
-        ]
+        self.walk_entries_m.return_value = {}
+        contents = []
 
-        create_backup()
+        def backup(media, *args, **kwargs):
+            contents.append(media.getbytes(0, 1024**2))
 
-        zipfile_m = self.zipfile_m.return_value.__enter__.return_value
-        for file in self.list_files_m.return_value:
-            arcname = file.replace("/home/test/", "")
-            zipfile_m.write.assert_any_call(file, arcname=arcname)
+        self.backup_m.side_effect = backup
+        with mock.patch("backup_to_cloud.main.READ_AHEAD_SIZE", read_ahead):
+            create_backup()
 
         self.backup_m.assert_called_once_with(
-            self.bytesio_m.return_value, ZIP_MIMETYPE, "<folder-id>", filename=zipname
+            mock.ANY, ZIP_MIMETYPE, "<folder-id>", filename=zipname
         )
+        with ZipFile(BytesIO(contents[0])) as zip_file:
+            assert {x: zip_file.read(x) for x in zip_file.namelist()} == files
 
-        self.bytesio_m.assert_called_once_with()
         self.get_mt_m.assert_not_called()
+        self.metrics_m.set.assert_any_call("backup_entry_files", 4)
+        self.metrics_m.inc.assert_any_call(
+            "backup_entry_compressed_bytes", len(contents[0])
+        )
+        self.log_m.assert_called_once_with(
+            "Utilization of the stages of entry %r: %s", "<name>", mock.ANY
+        )
+
+    @pytest.mark.parametrize("read_ahead", [1024**2, 100])
+    def test_multiple_no_zip(self, tree, read_ahead):
+        root, files = tree
+        entry = BackupEntry(
+            "<name>", "multiple-files", root.as_posix(), "<folder-id>", zip=False
+        )
+        self.get_autentr_m.return_value = [entry]
+        self.get_mt_m.return_value = "<mimetype>"
+        filelist = FileList.from_paths(root.joinpath(x) for x in files)
+        self.walk_entries_m.return_value = {"<name>": filelist}
+        uploaded = {}
+
+        def backup(file_data, *args, **kwargs):
+            if isinstance(file_data, BytesIO):
+                uploaded[kwargs["filename"]] = file_data.getvalue()
+            else:
+                uploaded[file_data] = None
+
+        self.backup_m.side_effect = backup
+        with mock.patch("backup_to_cloud.main.READ_AHEAD_SIZE", read_ahead):
+            create_backup()
+
+        assert self.backup_m.call_count == 4
+        assert self.get_mt_m.call_count == 4
+        for name, content in files.items():
+            path = root.joinpath(name).as_posix()
+            self.get_mt_m.assert_any_call(path, stat=None)
+            # Stat data is unknown, so the files are not read ahead.
+            assert uploaded[path] is None
+
         self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.called_once_with()
+        self.walk_entries_m.assert_called_once_with(
+            [entry], self.walk_stats_m.return_value, overlapping_only=True
+        )
 
-    def test_multiple_no_zip(self):
+    @pytest.mark.parametrize("read_ahead", [1024**2, 100])
+    def test_multiple_streaming_walk(self, tree, read_ahead):
+        root, files = tree
         entry = BackupEntry(
-            "<name>", "multiple-files", "/home/test", "<folder-id>", zip=False
+            "<name>", "multiple-files", root.as_posix(), "<folder-id>", filter="pdf$"
         )
         self.get_autentr_m.return_value = [entry]
         self.get_mt_m.return_value = "<mimetype>"
-        self.list_files_m.return_value = [
-            "/home/test/doc.pdf",
-            "/home/test/proyect/doc.pdf",
-            "/home/test/proyect/specs.pdf",
-            "/home/test/trash/unused/delete.py",
-        ]
+        self.walk_entries_m.return_value = {}
+        uploaded = {}
+
+        def backup(file_data, mimetype, folder_id, filename=None, stat=None):
+            if isinstance(file_data, BytesIO):
+                assert stat.size == len(file_data.getvalue())
+                uploaded[filename] = file_data.getvalue()
+            else:
+                assert stat.size == len(files["proyect/specs.pdf"])
+                uploaded[file_data.rsplit("/", 1)[1]] = None
+
+        self.backup_m.side_effect = backup
+        with mock.patch("backup_to_cloud.main.READ_AHEAD_SIZE", read_ahead):
+            create_backup()
 
-        create_backup()
+        assert self.backup_m.call_count == 3
+        if read_ahead > 100:
+            assert uploaded == {"doc.pdf": b"<proyect-doc>", "specs.pdf": mock.ANY}
+            assert uploaded["specs.pdf"] == files["proyect/specs.pdf"]
+        else:
+            assert uploaded["specs.pdf"] is None
+        self.metrics_m.set.assert_any_call("backup_entry_files", 3)
+        self.metrics_m.inc.assert_any_call(
+            "backup_walk_folders", self.walk_stats_m.return_value.dirs
+        )
 
+    @pytest.mark.parametrize("fails", [False, True])
+    def test_multiple_memory_released(self, tree, fails):
+        root, _ = tree
+        entry = BackupEntry("<name>", "multiple-files", root.as_posix(), "<folder-id>")
+        self.get_autentr_m.return_value = [entry]
+        self.walk_entries_m.return_value = {}
+        if fails:
+            self.backup_m.side_effect = ValueError("<error>")
+        budget = MemoryBudget()
+
+        release_m = mock.patch.object(budget, "release", wraps=budget.release)
+
+        with mock.patch("backup_to_cloud.main.memory_budget", budget), release_m:
+            if fails:
+                with pytest.raises(ValueError, match="<error>"):
+                    create_backup()
+            else:
+                create_backup()
+                # Every file was read ahead, and its memory released once.
+                assert budget.release.call_count == 4
+
+            assert budget.release.called
+
+        assert budget.used == 0
+        assert budget.optional == 0
+
+    def test_multiple_no_memory(self, tree):
+        root, _ = tree
+        entry = BackupEntry("<name>", "multiple-files", root.as_posix(), "<folder-id>")
+        self.get_autentr_m.return_value = [entry]
+        self.walk_entries_m.return_value = {}
+
+        with mock.patch("backup_to_cloud.main.memory_budget") as budget_m:
+            budget_m.try_acquire.return_value = False
+            create_backup()
+
+        # Without room in the budget, the files are read by the upload.
         assert self.backup_m.call_count == 4
-        assert self.get_mt_m.call_count == 4
+        for call in self.backup_m.call_args_list:
+            assert isinstance(call[0][0], str)
+        assert budget_m.try_acquire.call_count == 4
+        budget_m.release.assert_not_called()
 
-        for file in self.list_files_m.return_value:
-            self.backup_m.assert_any_call(file, "<mimetype>", "<folder-id>")
-            self.get_mt_m.assert_any_call(file)
+    def test_multiple_zip_memory(self, tree):
+        root, _ = tree
+        entry = BackupEntry(
+            "<name>", "multiple-files", root.as_posix(), "<folder-id>", zip=True
+        )
+        self.get_autentr_m.return_value = [entry]
+        self.walk_entries_m.return_value = {}
 
-        self.bytesio_m.assert_not_called()
-        self.get_autentr_m.assert_called_once_with()
-        self.list_files_m.called_once_with()
+        with mock.patch("backup_to_cloud.main.memory_budget") as budget_m:
+            budget_m.reserve.return_value.__enter__.return_value = 8 * CHUNK_SIZE
+            with mock.patch("backup_to_cloud.main.Pipeline") as pipeline_m:
+                pipeline_m.return_value.run.return_value = {}
+                create_backup()
+
+        budget_m.reserve.assert_called_once_with(
+            (QUEUE_SIZE + ZIP_BUFFERS) * CHUNK_SIZE
+        )
+        # The queues shrink to fit the memory reserved.
+        pipeline_m.assert_called_once_with(mock.ANY, 8 - ZIP_BUFFERS, entry="<name>")
+
+
+@mock.patch("backup_to_cloud.main.metrics")
+def test_compress_chunk_size(metrics_m, tmp_path):
+    sizes = [900_000, 1_500_000, 700_000, 2_000_000]
+    files, items = {}, []
+    for index, size in enumerate(sizes):
+        path = tmp_path.joinpath(f"file-{index}")
+        files[path.name] = os.urandom(size)
+        path.write_bytes(files[path.name])
+        stat = FileStat(size, 0)
+        # Files up to 1 MB are read ahead, the rest are read by _compress.
+        data = files[path.name] if size <= 1_000_000 else None
+        items.append((path.as_posix(), stat, None, data))
+
+    chunks = list(_compress(tmp_path.as_posix(), iter(items)))
+
+    assert all(len(x) == CHUNK_SIZE for x in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= CHUNK_SIZE
+    with ZipFile(BytesIO(b"".join(chunks))) as zip_file:
+        assert {x: zip_file.read(x) for x in zip_file.namelist()} == files
+
+
+@mock.patch("backup_to_cloud.main.metrics")
+def test_compress_missing_file_releases_memory(metrics_m, tmp_path):
+    budget = MemoryBudget()
+    assert budget.try_acquire(10)
+    path = tmp_path.joinpath("deleted").as_posix()
+    items = [(path, FileStat(10, 0), None, b"0123456789")]
+
+    with mock.patch("backup_to_cloud.main.memory_budget", budget):
+        with pytest.raises(FileNotFoundError):
+            list(_compress(tmp_path.as_posix(), iter(items)))
+
+    assert budget.optional == 0
+    assert budget.used == 0
+
+
+@mock.patch("backup_to_cloud.main.get_mimetype")
+@mock.patch("backup_to_cloud.main.backup")
+def test_backup_files(backup_m, get_mt_m, tmp_path):
+    root = tmp_path / "root"
+    root.joinpath("sub").mkdir(parents=True)
+    root.joinpath("a.txt").write_text("a")
+    root.joinpath("sub", "b.txt").write_text("b" * 100)
+    root.joinpath("c.pdf").write_text("c")
+    tmp_path.joinpath("outside.txt").write_text("d")
+    get_mt_m.return_value = "<mimetype>"
+    entry = BackupEntry(
+        "<name>", "multiple-files", str(root), "<folder-id>", filter=r"\.txt$"
+    )
+    paths = [
+        root / "sub" / "b.txt",
+        str(root / "a.txt"),
+        root / "a.txt",
+        root / "c.pdf",
+        root / "missing.txt",
+        root / "sub",
+        tmp_path / "outside.txt",
+    ]
+
+    assert backup_files(entry, paths) == 2
+
+    assert [x[0][0] for x in backup_m.call_args_list] == [
+        (root / "a.txt").as_posix(),
+        (root / "sub" / "b.txt").as_posix(),
+    ]
+    stat = backup_m.call_args[1]["stat"]
+    assert stat.size == 100
+    backup_m.assert_called_with(
+        (root / "sub" / "b.txt").as_posix(), "<mimetype>", "<folder-id>", stat=stat
+    )
+    get_mt_m.assert_called_with((root / "sub" / "b.txt").as_posix(), stat=stat)
+
+    entry.max_size = 10
+    backup_m.reset_mock()
+    assert backup_files(entry, paths) == 1
+
+
+def test_order_entries():
+    entries = [
+        BackupEntry(x, "single-file", f"/home/{x}.pdf", "<folder-id>") for x in "abcdef"
+    ]
+    estimates = {"a": 2, "b": None, "c": 30, "d": 2, "e": None}
+
+    result = order_entries(entries, estimates)
+
+    assert [x.name for x in result] == list("befcad")
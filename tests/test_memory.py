@@ -0,0 +1,99 @@
+from threading import Thread
+from time import sleep
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.memory import MemoryBudget
+
+
+@pytest.fixture(autouse=True)
+def metrics_m():
+    with mock.patch("backup_to_cloud.memory.metrics") as metrics_m:
+        metrics_m.get.return_value = 0
+        yield metrics_m
+
+
+@pytest.fixture
+def limit_m():
+    with mock.patch.object(MemoryBudget, "_get_limit") as limit_m:
+        limit_m.return_value = 100
+        yield limit_m
+
+
+def test_acquire_release(limit_m, metrics_m):
+    budget = MemoryBudget()
+    assert budget.acquire(30) == 30
+    assert budget.acquire(20) == 20
+    assert budget.used == 50
+    metrics_m.set.assert_called_with("backup_memory_peak_bytes", 50)
+
+    budget.release(30)
+    budget.release(20)
+    assert budget.used == 0
+    metrics_m.inc.assert_not_called()
+
+
+def test_acquire_waits(limit_m, metrics_m):
+    budget = MemoryBudget()
+    budget.acquire(40)
+    budget.acquire(40)
+    acquired = []
+    thread = Thread(target=lambda: acquired.append(budget.acquire(30)))
+    thread.start()
+
+    sleep(0.05)
+    assert not acquired
+    budget.release(40)
+    thread.join(1)
+
+    assert acquired == [30]
+    assert budget.used == 70
+    metrics_m.inc.assert_called_once_with("backup_entry_memory_wait_seconds", mock.ANY)
+
+
+def test_acquire_too_big(limit_m):
+    budget = MemoryBudget()
+    # Buffers never take the memory left to the optional ones.
+    assert budget.acquire(500) == 50
+    budget.release(50)
+    assert budget.used == 0
+
+
+def test_try_acquire(limit_m):
+    budget = MemoryBudget()
+    assert budget.try_acquire(30)
+    assert budget.try_acquire(20)
+    assert not budget.try_acquire(1)
+    assert budget.optional == 50
+
+    # Buffers needed to go on can use the rest.
+    assert budget.acquire(60) == 50
+    budget.release(20, optional=True)
+    assert budget.acquire(10) == 10
+    assert budget.try_acquire(10)
+    assert not budget.try_acquire(1)
+    assert budget.used == 100
+    assert budget.optional == 40
+
+
+def test_reserve(limit_m):
+    budget = MemoryBudget()
+    with budget.reserve(500) as reserved:
+        assert reserved == 50
+        assert budget.used == 50
+    assert budget.used == 0
+
+    with pytest.raises(ValueError):
+        with budget.reserve(10):
+            raise ValueError()
+    assert budget.used == 0
+
+
+def test_no_limit(limit_m, metrics_m):
+    limit_m.return_value = None
+    budget = MemoryBudget()
+    assert budget.acquire(10**12) == 10**12
+    assert budget.try_acquire(10**12)
+    assert budget.used == 2 * 10**12
+    metrics_m.set.assert_called_with("backup_memory_peak_bytes", 2 * 10**12)
@@ -0,0 +1,135 @@
+from threading import Thread
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.metrics import METRICS, Metrics
+
+
+class TestMetrics:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.metrics.settings").start()
+        self.settings_m.metrics_path = tmp_path / "metrics.prom"
+        self.metrics = Metrics()
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_metrics_help(self):
+        for name, help_text in METRICS.items():
+            assert name.startswith("backup_")
+            assert help_text.endswith(".")
+
+    def test_inc_set_get(self):
+        self.metrics.inc("backup_walk_files")
+        self.metrics.inc("backup_walk_files", 10)
+        self.metrics.set("backup_walk_folders", 5)
+
+        assert self.metrics.get("backup_walk_files") == 11
+        assert self.metrics.get("backup_walk_folders") == 5
+        assert self.metrics.get("backup_last_run_success") == 0
+
+        self.metrics.reset()
+        assert self.metrics.get("backup_walk_files") == 0
+
+    def test_unknown_metric(self):
+        with pytest.raises(KeyError, match="Unknown metric: 'invalid'"):
+            self.metrics.inc("invalid")
+
+    def test_entry_labels(self):
+        with self.metrics.entry("entry-1"):
+            self.metrics.inc("backup_entry_api_calls", 3)
+            with self.metrics.entry("entry-2"):
+                self.metrics.inc("backup_entry_api_calls")
+            self.metrics.inc("backup_entry_api_calls")
+
+        with self.metrics.entry("entry-1"):
+            assert self.metrics.get("backup_entry_api_calls") == 4
+        with self.metrics.entry("entry-2"):
+            assert self.metrics.get("backup_entry_api_calls") == 1
+        assert self.metrics.get("backup_entry_api_calls") == 0
+
+    def test_entry_labels_threads(self):
+        def worker(name):
+            with self.metrics.entry(name):
+                for _ in range(1000):
+                    self.metrics.inc("backup_entry_uploaded_bytes", 2)
+
+        threads = [Thread(target=worker, args=(f"e{x}",)) for x in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(4):
+            with self.metrics.entry(f"e{i}"):
+                assert self.metrics.get("backup_entry_uploaded_bytes") == 2000
+
+    @mock.patch("backup_to_cloud.metrics.perf_counter")
+    def test_stage(self, pc_m):
+        pc_m.side_effect = [10, 12.5, 20, 21, 30, 30.25]
+
+        with self.metrics.stage("walk"):
+            pass
+        with self.metrics.entry("<entry>"):
+            with self.metrics.stage("upload"):
+                pass
+            with self.metrics.stage("upload"):
+                pass
+
+        assert self.metrics.get("backup_stage_seconds", stage="walk") == 2.5
+        with self.metrics.entry("<entry>"):
+            value = self.metrics.get("backup_entry_stage_seconds", stage="upload")
+            assert value == 1.25
+
+    @mock.patch("backup_to_cloud.metrics.perf_counter")
+    def test_stage_error(self, pc_m):
+        pc_m.side_effect = [10, 11]
+
+        with pytest.raises(ValueError):
+            with self.metrics.stage("walk"):
+                raise ValueError
+
+        assert self.metrics.get("backup_stage_seconds", stage="walk") == 1
+
+    @mock.patch("backup_to_cloud.metrics.time")
+    @mock.patch("backup_to_cloud.metrics.perf_counter")
+    def test_record_run(self, pc_m, time_m):
+        pc_m.return_value = 15.5
+        time_m.return_value = 1600000000.7
+
+        self.metrics.record_run(10, False)
+
+        assert self.metrics.get("backup_last_run_duration_seconds") == 5.5
+        assert self.metrics.get("backup_last_run_success") == 0
+        assert self.metrics.get("backup_last_run_timestamp_seconds") == 1600000000
+
+    def test_render(self):
+        with self.metrics.entry('my "entry"'):
+            self.metrics.inc("backup_entry_uploaded_bytes", 1024)
+            self.metrics.inc("backup_entry_stage_seconds", 0.5, stage="upload")
+        self.metrics.set("backup_walk_files", 20)
+
+        assert self.metrics.render() == (
+            "# HELP backup_entry_stage_seconds "
+            + METRICS["backup_entry_stage_seconds"]
+            + "\n# TYPE backup_entry_stage_seconds gauge\n"
+            'backup_entry_stage_seconds{entry="my \\"entry\\"",stage="upload"} 0.5\n'
+            "# HELP backup_entry_uploaded_bytes "
+            + METRICS["backup_entry_uploaded_bytes"]
+            + "\n# TYPE backup_entry_uploaded_bytes gauge\n"
+            'backup_entry_uploaded_bytes{entry="my \\"entry\\""} 1024\n'
+            "# HELP backup_walk_files " + METRICS["backup_walk_files"] + "\n"
+            "# TYPE backup_walk_files gauge\n"
+            "backup_walk_files 20\n"
+        )
+
+    def test_write(self):
+        self.metrics.set("backup_last_run_success", 1)
+        self.metrics.write()
+
+        content = self.settings_m.metrics_path.read_text()
+        assert content == self.metrics.render()
+        assert content.endswith("backup_last_run_success 1\n")
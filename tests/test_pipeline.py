@@ -0,0 +1,146 @@
+import gc
+from threading import Lock
+from time import sleep
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.pipeline import Pipeline
+
+
+@pytest.fixture(autouse=True)
+def metrics_m():
+    with mock.patch("backup_to_cloud.pipeline.metrics") as metrics_m:
+        yield metrics_m
+
+
+def test_pipeline(metrics_m):
+    results = []
+
+    def source():
+        yield from range(10)
+
+    def double(items):
+        for item in items:
+            yield item * 2
+
+    def sink(items):
+        for item in items:
+            sleep(0.01)
+            results.append(item)
+
+    pipeline = Pipeline(
+        [("source", source), ("double", double), ("sink", sink)], entry="<name>"
+    )
+    # A full collection of the objects left by other tests can take as long
+    # as the whole run, and would count as the sink waiting.
+    gc.collect()
+    utilization = pipeline.run()
+
+    assert results == [x * 2 for x in range(10)]
+    assert list(utilization) == ["source", "double", "sink"]
+    assert utilization["sink"] > 0.5
+    assert utilization["source"] < 0.5
+    assert all(0 <= x <= 1 for x in utilization.values())
+    assert metrics_m.entry.call_count == 3
+    metrics_m.entry.assert_called_with("<name>")
+    metrics_m.set.assert_any_call(
+        "backup_entry_pipeline_utilization", utilization["sink"], stage="sink"
+    )
+    metrics_m.inc.assert_any_call(
+        "backup_entry_pipeline_busy_seconds", mock.ANY, stage="sink"
+    )
+
+
+def test_pipeline_backpressure():
+    produced, consumed = [0], [0]
+    max_pending = [0]
+    lock = Lock()
+
+    def source():
+        for item in range(50):
+            with lock:
+                produced[0] += 1
+                max_pending[0] = max(max_pending[0], produced[0] - consumed[0])
+            yield item
+
+    def sink(items):
+        for _ in items:
+            sleep(0.001)
+            with lock:
+                consumed[0] += 1
+
+    Pipeline([("source", source), ("sink", sink)], queue_size=2).run()
+
+    assert consumed[0] == 50
+    # Queued items, plus the ones held by each stage.
+    assert max_pending[0] <= 4
+
+
+@pytest.mark.parametrize("failing", ["source", "middle", "sink"])
+def test_pipeline_error(failing):
+    def source():
+        for item in range(1000):
+            if failing == "source" and item == 5:
+                raise ValueError("<source>")
+            yield item
+
+    def middle(items):
+        for item in items:
+            if failing == "middle" and item == 5:
+                raise ValueError("<middle>")
+            yield item
+
+    def sink(items):
+        for item in items:
+            if failing == "sink" and item == 5:
+                raise ValueError("<sink>")
+
+    pipeline = Pipeline([("source", source), ("middle", middle), ("sink", sink)], 2)
+    with pytest.raises(ValueError, match=f"<{failing}>"):
+        pipeline.run()
+
+
+@pytest.mark.parametrize("failing", [None, "sink"])
+def test_pipeline_discard(failing):
+    consumed, discarded = [], []
+
+    def source():
+        yield from range(100)
+
+    def sink(items):
+        for item in items:
+            consumed.append(item)
+            if len(consumed) == 5:
+                if failing:
+                    raise ValueError("<sink>")
+                return
+
+    pipeline = Pipeline([("source", source, discarded.append), ("sink", sink)], 2)
+    if failing:
+        with pytest.raises(ValueError, match="<sink>"):
+            pipeline.run()
+    else:
+        pipeline.run()
+
+    assert consumed == list(range(5))
+    # Every item produced is either consumed or discarded, once.
+    assert sorted(consumed + discarded) == list(range(len(consumed + discarded)))
+    if not failing:
+        assert discarded == list(range(5, 100))
+
+
+def test_pipeline_early_end():
+    def source():
+        yield from range(100)
+
+    def sink(items):
+        next(items)
+
+    utilization = Pipeline([("source", source), ("sink", sink)], 2).run()
+    assert list(utilization) == ["source", "sink"]
+
+
+def test_pipeline_no_stages():
+    with pytest.raises(ValueError, match="at least one stage"):
+        Pipeline([])
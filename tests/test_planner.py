@@ -0,0 +1,148 @@
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.automatic import BackupEntry
+from backup_to_cloud.filelist import FileStat
+from backup_to_cloud.planner import EntryPlan, estimate_duration, plan_backup
+from backup_to_cloud.upload import FILE_CHUNK_SIZE
+
+
+class TestPlanBackup:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.get_autentr_m = mock.patch(
+            "backup_to_cloud.main.get_automatic_entries"
+        ).start()
+        mock.patch("backup_to_cloud.main.log").start()
+        self.load_queue_m = mock.patch(
+            "backup_to_cloud.planner.load_resume_queue"
+        ).start()
+        self.load_queue_m.return_value = None
+        self.history_m = mock.patch("backup_to_cloud.planner.run_history").start()
+        self.history_m.estimate.side_effect = lambda name, size: size / 100
+        self.journal_m = mock.patch("backup_to_cloud.planner.upload_journal").start()
+        self.journal_m.get_done.return_value = None
+
+        self.root = tmp_path
+        self.files = {
+            "doc.pdf": b"<doc>",
+            "proyect/doc.pdf": b"<proyect-doc>",
+            "proyect/specs.pdf": b"<specs>" * 1000,
+        }
+        for name, content in self.files.items():
+            tmp_path.joinpath(name).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.joinpath(name).write_bytes(content)
+
+        yield
+
+        mock.patch.stopall()
+
+    def entry(self, name, **kwargs):
+        kwargs.setdefault("type", "multiple-files")
+        kwargs.setdefault("root_path", self.root.as_posix())
+        return BackupEntry(name, cloud_folder_id="<folder-id>", **kwargs)
+
+    def test_files(self):
+        self.get_autentr_m.return_value = [self.entry("a")]
+
+        (plan,) = plan_backup()
+
+        size = sum(len(x) for x in self.files.values())
+        assert plan.name == "a" and not plan.zip and not plan.resumed
+        assert plan.files == 3
+        assert plan.bytes == plan.upload_bytes == size
+        assert plan.api_calls == 6
+        assert plan.seconds == size / 100
+        self.history_m.estimate.assert_called_once_with("a", size)
+
+    def test_zip(self):
+        self.get_autentr_m.return_value = [self.entry("a", zip=True, zipname="a.zip")]
+
+        (plan,) = plan_backup()
+
+        names = sum(len(x) for x in self.files)
+        size = sum(len(x) for x in self.files.values())
+        assert plan.files == 3
+        assert plan.bytes == size
+        assert plan.upload_bytes == 22 + 3 * 92 + 2 * names + size
+        assert plan.api_calls == 3
+
+    def test_single_file(self):
+        path = self.root.joinpath("big.bin")
+        path.write_bytes(b"")
+        self.get_autentr_m.return_value = [
+            self.entry("a", type="single-file", root_path=path.as_posix()),
+            self.entry("b", type="single-file", root_path="/missing/file.pdf"),
+        ]
+
+        with mock.patch("backup_to_cloud.planner.os.stat") as stat_m:
+            stat_m.return_value = mock.Mock(
+                st_size=2 * FILE_CHUNK_SIZE + 1, st_mtime_ns=0
+            )
+            (plan,) = plan_backup(["a"])
+
+        assert plan.files == 1
+        # Search, start of the session and 3 chunks.
+        assert plan.api_calls == 5
+
+        (plan,) = plan_backup(["b"])
+        assert plan.files == 0
+        assert plan.deleted == 1
+
+    def test_skipped(self):
+        self.get_autentr_m.return_value = [self.entry("a")]
+        self.journal_m.get_done.side_effect = lambda key, stat: (
+            {"id": "<id>"} if key == "<folder-id>/specs.pdf" else None
+        )
+
+        (plan,) = plan_backup()
+
+        assert plan.files == 2
+        assert plan.skipped == 1
+        assert plan.skipped_bytes == len(self.files["proyect/specs.pdf"])
+        self.journal_m.get_done.assert_any_call(
+            "<folder-id>/specs.pdf", FileStat(7000, mock.ANY)
+        )
+
+    def test_resumed(self):
+        self.get_autentr_m.return_value = [self.entry("a"), self.entry("b")]
+        paths = [
+            self.root.joinpath("doc.pdf").as_posix(),
+            self.root.joinpath("deleted.pdf").as_posix(),
+        ]
+        self.load_queue_m.return_value = {"a": paths}
+
+        (plan,) = plan_backup()
+
+        assert plan.name == "a" and plan.resumed
+        assert plan.files == 1
+        assert plan.deleted == 1
+
+        # The queue is only used when every entry is planned.
+        assert len(plan_backup(["a", "b"])) == 2
+
+    def test_order(self):
+        self.get_autentr_m.return_value = [
+            self.entry("a", root_path=self.root.joinpath("proyect").as_posix()),
+            self.entry("b"),
+        ]
+
+        assert [x.name for x in plan_backup()] == ["b", "a"]
+
+
+def test_estimate_duration():
+    plans = [EntryPlan(name) for name in "abcd"]
+    for plan, seconds in zip(plans, [10, 6, 5, 4]):
+        plan.seconds = seconds
+
+    assert estimate_duration(plans, 1) == 25
+    assert estimate_duration(plans, 2) == 14
+    assert estimate_duration(plans, 8) == 10
+    assert estimate_duration([], 4) == 0
+
+
+def test_entry_plan():
+    plan = EntryPlan("a", zip=True)
+    assert plan.as_dict()["zip"] is True
+    assert repr(plan) == "EntryPlan('a', files=0, bytes=0)"
@@ -0,0 +1,137 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from unittest import mock
+from zipfile import ZipFile
+
+import pytest
+
+from backup_to_cloud.profiler import STAGES, Profiler, get_stage, is_idle
+
+
+@pytest.mark.parametrize(
+    "filename, function, stage",
+    [
+        ("/usr/lib/python3.7/ssl.py", "read", "api wait"),
+        ("/usr/lib/python3.7/http/client.py", "begin", "api wait"),
+        ("/site-packages/httplib2/__init__.py", "request", "api wait"),
+        ("/usr/lib/python3.7/zipfile.py", "write", "compress"),
+        ("/usr/lib/python3.7/pathlib.py", "read_bytes", "read"),
+        ("/app/backup_to_cloud/main.py", "_read", "read"),
+        ("/site-packages/backup_to_cloud/utils.py", "get_mimetype", "sniff"),
+        ("/site-packages/backup_to_cloud/utils.py", "log", None),
+        ("/site-packages/backup_to_cloud/walker.py", "scan_tree", "walk"),
+        ("C:\\site-packages\\backup_to_cloud\\walker.py", "scan_tree", "walk"),
+        ("/site-packages/backup_to_cloud/upload.py", "backup", "upload"),
+        ("/site-packages/backup_to_cloud/main.py", "create_backup", None),
+    ],
+)
+def test_get_stage(filename, function, stage):
+    assert get_stage(filename, function) == stage
+
+
+def _compress(tmp_path, seconds):
+    tmp_path.joinpath("data").write_bytes(bytes(range(256)) * 4096)
+    end = perf_counter() + seconds
+    while perf_counter() < end:
+        with ZipFile(tmp_path / "data.zip", "w", compression=8) as zip_file:
+            zip_file.write(tmp_path / "data", arcname="data")
+
+
+def test_invalid_profiler(tmp_path):
+    with pytest.raises(ValueError, match="Invalid profiler: 'invalid'"):
+        Profiler("cmd", tmp_path, "invalid")
+
+
+def test_sample(tmp_path):
+    with mock.patch("backup_to_cloud.profiler.SAMPLE_INTERVAL", 0.001):
+        with Profiler("cmd", tmp_path / "out") as prof:
+            _compress(tmp_path, 0.2)
+
+    assert prof.ticks > 0
+    assert [x.suffix for x in prof.paths] == [".folded", ".txt"]
+    for path in prof.paths:
+        assert path.parent == tmp_path / "out"
+        assert path.name.startswith("profile-cmd-")
+
+    lines = prof.paths[0].read_text().splitlines()
+    assert any("_compress (test_profiler.py:" in x for x in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack
+
+    times = prof.stage_times()
+    assert set(times) == set(STAGES)
+    assert times["compress"] > 0
+    assert times["compress"] == max(times.values())
+
+    summary = prof.paths[1].read_text()
+    assert summary.startswith("Profile of cmd (sample)\n")
+    assert "compress" in summary
+
+
+def test_cprofile(tmp_path):
+    with Profiler("cmd", tmp_path, "cprofile") as prof:
+        _compress(tmp_path, 0.05)
+
+    assert [x.suffix for x in prof.paths] == [".pstats", ".txt"]
+    stats = pstats.Stats(prof.paths[0].as_posix())
+    assert any(x[2] == "_compress" for x in stats.stats)
+
+    assert prof.stage_times()["compress"] > 0
+    assert prof.paths[1].read_text().startswith("Profile of cmd (cprofile)\n")
+
+
+def test_exception(tmp_path):
+    with pytest.raises(ValueError):
+        with Profiler("cmd", tmp_path):
+            raise ValueError
+
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.parametrize(
+    "filename, function, idle",
+    [
+        ("/usr/lib/python3.7/threading.py", "wait", True),
+        ("/usr/lib/python3.7/threading.py", "_wait_for_tstate_lock", True),
+        ("/usr/lib/python3.7/concurrent/futures/thread.py", "_worker", True),
+        ("/usr/lib/python3.7/selectors.py", "select", True),
+        ("~", "<method 'acquire' of '_thread.lock' objects>", True),
+        ("/usr/lib/python3.7/threading.py", "run", False),
+        ("/usr/lib/python3.7/zipfile.py", "write", False),
+        ("~", "<built-in method zlib.compress>", False),
+    ],
+)
+def test_is_idle(filename, function, idle):
+    assert is_idle(filename, function) == idle
+
+
+def _compress_threads(tmp_path, seconds):
+    # Threads waiting in queues and locks are idle, they must not count.
+    with ThreadPoolExecutor(4) as executor:
+        executor.submit(_compress, tmp_path, seconds).result()
+
+
+def test_sample_threads(tmp_path):
+    with mock.patch("backup_to_cloud.profiler.SAMPLE_INTERVAL", 0.001):
+        with Profiler("cmd", tmp_path / "out") as prof:
+            _compress_threads(tmp_path, 0.2)
+
+    times = prof.stage_times()
+    assert times["compress"] == max(times.values())
+    assert sum(times.values()) < 1.5 * prof.wall_time
+    assert "idle)" in prof.paths[1].read_text()
+
+
+def test_cprofile_threads(tmp_path):
+    with Profiler("cmd", tmp_path, "cprofile") as prof:
+        _compress_threads(tmp_path, 0.1)
+
+    stats = pstats.Stats(prof.paths[0].as_posix())
+    assert any(x[2] == "_compress" for x in stats.stats)
+
+    times = prof.stage_times()
+    assert times["compress"] > 0.5 * sum(times.values())
+    assert sum(times.values()) < 1.5 * prof.wall_time
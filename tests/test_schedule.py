@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+from backup_to_cloud.schedule import CronSchedule, parse_schedule
+
+
+@pytest.mark.parametrize(
+    "expression, field, expected",
+    [
+        ("* * * * *", "minutes", set(range(60))),
+        ("*/15 * * * *", "minutes", {0, 15, 30, 45}),
+        ("5,10-12 * * * *", "minutes", {5, 10, 11, 12}),
+        ("0-30/10 * * * *", "minutes", {0, 10, 20, 30}),
+        ("50/5 * * * *", "minutes", {50, 55}),
+        ("0 9-17 * * *", "hours", set(range(9, 18))),
+        ("0 0 1,15 * *", "days", {1, 15}),
+        ("0 0 1 jan,JUL *", "months", {1, 7}),
+        ("0 0 * * mon-fri", "weekdays", {1, 2, 3, 4, 5}),
+        ("0 0 * * 7", "weekdays", {0}),
+        ("0 0 * * 5-7", "weekdays", {5, 6, 0}),
+        ("@hourly", "minutes", {0}),
+        ("@weekly", "weekdays", {0}),
+    ],
+)
+def test_parse(expression, field, expected):
+    assert getattr(CronSchedule(expression), field) == expected
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "",
+        "* * * *",
+        "* * * * * *",
+        "60 * * * *",
+        "* 24 * * *",
+        "* * 0 * *",
+        "* * * 13 *",
+        "* * * * 8",
+        "*/0 * * * *",
+        "5-1 * * * *",
+        "a * * * *",
+        "* * * foo *",
+        "@never",
+    ],
+)
+def test_parse_error(expression):
+    with pytest.raises(ValueError, match="Invalid"):
+        CronSchedule(expression)
+
+
+@pytest.mark.parametrize(
+    "expression, date, expected",
+    [
+        ("* * * * *", "2021-03-04 10:20:30", "2021-03-04 10:21"),
+        ("*/15 * * * *", "2021-03-04 10:20:00", "2021-03-04 10:30"),
+        ("30 2 * * *", "2021-03-04 10:20:00", "2021-03-05 02:30"),
+        ("30 2 * * *", "2021-03-04 02:30:00", "2021-03-05 02:30"),
+        ("30 2 * * *", "2021-03-04 02:29:59", "2021-03-04 02:30"),
+        ("0 0 1 * *", "2021-12-15 00:00:00", "2022-01-01 00:00"),
+        ("0 0 29 2 *", "2021-03-01 00:00:00", "2024-02-29 00:00"),
+        ("0 12 * * sat", "2021-03-04 10:20:00", "2021-03-06 12:00"),
+        ("0 12 * * 0", "2021-03-04 10:20:00", "2021-03-07 12:00"),
+        # Both days restricted: any of them matches
+        ("0 0 10 * mon", "2021-03-04 10:20:00", "2021-03-08 00:00"),
+        ("0 0 5 * mon", "2021-03-04 10:20:00", "2021-03-05 00:00"),
+        # Like cron, a step of "*" is not a restriction
+        ("0 0 */2 * mon", "2021-03-04 10:20:00", "2021-03-15 00:00"),
+        ("@yearly", "2021-03-04 10:20:00", "2022-01-01 00:00"),
+    ],
+)
+def test_next_after(expression, date, expected):
+    schedule = CronSchedule(expression)
+    result = schedule.next_after(datetime.fromisoformat(date))
+
+    assert result == datetime.fromisoformat(expected)
+    assert schedule.matches(result)
+
+
+def test_next_after_never():
+    schedule = CronSchedule("0 0 30 2 *")
+    with pytest.raises(ValueError, match="never matches"):
+        schedule.next_after(datetime(2021, 1, 1))
+
+
+def test_eq():
+    assert CronSchedule("0 * * * *") == CronSchedule("0 * * * *")
+    assert CronSchedule("0 * * * *") != CronSchedule("1 * * * *")
+    assert CronSchedule("0 * * * *") != "0 * * * *"
+    assert len({CronSchedule("@daily"), CronSchedule("@daily")}) == 1
+    assert repr(CronSchedule("@daily")) == "CronSchedule('@daily')"
+
+
+def test_parse_schedule():
+    assert parse_schedule(None) is None
+    assert parse_schedule("@daily") == CronSchedule("@daily")
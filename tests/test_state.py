@@ -0,0 +1,306 @@
+import json
+from threading import Thread
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.filelist import FileStat
+from backup_to_cloud.state import (
+    DEFAULT_THROUGHPUT,
+    MimeTypeCache,
+    RunHistory,
+    UploadJournal,
+    atomic_write,
+    load_resume_queue,
+    save_resume_queue,
+)
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "folder" / "file.json"
+
+    atomic_write(path, b"<data>")
+    assert path.read_bytes() == b"<data>"
+
+    atomic_write(path, b"<new-data>")
+    assert path.read_bytes() == b"<new-data>"
+    assert [x.name for x in path.parent.iterdir()] == ["file.json"]
+
+
+def test_atomic_write_threads(tmp_path):
+    path = tmp_path / "file.json"
+    threads = [
+        Thread(target=lambda: [atomic_write(path, b"<data>") for _ in range(50)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert path.read_bytes() == b"<data>"
+    assert [x.name for x in tmp_path.iterdir()] == ["file.json"]
+
+
+class TestResumeQueue:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.state.settings").start()
+        self.settings_m.resume_queue_path = tmp_path / "state" / "resume.json"
+        self.path = self.settings_m.resume_queue_path
+        yield
+        mock.patch.stopall()
+
+    def test_round_trip(self):
+        assert load_resume_queue() is None
+
+        queue = {"a": None, "b": ["/home/b/1.txt"]}
+        save_resume_queue(queue)
+        assert load_resume_queue() == queue
+
+        save_resume_queue({})
+        assert not self.path.exists()
+        assert load_resume_queue() is None
+        save_resume_queue(None)
+
+    @pytest.mark.parametrize("content", ["{", "[]"])
+    def test_invalid(self, content):
+        self.path.parent.mkdir()
+        self.path.write_text(content)
+
+        with pytest.raises(ValueError, match="Invalid resume queue"):
+            load_resume_queue()
+
+
+class TestMimeTypeCache:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.state.settings").start()
+        self.settings_m.mimetype_cache_path = tmp_path / "state" / "mimetypes.json"
+        self.path = self.settings_m.mimetype_cache_path
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_get_missing_file(self):
+        cache = MimeTypeCache()
+        assert cache.get("/a/file", FileStat(10, 20)) is None
+
+    def test_get_invalid_file(self):
+        self.path.parent.mkdir()
+        self.path.write_text("<invalid-json>")
+
+        cache = MimeTypeCache()
+        assert cache.get("/a/file", FileStat(10, 20)) is None
+
+    def test_get(self):
+        self.path.parent.mkdir()
+        self.path.write_text(json.dumps({"/a/file": [10, 20, "text/plain"]}))
+
+        cache = MimeTypeCache()
+        assert cache.get("/a/file", FileStat(10, 20)) == "text/plain"
+        assert cache.get("/a/file", FileStat(11, 20)) is None
+        assert cache.get("/a/file", FileStat(10, 21)) is None
+        assert cache.get("/a/other", FileStat(10, 20)) is None
+
+    def test_set_save(self, tmp_path):
+        filepath = tmp_path.joinpath("file").as_posix()
+        tmp_path.joinpath("file").touch()
+        cache = MimeTypeCache()
+        cache.save()
+        assert not self.path.exists()
+
+        cache.set(filepath, FileStat(10, 20), "text/plain")
+        assert cache.get(filepath, FileStat(10, 20)) == "text/plain"
+
+        with mock.patch("backup_to_cloud.state.atomic_write") as atomic_write_m:
+            cache.save()
+            cache.save()
+
+        atomic_write_m.assert_called_once_with(self.path, mock.ANY)
+        data = atomic_write_m.call_args[0][1]
+        assert json.loads(data) == {filepath: [10, 20, "text/plain"]}
+
+        cache.set(filepath, FileStat(10, 20), "text/plain")
+        cache.save()
+        assert MimeTypeCache().get(filepath, FileStat(10, 20)) == "text/plain"
+
+    def test_save_prunes(self, tmp_path):
+        tmp_path.joinpath("kept").touch()
+        kept = tmp_path.joinpath("kept").as_posix()
+        deleted = tmp_path.joinpath("deleted").as_posix()
+        self.path.parent.mkdir()
+        self.path.write_text(
+            json.dumps(
+                {
+                    kept: [10, 20, "text/plain"],
+                    deleted: [10, 20, "text/plain"],
+                    "/a/used": [10, 20, "text/plain"],
+                    "/a/set": [10, 20, "text/plain"],
+                }
+            )
+        )
+
+        cache = MimeTypeCache()
+        cache.get("/a/used", FileStat(10, 20))
+        cache.set("/a/set", FileStat(11, 20), "text/html")
+        cache.save()
+
+        # Files looked up in the run are kept, even if they are gone now.
+        assert json.loads(self.path.read_text()) == {
+            kept: [10, 20, "text/plain"],
+            "/a/used": [10, 20, "text/plain"],
+            "/a/set": [11, 20, "text/html"],
+        }
+
+        with mock.patch("backup_to_cloud.state.atomic_write") as atomic_write_m:
+            cache.save()
+        atomic_write_m.assert_called_once_with(self.path, mock.ANY)
+        assert json.loads(atomic_write_m.call_args[0][1]) == {
+            kept: [10, 20, "text/plain"]
+        }
+
+    def test_unload(self):
+        cache = MimeTypeCache()
+        cache.set("/a/file", FileStat(10, 20), "text/plain")
+        cache.unload()
+        cache.save()
+
+        assert not self.path.exists()
+        assert cache.get("/a/file", FileStat(10, 20)) is None
+
+
+class TestRunHistory:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.state.settings").start()
+        self.settings_m.history_path = tmp_path / "state" / "history.json"
+        self.path = self.settings_m.history_path
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_estimate_unknown(self):
+        history = RunHistory()
+        assert history.estimate("<name>") is None
+        assert history.estimate("<name>", DEFAULT_THROUGHPUT * 2) == 2
+
+    def test_estimate_invalid_file(self):
+        self.path.parent.mkdir()
+        self.path.write_text("<invalid-json>")
+
+        assert RunHistory().estimate("<name>") is None
+
+    def test_record_estimate(self):
+        history = RunHistory()
+        history.record("a", 10, 1000, 5)
+
+        assert history.estimate("a") == 10
+        assert history.estimate("a", 2000) == 20
+        # Other entries are estimated with the throughput of the known ones.
+        assert history.estimate("b", 500) == 5
+        assert history.estimate("b") is None
+
+        history.record("a", 20, 1000, 7)
+        assert history.estimate("a") == 15
+
+    def test_estimate_no_bytes(self):
+        history = RunHistory()
+        history.record("a", 10, 0, 0)
+
+        assert history.estimate("a", 100) == 10
+        assert history.estimate("b", DEFAULT_THROUGHPUT) == 1
+
+    def test_save(self):
+        history = RunHistory()
+        history.save()
+        assert not self.path.exists()
+
+        history.record("a", 10, 1000, 5)
+        history.record("a", 20, 3000, 5)
+        history.save()
+
+        assert json.loads(self.path.read_text()) == {
+            "a": {"seconds": 15, "bytes": 2000, "files": 5, "runs": 2}
+        }
+        assert RunHistory().estimate("a") == 15
+
+    def test_unload(self):
+        history = RunHistory()
+        history.record("a", 10, 1000, 5)
+        history.unload()
+        history.save()
+
+        assert not self.path.exists()
+        assert history.estimate("a") is None
+
+
+class TestUploadJournal:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.settings_m = mock.patch("backup_to_cloud.state.settings").start()
+        self.settings_m.upload_journal_path = tmp_path / "state" / "uploads.jsonl"
+        self.path = self.settings_m.upload_journal_path
+        self.stat = FileStat(10, 20)
+
+        yield
+
+        mock.patch.stopall()
+
+    def test_records(self):
+        journal = UploadJournal()
+        journal.plan("a", self.stat)
+        journal.progress("b", self.stat, "<uri>", 256)
+        journal.done("c", self.stat, "<id>")
+
+        assert journal.get_done("a", self.stat) is None
+        assert journal.get_session("a", self.stat) is None
+        assert journal.get_session("b", self.stat) == "<uri>"
+        assert journal.get_done("c", self.stat)["id"] == "<id>"
+        # Changed files are uploaded again.
+        assert journal.get_session("b", FileStat(10, 21)) is None
+        assert journal.get_done("c", FileStat(11, 20)) is None
+
+        # Planning an upload keeps its interrupted session.
+        journal.plan("b", self.stat)
+        assert journal.get_session("b", self.stat) == "<uri>"
+        journal.unload()
+
+        lines = self.path.read_text().splitlines()
+        assert [json.loads(x)["status"] for x in lines] == [
+            "planned",
+            "uploading",
+            "done",
+        ]
+
+    def test_load(self):
+        journal = UploadJournal()
+        journal.progress("a", self.stat, "<uri-1>", 256)
+        journal.progress("a", self.stat, "<uri-1>", 512)
+        journal.done("b", self.stat, "<id>")
+        journal.unload()
+        with self.path.open("ab") as file_handler:
+            file_handler.write(b'{"key": "c", "sta')
+
+        journal = UploadJournal()
+        assert journal.get_session("a", self.stat) == "<uri-1>"
+        assert journal.get_done("b", self.stat)["id"] == "<id>"
+        assert journal.get_done("c", self.stat) is None
+
+    def test_compact(self):
+        journal = UploadJournal()
+        journal.progress("a", self.stat, "<uri>", 256)
+        journal.done("b", self.stat, "<id>")
+        journal.compact()
+
+        assert len(self.path.read_text().splitlines()) == 1
+        journal = UploadJournal()
+        assert journal.get_session("a", self.stat) == "<uri>"
+        assert journal.get_done("b", self.stat) is None
+
+        journal.done("a", self.stat, "<id>")
+        journal.compact()
+        assert not self.path.exists()
+        journal.compact()
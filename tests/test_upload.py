@@ -3,15 +3,26 @@ from pathlib import Path
 from unittest import mock
 
 import pytest
+from googleapiclient.errors import HttpError
 
 from backup_to_cloud.exceptions import MultipleFilesError
-from backup_to_cloud.upload import backup, save_new_file, save_version
+from backup_to_cloud.filelist import FileStat
+from backup_to_cloud.upload import (
+    FILE_CHUNK_SIZE,
+    MAX_RETRIES,
+    ChunkedUpload,
+    backup,
+    execute,
+    execute_upload,
+    save_new_file,
+    save_version,
+)
 
 
 class TestBackup:
     @pytest.fixture(autouse=True)
     def mocks(self):
-        self.p_exists_m = mock.patch("pathlib.Path.exists").start()
+        self.p_stat_m = mock.patch("pathlib.Path.stat").start()
         self.p_read_bytes_m = mock.patch("pathlib.Path.read_bytes").start()
         self.sgds_m = mock.patch(
             "backup_to_cloud.upload.get_google_drive_services"
@@ -20,6 +31,9 @@ class TestBackup:
         self.new_ver_m = mock.patch("backup_to_cloud.upload.save_version").start()
         self.new_file_m = mock.patch("backup_to_cloud.upload.save_new_file").start()
         self.log_m = mock.patch("backup_to_cloud.upload.log").start()
+        self.journal_m = mock.patch("backup_to_cloud.upload.upload_journal").start()
+        self.journal_m.get_done.return_value = None
+        self.memory_m = mock.patch("backup_to_cloud.upload.memory_budget").start()
 
         yield
 
@@ -48,7 +62,10 @@ class TestBackup:
         yield self._file_data[request.param]
 
     def test_backup(self, exists, file_data, filename, nids):
-        self.p_exists_m.return_value = exists
+        if exists:
+            self.p_stat_m.return_value = mock.Mock(st_size=11, st_mtime_ns=0)
+        else:
+            self.p_stat_m.side_effect = FileNotFoundError
         useful_filename = filename or "<filepath>"
 
         files = self.sgds_m.return_value.files.return_value
@@ -70,7 +87,7 @@ class TestBackup:
             with pytest.raises(FileNotFoundError, match="<filepath>") as exc:
                 backup(file_data, mimetype, folder_id, filename)
 
-            self.p_exists_m.assert_called_once_with()
+            self.p_stat_m.assert_called_once_with()
             self.p_read_bytes_m.assert_not_called()
             self.bytesio_m.assert_not_called()
 
@@ -83,7 +100,7 @@ class TestBackup:
             with pytest.raises(ValueError, match=msg) as exc:
                 backup(file_data, mimetype, folder_id, filename)
 
-            self.p_exists_m.assert_not_called()
+            self.p_stat_m.assert_not_called()
             self.p_read_bytes_m.assert_not_called()
             self.bytesio_m.assert_not_called()
 
@@ -99,19 +116,21 @@ class TestBackup:
             self.log_m.assert_called_once_with(exc.value)
 
             if isinstance(file_data, BytesIO):
-                self.p_exists_m.assert_not_called()
+                self.p_stat_m.assert_not_called()
             else:
-                self.p_exists_m.assert_called_once_with()
+                self.p_stat_m.assert_called_once_with()
                 self.bytesio_m.assert_called_once_with(self.p_read_bytes_m.return_value)
 
         if nids <= 1:
             result = backup(file_data, mimetype, folder_id, filename)
 
         if isinstance(file_data, BytesIO):
-            self.p_exists_m.assert_not_called()
+            self.p_stat_m.assert_not_called()
+            self.memory_m.reserve.assert_not_called()
         else:
-            self.p_exists_m.assert_called_once_with()
+            self.p_stat_m.assert_called_once_with()
             self.bytesio_m.assert_called_once_with(self.p_read_bytes_m.return_value)
+            self.memory_m.reserve.assert_called_once_with(11)
 
         # Google Drive API
         self.sgds_m.assert_called_once_with()
@@ -128,10 +147,17 @@ class TestBackup:
 
         self.log_m.assert_not_called()
 
+        key = "<folder-id>/" + useful_filename
         if isinstance(file_data, BytesIO):
             shipped_data = file_data
+            stat = None
+            self.journal_m.plan.assert_not_called()
+            self.journal_m.done.assert_not_called()
         else:
             shipped_data = self.bytesio_m.return_value
+            stat = FileStat(11, 0)
+            self.journal_m.get_done.assert_called_once_with(key, stat)
+            self.journal_m.plan.assert_called_once_with(key, stat)
 
         if nids == 0:
             self.new_file_m.assert_called_once_with(
@@ -140,13 +166,21 @@ class TestBackup:
                 mimetype,
                 folder_id,
                 useful_filename,
+                key=key,
+                stat=stat,
             )
             self.new_ver_m.assert_not_called()
             assert result == self.new_file_m.return_value
         if nids == 1:
             self.new_file_m.assert_not_called()
             self.new_ver_m.assert_called_once_with(
-                self.sgds_m.return_value, shipped_data, mimetype, 0, useful_filename
+                self.sgds_m.return_value,
+                shipped_data,
+                mimetype,
+                0,
+                useful_filename,
+                key=key,
+                stat=stat,
             )
             assert result == self.new_ver_m.return_value
 
@@ -200,3 +234,317 @@ def test_save_version(mibu_m, log_m):
     command.execute.assert_called_once_with()
 
     assert result == command.execute.return_value
+
+
+@mock.patch("backup_to_cloud.upload.memory_budget", mock.MagicMock())
+@mock.patch("backup_to_cloud.upload.upload_journal")
+@mock.patch("backup_to_cloud.upload.save_new_file")
+@mock.patch("backup_to_cloud.upload.get_google_drive_services")
+@mock.patch("pathlib.Path.read_bytes")
+@mock.patch("pathlib.Path.stat")
+def test_backup_known_stat(stat_m, read_bytes_m, gds_m, new_file_m, journal_m):
+    read_bytes_m.return_value = b"<file-data>"
+    gds_m.return_value.files.return_value.list.return_value.execute.return_value = {}
+    journal_m.get_done.return_value = None
+
+    result = backup(
+        Path("<filepath>"), "<mimetype>", "<folder-id>", stat=FileStat(11, 0)
+    )
+
+    stat_m.assert_not_called()
+    read_bytes_m.assert_called_once_with()
+    assert result == new_file_m.return_value
+
+
+@mock.patch("backup_to_cloud.upload.upload_journal")
+@mock.patch("backup_to_cloud.upload.metrics")
+@mock.patch("backup_to_cloud.upload.save_new_file")
+@mock.patch("backup_to_cloud.upload.get_google_drive_services")
+@mock.patch("pathlib.Path.read_bytes")
+def test_backup_metrics(read_bytes_m, gds_m, new_file_m, metrics_m, journal_m):
+    read_bytes_m.return_value = b"<file-data>"
+    journal_m.get_done.return_value = None
+    gds_m.return_value.files.return_value.list.return_value.execute.return_value = {}
+
+    backup(Path("<filepath>"), "<mimetype>", "<folder-id>", stat=FileStat(11, 0))
+
+    metrics_m.inc.assert_any_call("backup_entry_read_bytes", 11)
+    metrics_m.inc.assert_any_call("backup_entry_uploaded_bytes", 11)
+    metrics_m.inc.assert_any_call("backup_entry_api_calls")
+    metrics_m.stage.assert_called_once_with("upload")
+
+
+def test_chunked_upload():
+    media = ChunkedUpload(iter([b"abc", b"", b"defgh", b"ij"]), "<mimetype>", 4)
+
+    assert media.mimetype() == "<mimetype>"
+    assert media.chunksize() == 4
+    assert media.size() is None
+    assert media.resumable()
+
+    assert media.getbytes(0, 4) == b"abcd"
+    assert media.bytes_read == 8
+    # Failed requests send the same chunk again.
+    assert media.getbytes(0, 4) == b"abcd"
+    assert media.getbytes(4, 4) == b"efgh"
+    assert media.getbytes(8, 4) == b"ij"
+    assert media.getbytes(10, 4) == b""
+    assert media.bytes_read == 10
+
+
+@mock.patch("backup_to_cloud.upload.log")
+@mock.patch("backup_to_cloud.upload.MediaIoBaseUpload")
+def test_save_new_file_chunked(mibu_m, log_m):
+    gds = mock.MagicMock()
+    media = ChunkedUpload([b"<file-data>"], "<mimetype>")
+
+    save_new_file(gds, media, "<mimetype>", "<folder-id>", "<filename>")
+
+    mibu_m.assert_not_called()
+    gds.files.return_value.create.assert_called_once_with(
+        body=mock.ANY, media_body=media, fields="id"
+    )
+
+
+@mock.patch("backup_to_cloud.upload.metrics")
+@mock.patch("backup_to_cloud.upload.save_version")
+@mock.patch("backup_to_cloud.upload.get_google_drive_services")
+def test_backup_chunked_metrics(gds_m, new_ver_m, metrics_m):
+    list_m = gds_m.return_value.files.return_value.list.return_value
+    list_m.execute.return_value = {"files": [{"id": "<file-id>"}]}
+    media = ChunkedUpload([b"<file-data>"], "<mimetype>")
+    new_ver_m.side_effect = lambda *args, **kwargs: media.getbytes(0, 100)
+
+    backup(media, "<mimetype>", "<folder-id>", filename="<filename>")
+
+    new_ver_m.assert_called_once_with(
+        gds_m.return_value,
+        media,
+        "<mimetype>",
+        "<file-id>",
+        "<filename>",
+        key="<folder-id>/<filename>",
+        stat=None,
+    )
+    metrics_m.inc.assert_any_call("backup_entry_uploaded_bytes", 11)
+
+
+@mock.patch("backup_to_cloud.upload.log")
+@mock.patch("backup_to_cloud.upload.get_google_drive_services")
+@mock.patch("backup_to_cloud.upload.upload_journal")
+def test_backup_done(journal_m, gds_m, log_m):
+    journal_m.get_done.return_value = {"id": "<file-id>"}
+    stat = FileStat(11, 0)
+
+    result = backup(BytesIO(b"<file-data>"), "<mimetype>", "<id>", "<name>", stat)
+
+    assert result == {"id": "<file-id>"}
+    journal_m.get_done.assert_called_once_with("<id>/<name>", stat)
+    gds_m.assert_not_called()
+    log_m.assert_called_once_with(
+        "Skipping %s, uploaded before the last backup was interrupted", "<id>/<name>"
+    )
+
+
+@mock.patch("backup_to_cloud.upload.memory_budget")
+@mock.patch("backup_to_cloud.upload.upload_journal")
+@mock.patch("backup_to_cloud.upload.metrics")
+@mock.patch("backup_to_cloud.upload.save_new_file")
+@mock.patch("backup_to_cloud.upload.get_google_drive_services")
+@mock.patch("backup_to_cloud.upload.FILE_CHUNK_SIZE", 4)
+def test_backup_streamed(gds_m, new_file_m, metrics_m, journal_m, memory_m, tmp_path):
+    gds_m.return_value.files.return_value.list.return_value.execute.return_value = {}
+    journal_m.get_done.return_value = None
+    new_file_m.return_value = {"id": "<file-id>"}
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"<file-data>")
+
+    def save_new_file(gds, file_data, *args, **kwargs):
+        assert not isinstance(file_data, BytesIO)
+        assert file_data.read() == b"<file-data>"
+        return {"id": "<file-id>"}
+
+    new_file_m.side_effect = save_new_file
+    backup(path, "<mimetype>", "<folder-id>")
+
+    stat = FileStat.from_stat(path.stat())
+    key = "<folder-id>/file.bin"
+    journal_m.plan.assert_called_once_with(key, stat)
+    journal_m.done.assert_called_once_with(key, stat, "<file-id>")
+    metrics_m.inc.assert_any_call("backup_entry_read_bytes", 11)
+    metrics_m.inc.assert_any_call("backup_entry_uploaded_bytes", 11)
+    # Only a chunk of the file is in memory at a time.
+    memory_m.reserve.assert_called_once_with(4)
+
+
+@mock.patch("backup_to_cloud.upload.log")
+@mock.patch("backup_to_cloud.upload.MediaIoBaseUpload")
+def test_save_new_file_resumable(mibu_m, log_m, tmp_path):
+    gds = mock.MagicMock()
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"<file-data>")
+
+    with path.open("rb") as file_handler:
+        save_new_file(gds, file_handler, "<mimetype>", "<folder-id>", "<filename>")
+
+    mibu_m.assert_called_once_with(
+        file_handler,
+        mimetype="<mimetype>",
+        chunksize=FILE_CHUNK_SIZE,
+        resumable=True,
+    )
+
+
+class TestExecuteUpload:
+    @pytest.fixture(autouse=True)
+    def mocks(self):
+        self.execute_m = mock.patch("backup_to_cloud.upload.execute").start()
+        self.execute_m.side_effect = lambda request: request.execute()
+        self.journal_m = mock.patch("backup_to_cloud.upload.upload_journal").start()
+        self.journal_m.get_session.return_value = None
+        self.log_m = mock.patch("backup_to_cloud.upload.log").start()
+        self.request = mock.Mock(resumable_uri=None, _in_error_state=False)
+        self.stat = FileStat(11, 0)
+
+        yield
+
+        mock.patch.stopall()
+
+    def chunks(self, *offsets):
+        """Makes the request confirm `offsets` (or raise them), then end."""
+
+        self.uris = []
+        results = iter(offsets)
+
+        def next_chunk():
+            self.uris.append(self.request.resumable_uri)
+            offset = next(results, None)
+            if isinstance(offset, Exception):
+                raise offset
+            self.request.resumable_uri = "<uri>"
+            if offset is None:
+                return None, {"id": "<file-id>"}
+            return mock.Mock(resumable_progress=offset), None
+
+        self.request.next_chunk.side_effect = next_chunk
+
+    @pytest.mark.parametrize("key, resumable", [("<key>", False), (None, True)])
+    def test_not_journaled(self, key, resumable):
+        self.request.resumable = resumable
+
+        result = execute_upload(self.request, key, self.stat)
+
+        assert result == self.request.execute.return_value
+        self.request.next_chunk.assert_not_called()
+        self.journal_m.get_session.assert_not_called()
+
+    def test_new(self):
+        self.chunks(256, 512)
+
+        assert execute_upload(self.request, "<key>", self.stat) == {"id": "<file-id>"}
+
+        self.journal_m.get_session.assert_called_once_with("<key>", self.stat)
+        self.journal_m.progress.assert_has_calls(
+            [
+                mock.call("<key>", self.stat, "<uri>", 256),
+                mock.call("<key>", self.stat, "<uri>", 512),
+            ]
+        )
+        assert not self.request._in_error_state
+        self.log_m.assert_not_called()
+
+    def test_resume(self):
+        self.journal_m.get_session.return_value = "<uri>"
+        self.chunks(512)
+
+        assert execute_upload(self.request, "<key>", self.stat) == {"id": "<file-id>"}
+
+        assert self.uris == ["<uri>", "<uri>"]
+        assert self.request._in_error_state
+        self.log_m.assert_called_once_with("Resuming the upload of %s", "<key>")
+
+    @pytest.mark.parametrize("status", [404, 410])
+    def test_resume_expired(self, status):
+        self.journal_m.get_session.return_value = "<old-uri>"
+        error = HttpError(mock.Mock(status=status, reason="<reason>"), b"")
+        self.chunks(error, 256)
+
+        assert execute_upload(self.request, "<key>", self.stat) == {"id": "<file-id>"}
+
+        # The upload starts again, in a new session.
+        assert self.uris == ["<old-uri>", None, "<uri>"]
+        assert self.request.resumable_progress == 0
+        assert not self.request._in_error_state
+        self.log_m.assert_called_with(
+            "Upload session of %s expired, starting again", "<key>"
+        )
+
+    def test_error(self):
+        error = HttpError(mock.Mock(status=404, reason="<reason>"), b"")
+        self.chunks(error)
+
+        with pytest.raises(HttpError):
+            execute_upload(self.request, "<key>", self.stat)
+
+
+class TestExecute:
+    @pytest.fixture(autouse=True)
+    def mocks(self):
+        self.metrics_m = mock.patch("backup_to_cloud.upload.metrics").start()
+        self.sleep_m = mock.patch("backup_to_cloud.upload.sleep").start()
+        self.log_m = mock.patch("backup_to_cloud.upload.log").start()
+        mock.patch("backup_to_cloud.upload.random", return_value=0.5).start()
+        self.request = mock.Mock()
+
+        yield
+
+        mock.patch.stopall()
+
+    @staticmethod
+    def http_error(status):
+        return HttpError(mock.Mock(status=status, reason="<reason>"), b"")
+
+    def test_success(self):
+        assert execute(self.request) == self.request.execute.return_value
+
+        self.metrics_m.inc.assert_called_once_with("backup_entry_api_calls")
+        self.sleep_m.assert_not_called()
+
+    @pytest.mark.parametrize("status", [429, 500, 503])
+    def test_retry(self, status):
+        errors = [self.http_error(status), self.http_error(status)]
+        self.request.execute.side_effect = errors + ["<response>"]
+
+        assert execute(self.request) == "<response>"
+
+        assert self.request.execute.call_count == 3
+        self.sleep_m.assert_has_calls([mock.call(1.5), mock.call(2.5)])
+        self.metrics_m.inc.assert_has_calls(
+            [
+                mock.call("backup_entry_api_calls"),
+                mock.call("backup_entry_api_retries"),
+                mock.call("backup_entry_api_calls"),
+                mock.call("backup_entry_api_retries"),
+                mock.call("backup_entry_api_calls"),
+            ]
+        )
+        assert self.log_m.call_count == 2
+
+    def test_retry_exhausted(self):
+        self.request.execute.side_effect = self.http_error(500)
+
+        with pytest.raises(HttpError):
+            execute(self.request)
+
+        assert self.request.execute.call_count == MAX_RETRIES + 1
+        assert self.sleep_m.call_count == MAX_RETRIES
+
+    @pytest.mark.parametrize("status", [400, 403, 404])
+    def test_no_retry(self, status):
+        self.request.execute.side_effect = self.http_error(status)
+
+        with pytest.raises(HttpError):
+            execute(self.request)
+
+        self.request.execute.assert_called_once_with()
+        self.sleep_m.assert_not_called()
@@ -1,35 +1,26 @@
-from pathlib import Path
 from unittest import mock
 
 import pytest
 
 from backup_to_cloud.exceptions import AutomaticEntryError, TokenError
+from backup_to_cloud.filelist import FileStat
 from backup_to_cloud.utils import (
-    SCOPES,
+    SNIFF_SIZE,
     ZIP_MIMETYPE,
-    gen_new_token,
-    get_creds_from_token,
-    get_google_drive_services,
     get_mimetype,
-    list_files,
     log,
+    sniff_mimetype,
 )
 
 
 def test_module_constants():
-    assert isinstance(SCOPES, list)
-    assert len(SCOPES) == 1
-    assert isinstance(SCOPES[0], str)
-    assert "googleapis" in SCOPES[0]
-
     assert isinstance(ZIP_MIMETYPE, str)
 
 
 class TestLog:
     @pytest.fixture(autouse=True)
     def mocks(self):
-        self.dt_m = mock.patch("backup_to_cloud.utils.datetime").start()
-        self.settings_m = mock.patch("backup_to_cloud.utils.settings").start()
+        self.writer_m = mock.patch("backup_to_cloud.utils.log_writer").start()
 
         yield
         mock.patch.stopall()
@@ -43,147 +34,13 @@ class TestLog:
 
     @pytest.mark.parametrize("exc", exceptions)
     def test_log(self, exc):
-        self.dt_m.now.return_value.strftime.return_value = "<datetime>"
         if exc:
             log(exc)
-            msg = "[<datetime>] ERROR: " + repr(exc)
+            self.writer_m.write.assert_called_once_with(repr(exc), error=True)
         else:
             log("this is %d%% %r important", 100, "really")
-            msg = "[<datetime>] this is 100% 'really' important"
-
-        self.dt_m.now.return_value.strftime.assert_called_once_with("%Y-%m-%d %H:%M:%S")
-        self.settings_m.log_path.open.assert_called_once_with("at", encoding="utf-8")
-        file_handler = self.settings_m.log_path.open.return_value
-        file_handler.__enter__.assert_called_once()
-        file_handler.__enter__.return_value.write.assert_called_once_with(msg + "\n")
-        file_handler.__exit__.assert_called_once()
-
-
-class TestGenNewToken:
-    @pytest.fixture(autouse=True)
-    def mocks(self):
-        secrets_path = "backup_to_cloud.utils.InstalledAppFlow.from_client_secrets_file"
-        self.fcsf_m = mock.patch(secrets_path).start()
-        self.pkl_dumps_m = mock.patch("backup_to_cloud.utils.pickle.dumps").start()
-        self.scopes_m = mock.patch("backup_to_cloud.utils.SCOPES").start()
-        self.settings_m = mock.patch("backup_to_cloud.utils.settings").start()
-
-        yield
-        mock.patch.stopall()
-
-    @pytest.mark.parametrize("exists", [True, False])
-    def test_gen_new_token(self, exists):
-        self.settings_m.credentials_path.exists.return_value = exists
-        self.settings_m.credentials_path.as_posix.return_value = "<creds-path>"
-
-        if not exists:
-            with pytest.raises(FileNotFoundError, match="<creds-path>"):
-                gen_new_token()
-            self.fcsf_m.assert_not_called()
-            return
-
-        gen_new_token()
-
-        self.fcsf_m.assert_called_once_with(
-            self.settings_m.credentials_path.as_posix.return_value, self.scopes_m
-        )
-        self.fcsf_m.return_value.run_local_server.assert_called_once_with(port=0)
-        flow = self.fcsf_m.return_value.run_local_server.return_value
-
-        self.pkl_dumps_m.assert_called_once_with(flow)
-        self.settings_m.token_path.write_bytes.assert_called_once_with(
-            self.pkl_dumps_m.return_value
-        )
-
-
-@pytest.mark.parametrize("creds", [None, "<creds>"])
-@mock.patch("backup_to_cloud.utils.get_creds_from_token")
-@mock.patch("backup_to_cloud.utils.build")
-def test_get_google_drive_services(build_m, gcft_m, creds):
-    get_google_drive_services(creds)
-
-    if not creds:
-        gcft_m.assert_called_once_with()
-        build_m.assert_called_once_with("drive", "v3", credentials=gcft_m.return_value)
-    else:
-        gcft_m.assert_not_called()
-        build_m.assert_called_once_with("drive", "v3", credentials="<creds>")
-
-
-class TestGetCredsFromToken:
-    @pytest.fixture(autouse=True)
-    def mocks(self):
-        self.settings_m = mock.patch("backup_to_cloud.utils.settings").start()
-        self.pkl_loads_m = mock.patch("backup_to_cloud.utils.pickle.loads").start()
-        self.pkl_dumps_m = mock.patch("backup_to_cloud.utils.pickle.dumps").start()
-        self.log_m = mock.patch("backup_to_cloud.utils.log").start()
-        self.req_m = mock.patch("backup_to_cloud.utils.Request").start()
-
-        self.settings_m.token_path.as_posix.return_value = "<token-path>"
-        self.settings_m.token_path.read_bytes.return_value = b"<pickle-data>"
-
-        yield
-
-        mock.patch.stopall()
-
-    @pytest.fixture(params=[True, False])
-    def valid(self, request):
-        return request.param
-
-    @pytest.fixture(params=[True, False])
-    def exists(self, request):
-        return request.param
-
-    @pytest.fixture(params=[True, False])
-    def expired(self, request):
-        return request.param
-
-    @pytest.fixture(params=[None, "<refresh-token>"])
-    def refresh_token(self, request):
-        return request.param
-
-    def test_get_creds_from_token(self, exists, valid, expired, refresh_token):
-        self.settings_m.token_path.exists.return_value = exists
-        self.pkl_loads_m.return_value.valid = valid
-        self.pkl_loads_m.return_value.expired = expired
-        self.pkl_loads_m.return_value.refresh_token = refresh_token
-
-        do_refresh = expired and bool(refresh_token) and not valid and exists
-        error = not valid and (not expired or not bool(refresh_token)) and exists
-
-        if not exists:
-            with pytest.raises(TokenError, match="'<token-path>' doesn't exist") as exc:
-                get_creds_from_token()
-
-            self.pkl_loads_m.assert_not_called()
-            self.pkl_dumps_m.assert_not_called()
-            self.log_m.assert_called_with(exc.value)
-            return
-
-        if error:
-            with pytest.raises(
-                TokenError, match="Invalid token: '<token-path>'"
-            ) as exc:
-                get_creds_from_token()
-
-            self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
-            self.pkl_dumps_m.assert_not_called()
-            self.log_m.assert_called_with(exc.value)
-            return
-
-        creds = get_creds_from_token()
-        assert creds == self.pkl_loads_m.return_value
-
-        self.pkl_loads_m.assert_called_once_with(b"<pickle-data>")
-
-        if do_refresh:
-            self.req_m.assert_called_once_with()
-            self.pkl_loads_m.return_value.refresh.assert_called_once_with(
-                self.req_m.return_value
-            )
-            self.pkl_dumps_m.assert_called_once_with(self.pkl_loads_m.return_value)
-            self.log_m.assert_called_once_with(
-                "Token updated (expires %s)", self.pkl_loads_m.return_value.expiry
+            self.writer_m.write.assert_called_once_with(
+                "this is 100% 'really' important"
             )
 
 
@@ -192,6 +49,9 @@ class TestMimeType:
     def mocks(self):
         self.path_m = mock.patch("backup_to_cloud.utils.Path").start()
         self.log_m = mock.patch("backup_to_cloud.utils.log").start()
+        self.cache_m = mock.patch("backup_to_cloud.utils.mimetype_cache").start()
+        mock.patch.dict("backup_to_cloud.utils._EXTENSION_CACHE", clear=True).start()
+        self.cache_m.get.return_value = None
 
         self.not_in_db_filename = "folder/filename.weird-extension"
         self.log_template = "Mimetype of %r is %r [%s]"
@@ -310,15 +170,25 @@ class TestMimeType:
         assert test("folder/file.yml") == "application/x-yaml"
         assert test("folder/file.zip") == "application/zip"
 
-        assert self.log_m.call_count == 56
+        # Each extension is logged only the first time
+        assert self.log_m.call_count == 55
         for call in self.log_m.call_args_list:
             assert call[0][3] == "database"
 
         self.path_m.assert_not_called()
 
+    def set_content(self, content):
+        file_handler = self.path_m.return_value.open.return_value.__enter__
+        file_handler.return_value.read.return_value = content
+
+    def assert_read(self):
+        self.path_m.return_value.open.assert_called_once_with("rb")
+        file_handler = self.path_m.return_value.open.return_value.__enter__
+        file_handler.return_value.read.assert_called_once_with(SNIFF_SIZE)
+
     def test_not_in_db_exists_text(self):
         self.path_m.return_value.is_file.return_value = True
-        self.path_m.return_value.read_bytes.return_value = "áéíóúñ€".encode()
+        self.set_content("áéíóúñ€".encode())
 
         mime_type = get_mimetype(self.not_in_db_filename)
         assert mime_type == "text/plain"
@@ -327,13 +197,11 @@ class TestMimeType:
         )
         self.path_m.assert_called_once_with(self.not_in_db_filename)
         self.path_m.return_value.is_file.assert_called_once_with()
-        self.path_m.return_value.read_bytes.assert_called_once_with()
+        self.assert_read()
 
     def test_not_in_db_exists_bytes(self):
         self.path_m.return_value.is_file.return_value = True
-        self.path_m.return_value.read_bytes.return_value = bytes.fromhex(
-            "02 05 06 07 a5"
-        )
+        self.set_content(bytes.fromhex("02 05 06 07 a5"))
 
         mime_type = get_mimetype(self.not_in_db_filename)
         assert mime_type == "application/octet-stream"
@@ -345,7 +213,53 @@ class TestMimeType:
         )
         self.path_m.assert_called_once_with(self.not_in_db_filename)
         self.path_m.return_value.is_file.assert_called_once_with()
-        self.path_m.return_value.read_bytes.assert_called_once_with()
+        self.assert_read()
+
+    def test_not_in_db_known_stat(self):
+        self.set_content(b"content")
+
+        mime_type = get_mimetype(self.not_in_db_filename, stat=FileStat(7, 0))
+        assert mime_type == "text/plain"
+        self.path_m.return_value.is_file.assert_not_called()
+        self.assert_read()
+        self.cache_m.get.assert_called_once_with(
+            self.not_in_db_filename, FileStat(7, 0)
+        )
+        self.cache_m.set.assert_called_once_with(
+            self.not_in_db_filename, FileStat(7, 0), "text/plain"
+        )
+
+    def test_not_in_db_cached(self):
+        self.cache_m.get.return_value = "<cached-mimetype>"
+
+        mime_type = get_mimetype(self.not_in_db_filename, stat=FileStat(7, 0))
+        assert mime_type == "<cached-mimetype>"
+        self.path_m.return_value.open.assert_not_called()
+        self.cache_m.set.assert_not_called()
+        self.log_m.assert_not_called()
+
+    def test_extension_cache(self):
+        assert get_mimetype("folder/a.pdf") == "application/pdf"
+        assert get_mimetype("other/b.pdf") == "application/pdf"
+        assert get_mimetype("folder/c.tar.gz") == "application/x-tar"
+        self.log_m.assert_any_call(
+            self.log_template, "folder/a.pdf", "application/pdf", "database"
+        )
+        assert self.log_m.call_count == 2
+
+    def test_not_in_db_magic_number(self):
+        self.path_m.return_value.is_file.return_value = True
+        self.set_content(b"SQLite format 3\x00" + bytes(100))
+
+        mime_type = get_mimetype(self.not_in_db_filename)
+        assert mime_type == "application/x-sqlite3"
+        self.log_m.assert_called_once_with(
+            self.log_template,
+            self.not_in_db_filename,
+            "application/x-sqlite3",
+            "magic number",
+        )
+        self.assert_read()
 
     def test_not_in_db_not_exists(self):
         self.path_m.return_value.is_file.return_value = False
@@ -360,44 +274,46 @@ class TestMimeType:
         )
         self.path_m.assert_called_once_with(self.not_in_db_filename)
         self.path_m.return_value.is_file.assert_called_once_with()
-        self.path_m.return_value.read_bytes.assert_not_called()
+        self.path_m.return_value.open.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "header,mime_type",
+    [
+        (b"SQLite format 3\x00\x10\x00", "application/x-sqlite3"),
+        (b"\x1f\x8b\x08\x00", "application/gzip"),
+        (b"\x28\xb5\x2f\xfd\x00", "application/zstd"),
+        (b"%PDF-1.4\n", "application/pdf"),
+        (b"\x7fELF\x02\x01", "application/x-executable"),
+        (b"\x89PNG\r\n\x1a\n\x00", "image/png"),
+        (b"PK\x03\x04\x14\x00", "application/zip"),
+        (bytes(257) + b"ustar\x0000", "application/x-tar"),
+    ],
+)
+def test_sniff_mimetype_magic_number(header, mime_type):
+    assert sniff_mimetype(header, False) == (mime_type, "magic number")
+    assert sniff_mimetype(header, True) == (mime_type, "magic number")
+
+
+@pytest.mark.parametrize(
+    "header,complete,mime_type",
+    [
+        (b"", True, "text/plain"),
+        (b"key = value\n", True, "text/plain"),
+        ("áéíóúñ€".encode(), True, "text/plain"),
+        ("€".encode()[:2], False, "text/plain"),
+        ("€".encode()[:2], True, "application/octet-stream"),
+        (b"text\x00with null", True, "application/octet-stream"),
+        (bytes.fromhex("02 05 06 07 a5"), False, "application/octet-stream"),
+    ],
+)
+def test_sniff_mimetype_content(header, complete, mime_type):
+    assert sniff_mimetype(header, complete)[0] == mime_type
 
 
-@mock.patch("backup_to_cloud.utils.walk")
-def test_list_files(walk_m):
-    walk_m.return_value = (
-        ("/home/test", ["index", "public"], []),
-        ("/home/test/index", ["a"], ["access.log", "error.log"]),
-        ("/home/test/index/a", ["x"], ["a.txt"]),
-        ("/home/test/index/a/x", [], ["file.txt", "file.pdf"]),
-        ("/home/test/public", [], ["access.log", "error.log"]),
-    )
+def test_get_mimetype_reads_header(tmp_path):
+    big_file = tmp_path / "dump"
+    big_file.write_bytes(b"a" * SNIFF_SIZE * 4 + b"\xff")
 
-    all_files = list_files("<root>", ".")
-    assert set(all_files) == {
-        Path("/home/test/index/a/a.txt"),
-        Path("/home/test/index/a/x/file.txt"),
-        Path("/home/test/index/a/x/file.pdf"),
-        Path("/home/test/index/access.log"),
-        Path("/home/test/index/error.log"),
-        Path("/home/test/public/access.log"),
-        Path("/home/test/public/error.log"),
-    }
-
-    log_files = list_files("<root>", ".log$")
-
-    assert set(log_files) == {
-        Path("/home/test/index/access.log"),
-        Path("/home/test/index/error.log"),
-        Path("/home/test/public/access.log"),
-        Path("/home/test/public/error.log"),
-    }
-
-    txt_files = list_files("<root>", ".txt$")
-    assert set(txt_files) == {
-        Path("/home/test/index/a/a.txt"),
-        Path("/home/test/index/a/x/file.txt"),
-    }
-
-    pdf_files = list_files("<root>", ".pdf$")
-    assert set(pdf_files) == {Path("/home/test/index/a/x/file.pdf")}
+    with mock.patch("backup_to_cloud.utils.log"):
+        assert get_mimetype(big_file.as_posix()) == "text/plain"
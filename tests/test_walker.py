@@ -0,0 +1,251 @@
+import os
+from pathlib import Path
+from time import time
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.automatic import BackupEntry
+from backup_to_cloud.exceptions import AutomaticEntryError
+from backup_to_cloud.walker import (
+    WalkStats,
+    WalkTarget,
+    iter_matches,
+    iter_target,
+    list_files,
+    plan_walks,
+    scan_tree,
+    walk_entries,
+    walk_targets,
+)
+
+
+class TestWalkTarget:
+    def test_contains(self):
+        target = WalkTarget("/srv/data", ".")
+        assert target.contains("/srv/data")
+        assert target.contains("/srv/data/logs")
+        assert not target.contains("/srv/data-old")
+        assert not target.contains("/srv")
+
+    def test_repr(self):
+        target = WalkTarget("/srv/data", ".log$")
+        assert repr(target) == "WalkTarget(root='/srv/data', filter='.log$')"
+
+
+def test_plan_walks():
+    targets = [
+        WalkTarget("/srv/a", "."),
+        WalkTarget("/srv-x", "."),
+        WalkTarget("/srv", ".pdf$"),
+        WalkTarget("/home/user", "."),
+        WalkTarget("/srv/a/b", "."),
+        WalkTarget("/srv", ".log$"),
+    ]
+
+    plan = plan_walks(targets)
+    assert [root for root, _ in plan] == ["/home/user", "/srv", "/srv-x"]
+    assert plan[0][1] == [targets[3]]
+    assert plan[1][1] == [targets[2], targets[5], targets[0], targets[4]]
+    assert plan[2][1] == [targets[1]]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for relpath in ("a/x.log", "a/y.txt", "a/b/z.log", "c/w.log"):
+        tmp_path.joinpath(relpath).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(relpath).write_text(relpath)
+    yield tmp_path
+
+
+def test_scan_tree(tree):
+    tree.joinpath("link").symlink_to(tree / "a", target_is_directory=True)
+    root = tree.as_posix()
+
+    result = {
+        Path(dirpath).as_posix(): sorted(x.name for x in files)
+        for dirpath, files in scan_tree(root)
+    }
+    assert result == {
+        root: [],
+        root + "/a": ["x.log", "y.txt"],
+        root + "/a/b": ["z.log"],
+        root + "/c": ["w.log"],
+    }
+    assert list(scan_tree(root + "/missing")) == []
+
+
+def test_walk_targets(tree):
+    root = tree.as_posix()
+    outer = WalkTarget(root, ".log$")
+    inner = WalkTarget(root + "/a", ".")
+
+    walk_targets(root, [outer, inner])
+
+    assert list(outer.files.iter_posix()) == [
+        root + "/a/x.log",
+        root + "/a/b/z.log",
+        root + "/c/w.log",
+    ]
+    assert list(inner.files.iter_posix()) == [
+        root + "/a/x.log",
+        root + "/a/y.txt",
+        root + "/a/b/z.log",
+    ]
+    assert outer.files.stat(0).size == len("a/x.log")
+    assert outer.files.total_size() == len("a/x.log" + "a/b/z.log" + "c/w.log")
+
+
+def test_walk_targets_predicates(tree):
+    root = tree.as_posix()
+    old = time() - 10 * 86400
+    os.utime(tree / "a/x.log", (old, old))
+    tree.joinpath("c/w.log").write_text("w" * 100)
+
+    small = WalkTarget(root, ".", max_size=7)
+    big = WalkTarget(root, ".", min_size=50)
+    new = WalkTarget(root, ".log$", newer_than=86400)
+    aged = WalkTarget(root, ".", older_than=86400)
+    mine = WalkTarget(root, ".log$", owner=str(os.getuid()))
+    other = WalkTarget(root, ".", owner=str(os.getuid() + 1))
+
+    with mock.patch("backup_to_cloud.walker.scandir", wraps=os.scandir) as scandir_m:
+        walk_targets(root, [small, big, new, aged, mine, other])
+
+    assert scandir_m.call_count == 4
+    assert [x.name for x in small.files] == ["x.log", "y.txt"]
+    assert [x.name for x in big.files] == ["w.log"]
+    assert [x.name for x in new.files] == ["z.log", "w.log"]
+    assert [x.name for x in aged.files] == ["x.log"]
+    assert [x.name for x in mine.files] == ["x.log", "z.log", "w.log"]
+    assert not other.files
+
+
+def test_walk_target_owner():
+    with mock.patch("backup_to_cloud.walker.getpwnam") as getpwnam_m:
+        getpwnam_m.return_value.pw_uid = 1000
+        assert WalkTarget("/srv", ".", owner="user").uid == 1000
+        getpwnam_m.assert_called_once_with("user")
+
+        getpwnam_m.side_effect = KeyError("user")
+        with pytest.raises(AutomaticEntryError, match="Unknown owner: 'user'"):
+            WalkTarget("/srv", ".", owner="user")
+
+
+def test_walk_entries(tree):
+    root = tree.as_posix()
+    entries = [
+        BackupEntry("logs", "multiple-files", root, filter=".log$"),
+        BackupEntry("a", "multiple-files", root + "/a", min_size="8"),
+        BackupEntry("missing", "multiple-files", root + "/missing"),
+    ]
+
+    with mock.patch("backup_to_cloud.walker.scandir", wraps=os.scandir) as scandir_m:
+        result = walk_entries(entries)
+
+    assert scandir_m.call_count == 4
+    scandir_m.assert_any_call(root)
+    assert list(result["logs"].iter_posix()) == [
+        root + "/a/x.log",
+        root + "/a/b/z.log",
+        root + "/c/w.log",
+    ]
+    assert list(result["a"].iter_posix()) == [root + "/a/b/z.log"]
+    assert not result["missing"]
+
+
+def test_walk_entries_symlink(tree, tmp_path_factory):
+    data = tmp_path_factory.mktemp("data")
+    data.joinpath("f.txt").write_text("f")
+    tree.joinpath("c", "link").symlink_to(data, target_is_directory=True)
+    root = tree.as_posix()
+    entries = [
+        BackupEntry("outer", "multiple-files", root),
+        BackupEntry("inner", "multiple-files", root + "/c/link"),
+        BackupEntry("deeper", "multiple-files", root + "/c/link/sub"),
+        BackupEntry("c", "multiple-files", root + "/c"),
+    ]
+
+    # The walk of the outer root doesn't follow the symlink.
+    plan = plan_walks(WalkTarget.from_entry(x) for x in entries)
+    assert [(x, [y.root for y in group]) for x, group in plan] == [
+        (root, [root, root + "/c"]),
+        (root + "/c/link", [root + "/c/link", root + "/c/link/sub"]),
+    ]
+
+    result = walk_entries(entries)
+    assert list(result["inner"].iter_posix()) == [root + "/c/link/f.txt"]
+    assert list(result["c"].iter_posix()) == [root + "/c/w.log"]
+    assert root + "/c/link/f.txt" not in list(result["outer"].iter_posix())
+
+
+def test_walk_entries_overlapping_only(tree):
+    root = tree.as_posix()
+    entries = [
+        BackupEntry("a", "multiple-files", root + "/a", filter=".log$"),
+        BackupEntry("b", "multiple-files", root + "/a/b"),
+        BackupEntry("c", "multiple-files", root + "/c"),
+    ]
+
+    with mock.patch("backup_to_cloud.walker.scandir", wraps=os.scandir) as scandir_m:
+        result = walk_entries(entries, overlapping_only=True)
+
+    assert scandir_m.call_count == 2
+    assert sorted(result) == ["a", "b"]
+    assert list(result["b"].iter_posix()) == [root + "/a/b/z.log"]
+
+
+def test_list_files(tree):
+    root = tree.as_posix()
+
+    all_files = list_files(root, ".")
+    assert set(all_files) == {
+        Path(root + "/a/x.log"),
+        Path(root + "/a/y.txt"),
+        Path(root + "/a/b/z.log"),
+        Path(root + "/c/w.log"),
+    }
+
+    log_files = list_files(root, ".log$")
+    assert set(log_files) == {
+        Path(root + "/a/x.log"),
+        Path(root + "/a/b/z.log"),
+        Path(root + "/c/w.log"),
+    }
+
+    txt_files = list_files(root + "/a", "a.+.txt$")
+    assert set(txt_files) == {Path(root + "/a/y.txt")}
+
+
+def test_iter_matches(tree):
+    root = tree.as_posix()
+    stats = WalkStats()
+
+    matches = iter_matches(root, ".log$", stats)
+    assert next(matches) == (root + "/a/x.log", mock.ANY)
+    assert stats.dirs == 2
+    assert stats.matched == 1
+
+    rest = list(matches)
+    assert [x[0] for x in rest] == [root + "/a/b/z.log", root + "/c/w.log"]
+    assert rest[0][1].size == len("a/b/z.log")
+    assert stats.dirs == 4
+    assert stats.files == 4
+    assert stats.matched == 3
+    assert stats.bytes == len("a/x.log" + "a/b/z.log" + "c/w.log")
+    assert stats.elapsed > 0
+    assert repr(stats) == "WalkStats(dirs=4, files=4, matched=3, bytes=23)"
+
+
+def test_iter_target(tree):
+    root = tree.as_posix()
+    stats = WalkStats()
+    target = WalkTarget(root, ".", min_size=8)
+
+    matches = list(iter_target(target, stats))
+
+    assert [x[0] for x in matches] == [root + "/a/b/z.log"]
+    assert matches[0][1].size == 9
+    assert stats.matched == 1
+    assert stats.files == 4
+    assert not target.files
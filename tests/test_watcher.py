@@ -0,0 +1,190 @@
+import sys
+from threading import Thread
+from unittest import mock
+
+import pytest
+
+from backup_to_cloud.automatic import BackupEntry
+from backup_to_cloud.watcher import (
+    IN_CLOSE_WRITE,
+    IN_Q_OVERFLOW,
+    Inotify,
+    Watcher,
+)
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is only available on Linux"
+)
+
+
+def test_inotify(tmp_path):
+    inotify = Inotify()
+    try:
+        wd = inotify.add_watch(tmp_path.as_posix())
+        assert inotify.read(0) == []
+
+        tmp_path.joinpath("file.txt").write_text("data")
+        events = inotify.read(1)
+        assert (wd, IN_CLOSE_WRITE, "file.txt") in events
+
+        with pytest.raises(FileNotFoundError):
+            inotify.add_watch(tmp_path.joinpath("missing").as_posix())
+        with pytest.raises(NotADirectoryError):
+            inotify.add_watch(tmp_path.joinpath("file.txt").as_posix())
+    finally:
+        inotify.close()
+        inotify.close()
+
+
+@mock.patch("backup_to_cloud.watcher.sys")
+def test_inotify_not_linux(sys_m):
+    sys_m.platform = "win32"
+    with pytest.raises(OSError, match="only available on Linux"):
+        Inotify()
+
+
+class TestWatcher:
+    @pytest.fixture(autouse=True)
+    def mocks(self, tmp_path):
+        self.create_backup_m = mock.patch(
+            "backup_to_cloud.watcher.create_backup"
+        ).start()
+        self.backup_files_m = mock.patch("backup_to_cloud.watcher.backup_files").start()
+        self.log_m = mock.patch("backup_to_cloud.watcher.log").start()
+        self.cache_m = mock.patch("backup_to_cloud.watcher.mimetype_cache").start()
+        self.journal_m = mock.patch("backup_to_cloud.watcher.upload_journal").start()
+        self.writer_m = mock.patch("backup_to_cloud.watcher.log_writer").start()
+
+        self.root = tmp_path
+        tmp_path.joinpath("files", "sub").mkdir(parents=True)
+        tmp_path.joinpath("zipped").mkdir()
+        tmp_path.joinpath("single.txt").write_text("v1")
+        self.entries = [
+            BackupEntry("files", "multiple-files", str(tmp_path / "files")),
+            BackupEntry("zipped", "multiple-files", str(tmp_path / "zipped"), zip=True),
+            BackupEntry("single", "single-file", str(tmp_path / "single.txt")),
+        ]
+        self.watcher = Watcher(self.entries, debounce=0.05)
+
+        yield
+
+        self.watcher.close()
+        mock.patch.stopall()
+
+    def poll(self):
+        while self.watcher.poll(0.2):
+            pass
+
+    def test_watched_dirs(self):
+        assert sorted(self.watcher.dirs.values()) == [
+            self.root.as_posix(),
+            (self.root / "files").as_posix(),
+            (self.root / "files" / "sub").as_posix(),
+            (self.root / "zipped").as_posix(),
+        ]
+
+    def test_changes(self):
+        self.root.joinpath("files", "sub", "a.txt").write_text("a")
+        self.root.joinpath("files", "sub", "a.txt").write_text("a2")
+        self.root.joinpath("files", "new", "deep").mkdir(parents=True)
+        self.root.joinpath("files", "new", "deep", "b.txt").write_text("b")
+        self.root.joinpath("zipped", "c.txt").write_text("c")
+        self.root.joinpath("single.txt").write_text("v2")
+        self.root.joinpath("other.txt").write_text("other")
+        self.poll()
+
+        files = self.root.joinpath("files").as_posix()
+        assert self.watcher.changed == {
+            "files": {f"{files}/sub/a.txt", f"{files}/new/deep/b.txt"}
+        }
+        assert self.watcher.rebuild == {"zipped", "single"}
+        assert f"{files}/new/deep" in self.watcher.dirs.values()
+
+    def test_deletions(self):
+        self.root.joinpath("files", "a.txt").write_text("a")
+        self.root.joinpath("zipped", "sub").mkdir()
+        self.poll()
+        self.watcher.flush()
+
+        self.root.joinpath("files", "a.txt").unlink()
+        self.root.joinpath("files", "sub").rename(self.root / "moved")
+        self.root.joinpath("single.txt").unlink()
+        self.poll()
+
+        assert self.watcher.changed == {}
+        assert self.watcher.rebuild == set()
+        assert (
+            self.root / "files" / "sub"
+        ).as_posix() not in self.watcher.dirs.values()
+
+        self.root.joinpath("zipped", "sub").rmdir()
+        self.poll()
+        assert self.watcher.rebuild == {"zipped"}
+
+    def test_overflow(self):
+        self.watcher.handle_event(-1, IN_Q_OVERFLOW, "")
+        assert self.watcher.rebuild == {"files", "zipped", "single"}
+        self.log_m.assert_called_once_with(
+            "Inotify events lost, backing up every entry"
+        )
+
+    def test_unknown_wd(self):
+        self.watcher.handle_event(12345, IN_CLOSE_WRITE, "file.txt")
+        assert self.watcher.get_timeout() == 1
+
+    def test_get_timeout(self):
+        watcher = Watcher([], debounce=2, max_delay=10)
+        watcher._first_change = 100
+        watcher._last_change = 105
+
+        assert watcher.get_timeout(106) == 1
+        assert watcher.get_timeout(109) == 0
+        watcher._last_change = 109
+        assert watcher.get_timeout(109.5) == 0.5
+        watcher.close()
+
+    def test_flush(self):
+        path = (self.root / "files" / "a.txt").as_posix()
+        self.watcher.changed = {"files": {path}, "zipped": {"<path>"}}
+        self.watcher.rebuild = {"zipped", "single"}
+        self.backup_files_m.return_value = 1
+
+        self.watcher.flush()
+
+        self.create_backup_m.assert_called_once_with(["single", "zipped"])
+        self.backup_files_m.assert_called_once_with(self.entries[0], {path})
+        self.log_m.assert_called_with(
+            "Backed up %d changed files of entry %r", 1, "files"
+        )
+        self.cache_m.save.assert_called_once_with()
+        self.journal_m.compact.assert_called_once_with()
+        self.writer_m.flush.assert_called_once_with()
+        assert not self.watcher.changed and not self.watcher.rebuild
+        assert self.watcher.get_timeout() == 1
+
+    def test_flush_errors(self):
+        self.watcher.changed = {"files": {"<path>"}}
+        self.watcher.rebuild = {"single"}
+        exc1, exc2 = FileNotFoundError("<single>"), OSError("<files>")
+        self.create_backup_m.side_effect = exc1
+        self.backup_files_m.side_effect = exc2
+
+        self.watcher.flush()
+
+        self.log_m.assert_any_call(exc1)
+        self.log_m.assert_called_with(exc2)
+
+    def test_run(self):
+        def flush():
+            self.watcher.rebuild = set()
+            self.watcher._first_change = None
+            self.watcher.stop()
+
+        with mock.patch.object(self.watcher, "flush", side_effect=flush) as flush_m:
+            thread = Thread(target=self.watcher.run)
+            thread.start()
+            self.root.joinpath("single.txt").write_text("v2")
+            thread.join(5)
+
+        assert not thread.is_alive()
+        flush_m.assert_called_once_with()